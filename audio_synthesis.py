@@ -1,106 +1,303 @@
+import base64
+import io
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 import os
 import json
+from botocore.config import Config
 from dotenv import load_dotenv
 from pydub import AudioSegment
 
+from utils.forced_alignment import align_audio
+from utils.request_scheduler import get_scheduler
+from utils.response_cache import ResponseCache, make_cache_key
+
 load_dotenv()
 
 
-def text_to_audio(
-        text,
-        audio_path="results/output_audio.mp3",
-        wav_audio_path="results/output_audio.wav"
-):
-    polly_client = boto3.Session(
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name='us-east-1'
-    ).client('polly')
+POLLY_VOICE_ID = 'Gregory'
+POLLY_ENGINE = 'neural'
+# Polly rejects SynthesizeSpeech requests above 3000 billed characters
+POLLY_MAX_CHARS = int(os.getenv('POLLY_MAX_CHARS', 3000))
+POLLY_MAX_WORKERS = int(os.getenv('POLLY_MAX_WORKERS', 8))
+# with the speech cache on every sentence is synthesized and cached on its own, so an edited script only pays for
+# the changed sentences, packing them into as few requests as possible keeps Polly's prosody across sentences instead
+POLLY_PACK_CACHED_SENTENCES = os.getenv('POLLY_PACK_CACHED_SENTENCES', '').lower() in ('1', 'true', 'yes')
+# 'polly' asks Polly for speech marks, 'vosk' aligns the synthesized audio locally against the script
+WORD_TIMINGS = os.getenv('WORD_TIMINGS', 'polly')
+WORD_TIMING_BACKENDS = ('polly', 'vosk')
+SPEECH_MARK_TYPES = ['word', 'sentence']
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+# a period after these does not end the sentence, neither does one in an initialism like "U.S." or "Jensen H. Huang"
+ABBREVIATIONS = {'inc', 'corp', 'co', 'ltd', 'plc', 'llc', 'mr', 'mrs', 'ms', 'dr', 'st', 'jr', 'sr', 'vs',
+                 'approx', 'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep', 'sept', 'oct', 'nov', 'dec'}
+INITIALISM = re.compile(r'(?:\b[A-Za-z]\.){2,}$|\b[A-Z]\.$')
+
+_polly_client = None
+_polly_client_lock = threading.Lock()
+_tts_cache = None
+
+
+def get_polly_client():
+    # one client for the process, boto3 clients are thread safe and the connection pool is sized for
+    # the audio and speech mark requests of every chunk in flight at once
+    global _polly_client
+    with _polly_client_lock:
+        if _polly_client is None:
+            _polly_client = boto3.Session(
+                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                region_name='us-east-1'
+            ).client('polly', endpoint_url=os.getenv('POLLY_ENDPOINT_URL') or None,
+                     config=Config(max_pool_connections=POLLY_MAX_WORKERS * 2,
+                                   # throttling is retried by the request scheduler instead
+                                   retries={'total_max_attempts': 1}))
+        return _polly_client
+
+
+def get_tts_cache():
+    global _tts_cache
+    if os.getenv('TTS_CACHE_DISABLED', '').lower() in ('1', 'true', 'yes'):
+        return None
+    if _tts_cache is None:
+        _tts_cache = ResponseCache(
+            path=os.getenv('TTS_CACHE_PATH', 'temp/cache/tts.sqlite'),
+            ttl_seconds=float(os.getenv('TTS_CACHE_TTL_SECONDS', 30 * 24 * 60 * 60)),
+            max_entries=int(os.getenv('TTS_CACHE_MAX_ENTRIES', 20000)),
+        )
+    return _tts_cache
+
+
+def get_tts_cache_key(text, speech_mark_types=SPEECH_MARK_TYPES):
+    return make_cache_key("polly", text, POLLY_VOICE_ID, POLLY_ENGINE, 'mp3', speech_mark_types)
 
-    response_audio = polly_client.synthesize_speech(
+
+def get_cached_chunk(tts_cache, text, speech_mark_types=SPEECH_MARK_TYPES):
+    value = tts_cache.get(get_tts_cache_key(text, speech_mark_types)) if tts_cache else None
+    if value is None:
+        return None
+    try:
+        item = json.loads(value)
+        return base64.b64decode(item['audio']), item['speech_marks']
+    except Exception as e:
+        print(f"Error reading cached speech for '{text[:40]}': {e}")
+        return None
+
+
+def store_cached_chunk(tts_cache, text, audio_bytes, speech_marks, speech_mark_types=SPEECH_MARK_TYPES):
+    if tts_cache:
+        tts_cache.set(get_tts_cache_key(text, speech_mark_types), json.dumps({
+            "audio": base64.b64encode(audio_bytes).decode('ascii'),
+            "speech_marks": speech_marks,
+        }))
+
+
+def is_sentence_end(text, next_text):
+    if next_text[:1].islower():
+        return False
+    if INITIALISM.search(text):
+        return False
+    last_word = text.rsplit(None, 1)[-1] if text.strip() else ""
+    return last_word.rstrip('.').lower() not in ABBREVIATIONS or not last_word.endswith('.')
+
+
+def split_sentences(text):
+    # like SENTENCE_BOUNDARY.split, the last part is whatever follows the last boundary, but "NVIDIA Corp. said",
+    # "the U.S. market" and "up 5 p.m. today" stay in one sentence
+    parts = []
+    start = 0
+    for boundary in SENTENCE_BOUNDARY.finditer(text):
+        if is_sentence_end(text[start:boundary.start()], text[boundary.end():]):
+            parts.append(text[start:boundary.start()])
+            start = boundary.end()
+    parts.append(text[start:])
+    return parts
+
+
+def split_text_into_chunks(text, max_chars=POLLY_MAX_CHARS, pack=True):
+    # chunks end on sentence boundaries, a single sentence longer than the limit is split between words,
+    # without pack every sentence is its own chunk
+    chunks = []
+    current = ""
+    for sentence in split_sentences(text.strip()):
+        pieces = [sentence]
+        if len(sentence) > max_chars:
+            pieces = []
+            for word in sentence.split():
+                if pieces and len(pieces[-1]) + 1 + len(word) <= max_chars:
+                    pieces[-1] += " " + word
+                else:
+                    pieces.append(word[:max_chars])
+        for piece in pieces:
+            if current and pack and len(current) + 1 + len(piece) <= max_chars:
+                current += " " + piece
+            else:
+                if current:
+                    chunks.append(current)
+                current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def synthesize_audio(polly_client, text):
+    response_audio = get_scheduler("polly").call(
+        polly_client.synthesize_speech,
         Text=text,
         OutputFormat='mp3',
-        VoiceId='Gregory',
-        Engine='neural',
+        VoiceId=POLLY_VOICE_ID,
+        Engine=POLLY_ENGINE,
         # TextType='ssml'
     )
-
-    if "AudioStream" in response_audio:
-        with open(audio_path, 'wb') as file:
-            file.write(response_audio['AudioStream'].read())
-    else:
+    if "AudioStream" not in response_audio:
         raise Exception("Could not stream audio")
+    return response_audio['AudioStream'].read()
 
-    audio_segment = AudioSegment.from_mp3(audio_path)
-    audio_segment.export(wav_audio_path, format="wav")
 
-    audio_duration_ms = len(audio_segment)
-
-    response_marks = polly_client.synthesize_speech(
+def synthesize_speech_marks(polly_client, text):
+    response_marks = get_scheduler("polly").call(
+        polly_client.synthesize_speech,
         Text=text,
         OutputFormat='json',
-        SpeechMarkTypes=['word', 'sentence'],
-        VoiceId='Gregory',
-        Engine='neural',
+        SpeechMarkTypes=SPEECH_MARK_TYPES,
+        VoiceId=POLLY_VOICE_ID,
+        Engine=POLLY_ENGINE,
         # TextType='ssml'
     )
+    if 'AudioStream' not in response_marks:
+        raise Exception("Could not retrieve speech marks")
+    speech_marks_data = response_marks['AudioStream'].read().decode('utf-8').split('\n')
+    return [json.loads(mark) for mark in speech_marks_data if mark.strip()]
 
-    if 'AudioStream' in response_marks:
-        speech_marks_data = response_marks['AudioStream'].read().decode('utf-8').split('\n')
-        speech_marks = []
 
-        for mark in speech_marks_data:
-            if mark.strip():
-                speech_marks.append(json.loads(mark))
+def build_sentences(speech_marks, audio_duration_ms, offset_ms=0):
+    list_of_sentences = []
+    current_sentence = None
+    current_words_in_sentence = []
 
-        list_of_sentences = []
-        current_sentence = None
-        current_words_in_sentence = []
+    for mark in speech_marks:
+        mark_time = mark['time'] + offset_ms
+        if mark['type'] == 'sentence':
 
-        for i, mark in enumerate(speech_marks):
-            if mark['type'] == 'sentence':
+            if current_sentence is not None:
 
-                if current_sentence is not None:
+                current_sentence['end'] = mark_time
 
-                    current_sentence['end'] = mark['time']
+                if current_words_in_sentence:
+                    current_words_in_sentence[-1]['end'] = mark_time
+                current_sentence['words_in_sentence'] = current_words_in_sentence
+                list_of_sentences.append(current_sentence)
 
-                    if current_words_in_sentence:
-                        current_words_in_sentence[-1]['end'] = mark['time']
-                    current_sentence['words_in_sentence'] = current_words_in_sentence
-                    list_of_sentences.append(current_sentence)
+            current_sentence = {
+                "sentence": mark['value'],
+                "start": mark_time,
 
-                current_sentence = {
-                    "sentence": mark['value'],
-                    "start": mark['time'],
+            }
+            current_words_in_sentence = []
+        elif mark['type'] == 'word':
 
-                }
-                current_words_in_sentence = []
-            elif mark['type'] == 'word':
+            word_dict = {
+                "word": mark['value'],
+                "start": mark_time,
 
-                word_dict = {
-                    "word": mark['value'],
-                    "start": mark['time'],
+            }
 
-                }
+            if current_words_in_sentence:
+                current_words_in_sentence[-1]['end'] = mark_time
+            current_words_in_sentence.append(word_dict)
 
-                if current_words_in_sentence:
-                    current_words_in_sentence[-1]['end'] = mark['time']
-                current_words_in_sentence.append(word_dict)
+    if current_sentence is not None:
 
-        if current_sentence is not None:
+        if current_words_in_sentence:
+            current_words_in_sentence[-1]['end'] = offset_ms + audio_duration_ms
 
-            if current_words_in_sentence:
-                current_words_in_sentence[-1]['end'] = audio_duration_ms
+        current_sentence['end'] = offset_ms + audio_duration_ms
+        current_sentence['words_in_sentence'] = current_words_in_sentence
+        list_of_sentences.append(current_sentence)
+
+    return list_of_sentences
 
-            current_sentence['end'] = audio_duration_ms
-            current_sentence['words_in_sentence'] = current_words_in_sentence
-            list_of_sentences.append(current_sentence)
 
-        return list_of_sentences
+def text_to_audio(
+        text,
+        audio_path="results/output_audio.mp3",
+        wav_audio_path=None,
+        polly_client=None,
+        max_workers=POLLY_MAX_WORKERS,
+        tts_cache=None,
+        word_timings=WORD_TIMINGS
+):
+    list_of_sentences, _ = synthesize_text(text, audio_path, wav_audio_path, polly_client, max_workers, tts_cache,
+                                           word_timings)
+    return list_of_sentences
 
+
+def synthesize_text(
+        text,
+        audio_path="results/output_audio.mp3",
+        wav_audio_path=None,
+        polly_client=None,
+        max_workers=POLLY_MAX_WORKERS,
+        tts_cache=None,
+        word_timings=WORD_TIMINGS
+):
+    if word_timings not in WORD_TIMING_BACKENDS:
+        raise ValueError(f"Unknown word timing backend '{word_timings}', expected one of {WORD_TIMING_BACKENDS}")
+    # with local alignment only the audio is requested from Polly
+    speech_mark_types = SPEECH_MARK_TYPES if word_timings == 'polly' else []
+    # returns the sentences and the decoded audio, so later stages reuse the PCM instead of decoding the mp3 again
+    tts_cache = tts_cache or get_tts_cache()
+    chunks = split_text_into_chunks(text, pack=not tts_cache or POLLY_PACK_CACHED_SENTENCES)
+    if not chunks:
+        raise ValueError("No text to synthesize")
+
+    cached_chunks = [get_cached_chunk(tts_cache, chunk, speech_mark_types) for chunk in chunks]
+    missing = [i for i, cached in enumerate(cached_chunks) if cached is None]
+    if tts_cache:
+        logging.info(f"Speech cache: {len(chunks) - len(missing)}/{len(chunks)} chunks reused.")
+
+    audio_chunks = [cached[0] if cached else None for cached in cached_chunks]
+    speech_marks_chunks = [cached[1] if cached else None for cached in cached_chunks]
+    if missing:
+        polly_client = polly_client or get_polly_client()
+        # the audio and speech mark requests of every chunk are independent, so they all run at once
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, 2 * len(missing)))) as executor:
+            audio_futures = [executor.submit(synthesize_audio, polly_client, chunks[i]) for i in missing]
+            marks_futures = [executor.submit(synthesize_speech_marks, polly_client, chunks[i]) if speech_mark_types
+                             else None for i in missing]
+            for i, audio_future, marks_future in zip(missing, audio_futures, marks_futures):
+                audio_chunks[i] = audio_future.result()
+                speech_marks_chunks[i] = marks_future.result() if marks_future else None
+                store_cached_chunk(tts_cache, chunks[i], audio_chunks[i], speech_marks_chunks[i], speech_mark_types)
+
+    # each chunk's marks start at 0, so they are shifted by the decoded length of the audio before them
+    audio_segments = [AudioSegment.from_file(io.BytesIO(audio_bytes), format="mp3") for audio_bytes in audio_chunks]
+    list_of_sentences = []
+    offset_ms = 0
+    for audio_segment, speech_marks in zip(audio_segments, speech_marks_chunks):
+        if speech_marks is not None:
+            list_of_sentences += build_sentences(speech_marks, len(audio_segment), offset_ms)
+        offset_ms += len(audio_segment)
+
+    if len(audio_chunks) == 1:
+        with open(audio_path, 'wb') as file:
+            file.write(audio_chunks[0])
+        audio_segment = audio_segments[0]
     else:
-        raise Exception("Could not retrieve speech marks")
+        audio_segment = sum(audio_segments[1:], audio_segments[0])
+        audio_segment.export(audio_path, format="mp3")
+    if wav_audio_path:
+        audio_segment.export(wav_audio_path, format="wav")
+
+    if word_timings == 'vosk':
+        speech_marks = align_audio(audio_segment, split_text_into_chunks(text, pack=False))
+        list_of_sentences = build_sentences(speech_marks, len(audio_segment))
+
+    return list_of_sentences, audio_segment
 
 # Example usage
 # if __name__ == "__main__":
@@ -0,0 +1,113 @@
+import argparse
+import datetime
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from create_content import create_contents
+from main import prepare_audio_and_videos, render_video
+from utils.consts import MARKET_TIME_ZONE
+from utils.open_ai import get_openai_client, get_response_cache
+from utils.request_scheduler import log_scheduler_stats
+from utils.utils import clean_text, setup_logging
+from video_creation import RENDER_BACKENDS
+
+setup_logging()
+
+AUDIO_MAX_WORKERS = 8
+
+
+def read_watchlist(path) -> dict:
+    # one ticker per line, optionally followed by a comma and the company name: "NVDA,NVIDIA Corporation"
+    companies_by_symbol = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            symbol, _, company_name = line.partition(',')
+            symbol = symbol.strip().upper()
+            companies_by_symbol[symbol] = company_name.strip() or symbol
+    return companies_by_symbol
+
+
+def prepare_ticker(symbol, text, client):
+    results_dir = f"results/{symbol}"
+    os.makedirs(results_dir, exist_ok=True)
+    audio_path, sentences_list_with_timings, audio_segment = prepare_audio_and_videos(clean_text(text), results_dir,
+                                                                                      client)
+    return audio_path, f"{results_dir}/output_video.mp4", sentences_list_with_timings, audio_segment
+
+
+def run_batch(companies_by_symbol: dict, use_temp_file=True, mock_data_input_now=None, render_workers=None,
+              render_backend="moviepy") -> dict:
+    start_time = time.time()
+    status_by_symbol = {}
+
+    texts_by_symbol = create_contents(companies_by_symbol, use_temp_file, mock_data_input_now)
+    for symbol, text in texts_by_symbol.items():
+        if isinstance(text, Exception) or not text:
+            status_by_symbol[symbol] = f"content failed: {text}"
+    logging.info(f"Content created for {len(texts_by_symbol) - len(status_by_symbol)}/{len(texts_by_symbol)} "
+                 f"tickers in {time.time() - start_time:.2f} seconds.")
+
+    client = get_openai_client()
+    render_jobs = {}
+    with ThreadPoolExecutor(max_workers=AUDIO_MAX_WORKERS) as executor:
+        futures = {symbol: executor.submit(prepare_ticker, symbol, text, client)
+                   for symbol, text in texts_by_symbol.items() if symbol not in status_by_symbol}
+        for symbol, future in futures.items():
+            try:
+                render_jobs[symbol] = future.result()
+            except Exception as e:
+                logging.exception(f"Failed to prepare audio for {symbol}: {e}")
+                status_by_symbol[symbol] = f"audio failed: {e}"
+
+    with ProcessPoolExecutor(max_workers=render_workers or os.cpu_count()) as executor:
+        # the decoded PCM travels with the job, so render processes do not decode the mp3 again
+        futures = {symbol: executor.submit(render_video, audio_path, video_path, sentences_list_with_timings,
+                                           render_backend, audio_segment=audio_segment)
+                   for symbol, (audio_path, video_path, sentences_list_with_timings, audio_segment)
+                   in render_jobs.items()}
+        for symbol, future in futures.items():
+            try:
+                status_by_symbol[symbol] = f"rendered {', '.join(future.result())}"
+            except Exception as e:
+                logging.exception(f"Failed to render video for {symbol}: {e}")
+                status_by_symbol[symbol] = f"render failed: {e}"
+
+    for symbol in companies_by_symbol:
+        logging.info(f"{symbol}: {status_by_symbol.get(symbol)}")
+    logging.info(f"Batch of {len(companies_by_symbol)} tickers finished in {time.time() - start_time:.2f} seconds.")
+    return status_by_symbol
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create opening briefings for a watchlist of tickers.")
+    parser.add_argument("symbols", nargs="*", help="Ticker symbols, e.g. NVDA AAPL MSFT")
+    parser.add_argument("--watchlist", help="File with one ticker per line, optionally 'SYMBOL,Company Name'")
+    parser.add_argument("--render-workers", type=int, default=None, help="Render processes, defaults to CPU count")
+    parser.add_argument("--no-temp-file", action="store_true", help="Ignore cached stock info in temp/")
+    parser.add_argument("--render-backend", choices=RENDER_BACKENDS, default="moviepy")
+    args = parser.parse_args()
+
+    companies_by_symbol = read_watchlist(args.watchlist) if args.watchlist else {}
+    for symbol in args.symbols:
+        companies_by_symbol.setdefault(symbol.upper(), symbol.upper())
+    if not companies_by_symbol:
+        parser.error("No tickers given, pass symbols or --watchlist.")
+
+    now = datetime.datetime.now(MARKET_TIME_ZONE)
+    mock_data_input_now = now.replace(hour=9, minute=0, second=0, microsecond=0)
+    run_batch(companies_by_symbol, use_temp_file=not args.no_temp_file, mock_data_input_now=mock_data_input_now,
+              render_workers=args.render_workers, render_backend=args.render_backend)
+
+    response_cache = get_response_cache()
+    if response_cache:
+        response_cache.log_stats("OpenAI response cache")
+    log_scheduler_stats()
+
+
+if __name__ == "__main__":
+    main()
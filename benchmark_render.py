@@ -0,0 +1,69 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from utils.utils import setup_logging
+from video_creation import create_video
+
+setup_logging()
+
+BENCHMARK_WORDS = ["the", "stock", "market", "opens", "higher", "today", "after", "strong", "earnings", "news"]
+
+
+def synthetic_sentences(audio_path, background_videos, sentence_seconds=5.0, word_seconds=0.5):
+    # evenly spaced sentences cycling through the available backgrounds, enough to exercise every stage
+    duration_ms = int(ffmpeg_parse_infos(audio_path)['duration'] * 1000)
+    sentence_ms, word_ms = int(sentence_seconds * 1000), int(word_seconds * 1000)
+    sentences = []
+    for i, start in enumerate(range(0, duration_ms, sentence_ms)):
+        end = min(start + sentence_ms, duration_ms)
+        words = [{"word": BENCHMARK_WORDS[(j // word_ms) % len(BENCHMARK_WORDS)], "start": j, "end": min(j + word_ms, end)}
+                 for j in range(start, end, word_ms)]
+        sentences.append({"sentence": f"Sentence {i}.", "start": start, "end": end,
+                          "video_name": os.path.basename(background_videos[i % len(background_videos)]),
+                          "words_in_sentence": words})
+    return sentences
+
+
+def benchmark(audio_path, sentences_list_with_timings, background_videos, worker_counts, output_dir="results"):
+    timings = {}
+    for workers in worker_counts:
+        video_path = os.path.join(output_dir, f"benchmark_{workers}_workers.mp4")
+        start_time = time.time()
+        create_video(audio_path, video_path, sentences_list_with_timings, background_videos,
+                     backend="chunked", workers=workers)
+        timings[workers] = time.time() - start_time
+        logging.info(f"{workers} workers: {timings[workers]:.2f} seconds, "
+                     f"{timings[worker_counts[0]] / timings[workers]:.2f}x speedup")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunked rendering from 1 to N worker processes.")
+    parser.add_argument("--audio", default="results/output_audio.mp3")
+    parser.add_argument("--sentences", help="JSON file with sentences_list_with_timings, synthetic if omitted")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    background_videos = glob.glob(os.path.join("inputs", "*.mp4")) or None
+    if args.sentences:
+        with open(args.sentences, 'r', encoding='utf-8') as file:
+            sentences_list_with_timings = json.load(file)
+    else:
+        sentences_list_with_timings = synthetic_sentences(args.audio, background_videos or ["none.mp4"])
+
+    os.makedirs("results", exist_ok=True)
+    worker_counts = sorted(set(args.workers))
+    # first pass warms the caption and proxy caches so every worker count is measured on the render alone
+    create_video(args.audio, "results/benchmark_warmup.mp4", sentences_list_with_timings, background_videos,
+                 backend="chunked", workers=1)
+    benchmark(args.audio, sentences_list_with_timings, background_videos, worker_counts)
+
+
+if __name__ == "__main__":
+    main()
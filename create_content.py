@@ -2,70 +2,178 @@ import yfinance as yf
 import datetime
 import asyncio
 import logging
+import math
 from tqdm import tqdm
+from utils.bar_store import BarStore, update_bar_stores
 from utils.consts import MARKET_TIME_ZONE
-from utils.open_ai import generate_stock_opening_analysis, summarize_with_open_ai
+from utils.article_store import canonicalize_url, content_hash, get_article_store
+from utils.open_ai import generate_stock_opening_analysis, get_openai_client, review_articles
+from utils.price_analytics import compute_premarket_analytics, format_premarket_analytics
+from utils.scraper import TieredArticleFetcher
 from utils.stock_market_time import StockMarketTime
 from utils.utils import get_text_by_url, save_to_temp_file, read_temp_file, setup_logging
 
 setup_logging()
 
 
-def create_content(use_temp_file=False, mock_data_input_now=None) -> str:
+BATCH_MAX_CONCURRENT_TICKERS = 8
+
+
+def create_content(use_temp_file=False, mock_data_input_now=None, stock_symbol='NVDA',
+                   company_name='NVIDIA Corporation') -> str:
     logging.info("Starting stock market time check...")
     stock_market_time = StockMarketTime(mock_data_input_now)
-    stock_symbol = 'NVDA'
-    company_name = 'NVIDIA Corporation'
-    now_date = stock_market_time.now.strftime("%Y-%m-%d")
+    stock_info = get_stock_info(stock_market_time, stock_symbol, company_name, use_temp_file)
+
+    result = generate_stock_opening_analysis(stock_info, company_name, stock_symbol)
+    # result_with_SSML = add_SSML_tags(result, company_name, stock_symbol)
+    return result
+
 
+def get_stock_info(stock_market_time: StockMarketTime, stock_symbol='NVDA', company_name='NVIDIA Corporation',
+                   use_temp_file=False, client=None, news_feed=None, collected_news=None, price_data=None) -> str:
+    now_date = stock_market_time.now.strftime("%Y-%m-%d")
     file_name = f"{stock_symbol}_{now_date}"
     stock_info = read_temp_file(file_name) if use_temp_file else None
 
     if not stock_info:
-        stock_info = get_stock_data(stock_symbol, company_name, stock_market_time)
+        stock_info = get_stock_data(stock_symbol, company_name, stock_market_time, client, news_feed, collected_news,
+                                    price_data)
         save_to_temp_file(stock_info, file_name)
+    return stock_info
 
-    result = generate_stock_opening_analysis(stock_info, company_name, stock_symbol)
-    # result_with_SSML = add_SSML_tags(result, company_name, stock_symbol)
+
+def create_contents(companies_by_symbol: dict, use_temp_file=False, mock_data_input_now=None) -> dict:
+    # batch version of create_content: one bulk price download, one browser and one LLM client for all
+    # tickers, a failing ticker maps to its exception instead of stopping the others
+    return asyncio.run(create_contents_async(companies_by_symbol, use_temp_file, mock_data_input_now))
+
+
+async def create_contents_async(companies_by_symbol: dict, use_temp_file=False, mock_data_input_now=None) -> dict:
+    stock_market_time = StockMarketTime(mock_data_input_now)
+    now_date = stock_market_time.now.strftime("%Y-%m-%d")
+    client = get_openai_client()
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENT_TICKERS)
+
+    stock_info_by_symbol = {}
+    if use_temp_file:
+        for stock_symbol in companies_by_symbol:
+            stock_info_by_symbol[stock_symbol] = read_temp_file(f"{stock_symbol}_{now_date}")
+    missing_symbols = [symbol for symbol in companies_by_symbol if not stock_info_by_symbol.get(symbol)]
+
+    analytics_by_symbol = {}
+    error_by_symbol = {}
+    if missing_symbols:
+        logging.info(f"Updating price history for {len(missing_symbols)} symbols...")
+        await run_for_symbols(update_bar_stores, missing_symbols, error_by_symbol)
+        analytics_by_symbol = await run_for_symbols(
+            lambda symbols: compute_premarket_analytics(symbols, stock_market_time.last_time_closed,
+                                                        stock_market_time.next_time_open),
+            [symbol for symbol in missing_symbols if symbol not in error_by_symbol], error_by_symbol)
+
+    async def create_one(stock_symbol, company_name, fetcher):
+        async with semaphore:
+            if stock_symbol in error_by_symbol:
+                return error_by_symbol[stock_symbol]
+            try:
+                stock_info = stock_info_by_symbol.get(stock_symbol)
+                if not stock_info:
+                    price_data = format_price_data(stock_symbol, analytics_by_symbol[stock_symbol])
+                    stock_info = await get_stock_data_async(stock_symbol, company_name, stock_market_time,
+                                                            fetcher, client, price_data)
+                    save_to_temp_file(stock_info, f"{stock_symbol}_{now_date}")
+                return await asyncio.to_thread(generate_stock_opening_analysis, stock_info, company_name,
+                                               stock_symbol, client)
+            except Exception as e:
+                logging.exception(f"Failed to create content for {stock_symbol}: {e}")
+                return e
+
+    try:
+        async with TieredArticleFetcher() as fetcher:
+            results = await asyncio.gather(*(create_one(stock_symbol, company_name, fetcher)
+                                             for stock_symbol, company_name in companies_by_symbol.items()))
+    finally:
+        await client.aclose()
+    return dict(zip(companies_by_symbol, results))
+
+
+async def run_for_symbols(function, symbols, error_by_symbol) -> dict:
+    # one bulk call for all symbols, after a failure every symbol is retried alone so only the failing
+    # ones end up in error_by_symbol
+    if not symbols:
+        return {}
+    try:
+        return await asyncio.to_thread(function, symbols)
+    except Exception as e:
+        logging.warning(f"Bulk price step failed for {len(symbols)} symbols, retrying one by one: {e}")
+    result = {}
+    for symbol in symbols:
+        try:
+            result.update(await asyncio.to_thread(function, [symbol]))
+        except Exception as e:
+            logging.exception(f"Price step failed for {symbol}: {e}")
+            error_by_symbol[symbol] = e
     return result
 
 
-def get_stock_data(stock_symbol: str, company_name: str, stock_market_time: StockMarketTime) -> str:
+def get_stock_data(stock_symbol: str, company_name: str, stock_market_time: StockMarketTime, client=None,
+                   news_feed=None, collected_news=None, price_data=None) -> str:
     logging.info("Getting stock data...")
-    price_data = get_price_data(stock_symbol, stock_market_time)
+    price_data = price_data or get_price_data(stock_symbol, stock_market_time)
     logging.info("Getting news data...")
-    news_data = get_news_data(company_name, stock_symbol, stock_market_time)
+    news_data = get_news_data(company_name, stock_symbol, stock_market_time, client, news_feed, collected_news)
     logging.info("Preparing output...")
+    return format_stock_data(stock_symbol, company_name, price_data, news_data)
+
+
+async def get_stock_data_async(stock_symbol: str, company_name: str, stock_market_time: StockMarketTime,
+                               fetcher=None, client=None, price_data=None, news_feed=None) -> str:
+    price_data = price_data or await asyncio.to_thread(get_price_data, stock_symbol, stock_market_time)
+    news_data = await get_news_data_async(company_name, stock_symbol, stock_market_time, fetcher, client,
+                                          news_feed=news_feed)
+    return format_stock_data(stock_symbol, company_name, price_data, news_data)
+
+
+def format_stock_data(stock_symbol: str, company_name: str, price_data: str, news_data: str) -> str:
     return f"Stock Data for {company_name} ({stock_symbol}):\n\n" \
            f"Price Data:\n{price_data}\n\n" \
            f"News Data:\n{news_data}"
 
 
 def get_price_data(stock_symbol: str, stock_market_time: StockMarketTime) -> str:
-    stock = yf.Ticker(stock_symbol)
-    start = stock_market_time.last_time_closed
-    end = stock_market_time.next_time_open
-    stock_data = stock.history(period="5d", interval="1m", prepost=True)
+    BarStore(stock_symbol).update()
+    analytics = compute_premarket_analytics([stock_symbol], stock_market_time.last_time_closed,
+                                            stock_market_time.next_time_open)[stock_symbol]
+    return format_price_data(stock_symbol, analytics)
 
-    stock_data = stock_data[(stock_data.index >= start) & (stock_data.index <= end)]
-    stock_data.to_csv(f"temp/{stock_symbol}_data.csv")
 
-    previous_close = stock_data.iloc[0]['Open']
-    open_price = stock_data.iloc[-1]['Open']
+def format_price_data(stock_symbol: str, analytics: dict) -> str:
+    if math.isnan(analytics['first_open']):
+        raise ValueError(f"No price bars stored for {stock_symbol} in the pre-market window.")
+    return format_premarket_analytics(analytics)
 
-    return (
-        f"Previous Close (Yesterday): {previous_close}\n"
-        f"Open Price (Today): {open_price}\n"
-    )
 
+def get_news_data(company_name: str, stock_symbol: str, stock_market_time: StockMarketTime, client=None,
+                  news_feed=None, collected_news=None) -> str:
+    client = client or get_openai_client()
+
+    async def run():
+        try:
+            return await get_news_data_async(company_name, stock_symbol, stock_market_time, client=client,
+                                             news_feed=news_feed, collected_news=collected_news)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
 
-def get_news_data(company_name: str, stock_symbol: str, stock_market_time: StockMarketTime) -> str:
-    stock = yf.Ticker(stock_symbol)
-    news = stock.news
-    relevant_news = []
-    urls = set()
 
-    for news_item in tqdm(news):
+def get_yahoo_news(stock_symbol: str) -> list:
+    return yf.Ticker(stock_symbol).news
+
+
+def filter_window_news(news, stock_market_time: StockMarketTime) -> list:
+    relevant_news = []
+    for news_item in news:
         published_timestamp = news_item['providerPublishTime']
         published_time = datetime.datetime.fromtimestamp(published_timestamp, MARKET_TIME_ZONE)
 
@@ -73,36 +181,95 @@ def get_news_data(company_name: str, stock_symbol: str, stock_market_time: Stock
                 stock_market_time.last_time_closed < published_time < stock_market_time.next_time_open):
             continue
 
-        url = news_item.get('link')
-        if not url:
+        if not news_item.get('link'):
             continue
 
         relevant_news.append(news_item)
-        urls.add(url)
+    return relevant_news
 
+
+async def collect_news_async(stock_symbol: str, stock_market_time: StockMarketTime, fetcher=None, article_store=None,
+                             news_feed=None):
+    # returns (news items in the market window, {link: article text}), only articles never seen before are fetched
+    # news_feed(symbol) returns the yfinance news item list, fixture feeds replace it in tests and dry runs
+    news = await asyncio.to_thread(news_feed or get_yahoo_news, stock_symbol)
+    relevant_news = filter_window_news(tqdm(news), stock_market_time)
+    urls = {news_item['link'] for news_item in relevant_news}
     logging.info(f"Number of relevant news items: {len(relevant_news)}")
+    if not relevant_news:
+        return relevant_news, {}
+
+    article_store = article_store or get_article_store()
+    text_by_link = article_store.get_texts(urls) if article_store else {}
+    new_url_by_canonical = {}
+    for url in urls - set(text_by_link):
+        new_url_by_canonical.setdefault(canonicalize_url(url), url)
+    logging.info(f"Articles to fetch: {len(new_url_by_canonical)} new of {len(urls)} links")
+    if new_url_by_canonical:
+        fetched_text_by_link = await get_text_by_url(set(new_url_by_canonical.values()), fetcher)
+        if article_store:
+            article_store.put_texts(fetched_text_by_link)
+        for url in urls - set(text_by_link):
+            text_by_link[url] = fetched_text_by_link.get(new_url_by_canonical[canonicalize_url(url)])
+    return relevant_news, text_by_link
+
+
+def get_news_fingerprint(collected_news) -> list:
+    # the canonical links in the window with the content hash of their text, changes when news arrives or is edited
+    relevant_news, text_by_link = collected_news
+    return sorted({(canonicalize_url(news_item['link']),
+                    content_hash(text_by_link[news_item['link']]) if text_by_link.get(news_item['link']) else None)
+                   for news_item in relevant_news})
+
+
+async def get_news_data_async(company_name: str, stock_symbol: str, stock_market_time: StockMarketTime,
+                              fetcher=None, client=None, article_store=None, news_feed=None,
+                              collected_news=None) -> str:
+    # collected_news is collect_news_async's result when the caller already gathered the news
+    article_store = article_store or get_article_store()
+    relevant_news, text_by_link = collected_news or await collect_news_async(
+        stock_symbol, stock_market_time, fetcher, article_store, news_feed)
 
     if not relevant_news:
         return (f"No relevant news found for {company_name} "
                 f"between {stock_market_time.last_time_closed} and "
                 f"{stock_market_time.next_time_open}.")
 
-    text_by_link = asyncio.run(get_text_by_url(urls))
-    news_data = ""
-
-    for news_item in tqdm(relevant_news):
-        link = news_item['link']
-        text = text_by_link.get(link)
+    # the same story syndicated under several links is summarized and reported once
+    news_with_text = []
+    hash_by_link = {}
+    seen_hashes = set()
+    for news_item in relevant_news:
+        text = text_by_link.get(news_item['link'])
         if not text:
             continue
+        article_hash = content_hash(text)
+        if article_hash not in seen_hashes:
+            seen_hashes.add(article_hash)
+            news_with_text.append(news_item)
+        hash_by_link[news_item['link']] = article_hash
 
-        published_timestamp = news_item['providerPublishTime']
-        published_time = datetime.datetime.fromtimestamp(published_timestamp, MARKET_TIME_ZONE)
-        summary = summarize_with_open_ai(text, link, company_name, stock_symbol)
+    review_by_hash = article_store.get_reviews(hash_by_link.values(), stock_symbol) if article_store else {}
+    news_to_review = [news_item for news_item in news_with_text if hash_by_link[news_item['link']] not in review_by_hash]
+    logging.info(f"Articles already reviewed for {stock_symbol}: {len(news_with_text) - len(news_to_review)}/"
+                 f"{len(news_with_text)}")
+    reviews = await review_articles([(text_by_link[news_item['link']], news_item['link'])
+                                     for news_item in news_to_review],
+                                    company_name, stock_symbol, client)
+    new_review_by_hash = {hash_by_link[news_item['link']]: review for news_item, review in zip(news_to_review, reviews)}
+    if article_store:
+        article_store.put_reviews(stock_symbol, new_review_by_hash)
+    review_by_hash.update(new_review_by_hash)
+    summaries = [(review_by_hash.get(hash_by_link[news_item['link']]) or {}).get("summary")
+                 for news_item in news_with_text]
+    news_data = ""
 
+    for news_item, summary in zip(news_with_text, summaries):
         if not summary:
             continue
 
+        published_timestamp = news_item['providerPublishTime']
+        published_time = datetime.datetime.fromtimestamp(published_timestamp, MARKET_TIME_ZONE)
         news_data += (f"Headline: {news_item['title'].strip()}\n"
                       f"Date: {published_time}\n"
                       f"Summary: {summary.strip()}\n\n")
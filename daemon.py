@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import time
+
+from batch import read_watchlist
+from create_content import BATCH_MAX_CONCURRENT_TICKERS, get_news_data_async, get_stock_data_async
+from main import run_pipeline
+from utils.consts import MARKET_TIME_ZONE
+from utils.open_ai import get_openai_client
+from utils.scraper import TieredArticleFetcher
+from utils.stock_market_time import StockMarketTime, is_trading_day
+from utils.utils import setup_logging
+from video_creation import RENDER_BACKENDS
+
+setup_logging()
+
+DEFAULT_TRIGGER_TIME = datetime.time(9, 0)
+DEFAULT_POLL_INTERVAL_SECONDS = 10 * 60
+
+
+class SystemClock:
+    def now(self):
+        return datetime.datetime.now(MARKET_TIME_ZONE)
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+class FakeClock:
+    # sleeping moves the clock forward instantly, so a whole night of polling runs in seconds
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    async def sleep(self, seconds):
+        self.current = MARKET_TIME_ZONE.normalize(self.current + datetime.timedelta(seconds=seconds))
+        await asyncio.sleep(0)
+
+
+class FixtureNewsFeed:
+    # {"NVDA": [yfinance news items]} from a JSON file, an item only shows up once the clock passed its
+    # providerPublishTime, like news arriving overnight
+    def __init__(self, path, clock):
+        with open(path, 'r', encoding='utf-8') as file:
+            self.news_by_symbol = json.load(file)
+        self.clock = clock
+
+    def __call__(self, stock_symbol):
+        now_timestamp = self.clock.now().timestamp()
+        return [news_item for news_item in self.news_by_symbol.get(stock_symbol, [])
+                if news_item['providerPublishTime'] <= now_timestamp]
+
+
+class PreOpenDaemon:
+    # keeps one browser-backed fetcher and one LLM client warm, polls news through the night so every article
+    # is already fetched and reviewed in the article store, and at trigger time only runs the final stages
+    def __init__(self, companies_by_symbol: dict, trigger_time=DEFAULT_TRIGGER_TIME,
+                 poll_interval=DEFAULT_POLL_INTERVAL_SECONDS, clock=None, news_feed=None, client=None,
+                 fetcher=None, produce=None, render_backend="moviepy"):
+        self.companies_by_symbol = companies_by_symbol
+        self.trigger_time = trigger_time
+        self.poll_interval = poll_interval
+        self.clock = clock or SystemClock()
+        self.news_feed = news_feed
+        self.client = client or get_openai_client()
+        self.fetcher = fetcher
+        # produce(trigger) is awaited on the daemon loop
+        self.produce = produce or self.run_final_stages
+        self.render_backend = render_backend
+        self.polls = 0
+
+    def next_trigger(self):
+        # the trigger is localized per date so it keeps the wall-clock time across DST changes, weekends and
+        # market holidays are skipped
+        now = self.clock.now()
+        date = now.date()
+        while True:
+            trigger = MARKET_TIME_ZONE.localize(datetime.datetime.combine(date, self.trigger_time))
+            if trigger > now and is_trading_day(date):
+                return trigger
+            date += datetime.timedelta(days=1)
+
+    async def poll_once(self):
+        stock_market_time = StockMarketTime(self.clock.now())
+        semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENT_TICKERS)
+
+        async def poll(stock_symbol, company_name):
+            async with semaphore:
+                try:
+                    await get_news_data_async(company_name, stock_symbol, stock_market_time, self.fetcher,
+                                              self.client, news_feed=self.news_feed)
+                except Exception as e:
+                    logging.exception(f"News poll failed for {stock_symbol}: {e}")
+
+        start_time = time.time()
+        await asyncio.gather(*(poll(stock_symbol, company_name)
+                               for stock_symbol, company_name in self.companies_by_symbol.items()))
+        self.polls += 1
+        logging.info(f"News poll {self.polls} at {self.clock.now()} took {time.time() - start_time:.2f} seconds.")
+
+    async def run_final_stages(self, trigger):
+        # late news is fetched and reviewed on this loop with the warm fetcher and client, most of it is already in
+        # the article store, only the synchronous analysis, audio and render stages run in a worker thread
+        stock_market_time = StockMarketTime(trigger)
+        semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENT_TICKERS)
+
+        async def gather_stock_info(stock_symbol, company_name):
+            async with semaphore:
+                try:
+                    return await get_stock_data_async(stock_symbol, company_name, stock_market_time, self.fetcher,
+                                                      self.client, news_feed=self.news_feed)
+                except Exception as e:
+                    logging.exception(f"Stock info failed for {stock_symbol}: {e}")
+                    return e
+
+        stock_infos = await asyncio.gather(*(gather_stock_info(stock_symbol, company_name)
+                                             for stock_symbol, company_name in self.companies_by_symbol.items()))
+        results = {}
+        for (stock_symbol, company_name), stock_info in zip(self.companies_by_symbol.items(), stock_infos):
+            if isinstance(stock_info, Exception):
+                results[stock_symbol] = stock_info
+                continue
+            try:
+                results[stock_symbol] = (await asyncio.to_thread(
+                    run_pipeline, stock_symbol, company_name, trigger, results_dir=f"results/{stock_symbol}",
+                    backend=self.render_backend, client=self.client, stock_info=stock_info))[3]
+            except Exception as e:
+                logging.exception(f"Final stages failed for {stock_symbol}: {e}")
+                results[stock_symbol] = e
+        return results
+
+    async def run(self, max_triggers=None):
+        triggers = 0
+        owns_fetcher = self.fetcher is None
+        if owns_fetcher:
+            self.fetcher = TieredArticleFetcher()
+            await self.fetcher.__aenter__()
+        try:
+            while max_triggers is None or triggers < max_triggers:
+                trigger = self.next_trigger()
+                logging.info(f"Next trigger at {trigger}, polling news every {self.poll_interval} seconds.")
+                while self.clock.now() < trigger:
+                    await self.poll_once()
+                    remaining = (trigger - self.clock.now()).total_seconds()
+                    if remaining > 0:
+                        await self.clock.sleep(min(self.poll_interval, remaining))
+                # a last poll picks up anything published since the previous one
+                await self.poll_once()
+                start_time = time.time()
+                results = await self.produce(trigger)
+                logging.info(f"Trigger {trigger}: videos ready {time.time() - start_time:.2f} seconds after the "
+                             f"trigger: {results}")
+                triggers += 1
+        finally:
+            if owns_fetcher:
+                await self.fetcher.__aexit__(None, None, None)
+                self.fetcher = None
+            await self.client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll news before the open and render the briefings at trigger time.")
+    parser.add_argument("symbols", nargs="*", help="Ticker symbols, e.g. NVDA AAPL MSFT")
+    parser.add_argument("--watchlist", help="File with one ticker per line, optionally 'SYMBOL,Company Name'")
+    parser.add_argument("--trigger", default=DEFAULT_TRIGGER_TIME.strftime("%H:%M"), help="Trigger time in ET, HH:MM")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL_SECONDS, help="Seconds")
+    parser.add_argument("--render-backend", choices=RENDER_BACKENDS, default="moviepy")
+    parser.add_argument("--once", action="store_true", help="Exit after the first trigger")
+    parser.add_argument("--fixture-news", help="JSON file of news items per symbol instead of yfinance")
+    parser.add_argument("--fake-start", help="Run on a fake clock starting at this ET time, e.g. 2024-12-10T18:00")
+    args = parser.parse_args()
+
+    companies_by_symbol = read_watchlist(args.watchlist) if args.watchlist else {}
+    for symbol in args.symbols:
+        companies_by_symbol.setdefault(symbol.upper(), symbol.upper())
+    if not companies_by_symbol:
+        parser.error("No tickers given, pass symbols or --watchlist.")
+
+    clock = SystemClock()
+    if args.fake_start:
+        clock = FakeClock(MARKET_TIME_ZONE.localize(datetime.datetime.fromisoformat(args.fake_start)))
+    news_feed = FixtureNewsFeed(args.fixture_news, clock) if args.fixture_news else None
+    hour, minute = (int(part) for part in args.trigger.split(":"))
+    daemon = PreOpenDaemon(companies_by_symbol, datetime.time(hour, minute), args.poll_interval, clock, news_feed,
+                           render_backend=args.render_backend)
+    asyncio.run(daemon.run(max_triggers=1 if args.once else None))
+
+
+if __name__ == "__main__":
+    main()
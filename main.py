@@ -1,14 +1,23 @@
+import argparse
+import asyncio
 import datetime
 import glob
 import logging
+import shutil
 import time
-from audio_synthesis import text_to_audio
-from create_content import create_content
+from audio_synthesis import synthesize_text, get_tts_cache, POLLY_VOICE_ID, POLLY_ENGINE, WORD_TIMINGS
+from create_content import collect_news_async, get_news_fingerprint, get_price_data, get_stock_info
+from inputs.video_map import VIDEO_DESCRIPTION_MAP
+from utils.artifact_store import ArtifactStore, file_fingerprint, read_json, read_text, write_json, write_text
 from utils.consts import MARKET_TIME_ZONE
-from utils.open_ai import match_text_to_video
-from utils.utils import setup_logging
-from video_creation import create_video
-from pydub import AudioSegment
+from utils.ffmpeg_render import check_output_equivalence
+from utils.open_ai import generate_stock_opening_analysis, match_sentences_to_videos, get_response_cache
+from utils.request_scheduler import log_scheduler_stats
+from utils.stock_market_time import StockMarketTime
+from streaming_pipeline import stream_briefing
+from utils.utils import clean_text, setup_logging
+from video_creation import create_video, RENDER_BACKENDS, VIDEO_FPS, VIDEO_SIZE
+from utils.render_profiles import RENDER_PROFILES
 import os
 
 setup_logging()
@@ -23,49 +32,205 @@ def check_part_of_text_map(part_of_text_map):
     pass
 
 
-def main():
-    os.makedirs('results', exist_ok=True)
-
-    logging.info("Starting the script.")
-
-    now = datetime.datetime.now(MARKET_TIME_ZONE)
-    mock_data_input_now = now.replace(hour=9, minute=0, second=0, microsecond=0)
-    text = create_content(use_temp_file=True, mock_data_input_now=mock_data_input_now)
-    # text = "Hi! My name is Gregory. I will read any text you type here."
-    text = text.replace("*", "").replace('"', "'")
-
-    audio_path = "results/output_audio.mp3"
-    video_path = "results/output_video.mp4"
-    wav_audio_path = "results/output_audio.wav"
+# bump a stage's version when its code changes so stored artifacts are rebuilt
+PIPELINE_STAGES = {"stock_info": 3, "analysis": 1, "audio": 1, "video_assignments": 1, "render": 1}
+
+
+def run_stock_info_stage(store, stock_market_time, stock_symbol='NVDA', company_name='NVIDIA Corporation',
+                         client=None, news_feed=None, given_stock_info=None):
+    # the latest bars and new articles are fetched before keying, so the key sees the price block and the news
+    # the stage would use
+    price_data, collected_news = None, None
+    if not given_stock_info:
+        price_data = get_price_data(stock_symbol, stock_market_time)
+        collected_news = asyncio.run(collect_news_async(stock_symbol, stock_market_time, news_feed=news_feed))
+
+    def stock_info_stage(directory):
+        # the key already covers the prices and the news, so the per-day temp file would only hide a change
+        write_text(directory, "stock_info.txt", given_stock_info or get_stock_info(
+            stock_market_time, stock_symbol, company_name, False, client, news_feed, collected_news, price_data))
+
+    _, stock_info_dir = store.run("stock_info", [PIPELINE_STAGES["stock_info"], stock_symbol, company_name,
+                                                 stock_market_time.last_time_closed.isoformat(),
+                                                 stock_market_time.next_time_open.isoformat(),
+                                                 given_stock_info or
+                                                 [price_data, get_news_fingerprint(collected_news)]],
+                                  stock_info_stage)
+    return read_text(stock_info_dir, "stock_info.txt")
+
+
+def run_pipeline(stock_symbol='NVDA', company_name='NVIDIA Corporation', mock_data_input_now=None,
+                 results_dir='results', backend="moviepy", workers=None, profiles=None, export_wav=False,
+                 force=(), client=None, news_feed=None, stock_info=None):
+    # stock_info -> analysis -> audio+timings -> video assignments -> render, every stage is keyed by a hash
+    # of its inputs, so a rerun only recomputes the stages whose inputs changed. A caller that already gathered
+    # the stock info on its own event loop (the daemon, with its warm fetcher) passes it in as stock_info
+    store = ArtifactStore(force=force)
+    stock_market_time = StockMarketTime(mock_data_input_now)
+    video_match_engine = os.getenv('VIDEO_MATCH_ENGINE', 'llm')
+    audio_segment = None
+
+    stock_info = run_stock_info_stage(store, stock_market_time, stock_symbol, company_name, client, news_feed,
+                                      stock_info)
+
+    def analysis_stage(directory):
+        text = generate_stock_opening_analysis(stock_info, company_name, stock_symbol, client)
+        if not text:
+            raise RuntimeError(f"No opening analysis generated for {stock_symbol}")
+        write_text(directory, "analysis.txt", clean_text(text))
+
+    _, analysis_dir = store.run("analysis", [PIPELINE_STAGES["analysis"], stock_info, company_name, stock_symbol],
+                                analysis_stage)
+    text = read_text(analysis_dir, "analysis.txt")
+
+    def audio_stage(directory):
+        nonlocal audio_segment
+        sentences_list_with_timings, audio_segment = synthesize_text(
+            text, os.path.join(directory, "output_audio.mp3"),
+            os.path.join(directory, "output_audio.wav") if export_wav else None)
+        write_json(directory, "sentences.json", sentences_list_with_timings)
+
+    audio_key, audio_dir = store.run("audio", [PIPELINE_STAGES["audio"], text, POLLY_VOICE_ID, POLLY_ENGINE,
+                                               WORD_TIMINGS], audio_stage)
+    sentences_list_with_timings = read_json(audio_dir, "sentences.json")
+    sentences = [sentence['sentence'] for sentence in sentences_list_with_timings]
+
+    def video_assignments_stage(directory):
+        write_json(directory, "video_names.json",
+                   match_sentences_to_videos(sentences, engine=video_match_engine, client=client))
+
+    _, assignments_dir = store.run("video_assignments", [PIPELINE_STAGES["video_assignments"], sentences,
+                                                         video_match_engine, VIDEO_DESCRIPTION_MAP],
+                                   video_assignments_stage)
+    for sentence, video_name in zip(sentences_list_with_timings, read_json(assignments_dir, "video_names.json")):
+        sentence['video_name'] = video_name
+
+    background_videos = glob.glob(os.path.join("inputs", "*.mp4"))
+
+    def render_stage(directory):
+        render_video(os.path.join(audio_dir, "output_audio.mp3"), os.path.join(directory, "output_video.mp4"),
+                     sentences_list_with_timings, backend, workers, profiles, audio_segment)
+
+    _, render_dir = store.run("render", [PIPELINE_STAGES["render"], audio_key, sentences_list_with_timings,
+                                         backend, profiles, VIDEO_SIZE, VIDEO_FPS,
+                                         file_fingerprint(background_videos)], render_stage)
+
+    # the latest outputs are published to results_dir, the artifacts stay keyed in temp/artifacts
+    os.makedirs(results_dir, exist_ok=True)
+    audio_path = os.path.join(results_dir, "output_audio.mp3")
+    shutil.copyfile(os.path.join(audio_dir, "output_audio.mp3"), audio_path)
+    video_paths = []
+    for name in sorted(os.listdir(render_dir)):
+        if name.endswith(".mp4"):
+            video_paths.append(os.path.join(results_dir, name))
+            shutil.copyfile(os.path.join(render_dir, name), video_paths[-1])
+    logging.info(f"Pipeline stages built: {store.built or 'none'}, reused: {store.reused or 'none'}")
+    return audio_path, sentences_list_with_timings, audio_segment, video_paths
+
+
+def prepare_audio_and_videos(text, results_dir='results', client=None, export_wav=False):
+    audio_path = f"{results_dir}/output_audio.mp3"
+    wav_audio_path = f"{results_dir}/output_audio.wav" if export_wav else None
     logging.info("Converting text to audio...")
     start_time = time.time()
-    sentences_list_with_timings = text_to_audio(text, audio_path, wav_audio_path)
+    sentences_list_with_timings, audio_segment = synthesize_text(text, audio_path, wav_audio_path)
     logging.info(f"Text to audio conversion completed in {time.time() - start_time:.2f} seconds.")
 
-    for sentence in sentences_list_with_timings:
-        sentence['video_name'] = match_text_to_video(sentence['sentence'])
+    logging.info("Matching sentences to background videos...")
+    start_time = time.time()
+    video_names = match_sentences_to_videos([sentence['sentence'] for sentence in sentences_list_with_timings],
+                                            engine=os.getenv('VIDEO_MATCH_ENGINE', 'llm'), client=client)
+    for sentence, video_name in zip(sentences_list_with_timings, video_names):
+        sentence['video_name'] = video_name
+    logging.info(f"Video matching completed in {time.time() - start_time:.2f} seconds.")
+
+    logging.info(f"Generated audio duration: {audio_segment.duration_seconds} seconds")
+    return audio_path, sentences_list_with_timings, audio_segment
+
 
+def render_video(audio_path, video_path, sentences_list_with_timings, backend="moviepy", workers=None,
+                 profiles=None, audio_segment=None):
     background_videos_dir = "inputs"
 
     logging.info("Fetching list of background videos.")
     background_videos = glob.glob(os.path.join(background_videos_dir, "*.mp4"))
     background_videos = background_videos if background_videos else None
 
+    logging.info(f"Creating video with text using the {f'{profiles} profiles' if profiles else f'{backend} backend'}...")
+    start_time = time.time()
+    rendition_paths = create_video(audio_path=audio_path,
+                                   video_path=video_path,
+                                   sentences_list_with_timings=sentences_list_with_timings,
+                                   background_videos=background_videos,
+                                   backend=backend,
+                                   workers=workers,
+                                   profiles=profiles,
+                                   audio_segment=audio_segment)
+    logging.info(f"Video creation completed in {time.time() - start_time:.2f} seconds.")
+    # with profiles only the renditions next to video_path are written, not video_path itself
+    return list(rendition_paths.values()) if profiles else [video_path]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create the opening briefing video.")
+    parser.add_argument("--render-backend", choices=RENDER_BACKENDS, default="moviepy")
+    parser.add_argument("--render-workers", type=int, default=None,
+                        help="Processes for the chunked backend, defaults to CPU count")
+    parser.add_argument("--check-equivalence", action="store_true",
+                        help="Also render with the other backend and compare the two outputs")
+    parser.add_argument("--profiles", nargs="+", choices=tuple(RENDER_PROFILES), default=None,
+                        help="Render these output formats in one pass, e.g. --profiles landscape vertical")
+    parser.add_argument("--stream", action="store_true",
+                        help="Synthesize and render the analysis sentence by sentence while it is generated")
+    parser.add_argument("--force", nargs="+", choices=tuple(PIPELINE_STAGES), default=(),
+                        help="Rebuild these stages even if their inputs did not change, e.g. --force stock_info")
+    parser.add_argument("--export-wav", action="store_true", help="Also write results/output_audio.wav")
+    args = parser.parse_args()
+    if args.profiles and (args.render_backend != parser.get_default("render_backend") or args.render_workers or
+                          args.check_equivalence):
+        # the renditions come from their own single-pass renderer, there is no backend output to compare them with
+        parser.error("--profiles cannot be combined with --render-backend, --render-workers or --check-equivalence")
+    if args.stream:
+        # the streaming mode renders its own chunks and only shares the stock_info stage with the pipeline
+        if args.profiles or args.export_wav or args.render_backend != parser.get_default("render_backend"):
+            parser.error("--stream cannot be combined with --profiles, --export-wav or --render-backend")
+        if set(args.force) - {"stock_info"}:
+            parser.error("--stream only runs the stock_info stage, --force accepts only stock_info with it")
+    return args
 
-    audio = AudioSegment.from_file(audio_path)
-    logging.info(f"Generated audio duration: {audio.duration_seconds} seconds")
 
-    logging.info("Analyzing audio for word timings...")
-    start_time = time.time()
-    logging.info(f"Word timings extraction completed in {time.time() - start_time:.2f} seconds.")
+def main():
+    args = parse_args()
+    os.makedirs('results', exist_ok=True)
 
-    logging.info("Creating video with text...")
-    start_time = time.time()
-    create_video(audio_path=audio_path,
-                 video_path=video_path,
-                 sentences_list_with_timings=sentences_list_with_timings,
-                 background_videos=background_videos)
-    logging.info(f"Video creation completed in {time.time() - start_time:.2f} seconds.")
+    logging.info("Starting the script.")
+
+    now = datetime.datetime.now(MARKET_TIME_ZONE)
+    mock_data_input_now = now.replace(hour=9, minute=0, second=0, microsecond=0)
+    # text = "Hi! My name is Gregory. I will read any text you type here."
+    if args.stream:
+        stock_info = run_stock_info_stage(ArtifactStore(force=args.force), StockMarketTime(mock_data_input_now))
+        audio_path, sentences_list_with_timings, audio_segment, video_path = stream_briefing(
+            stock_info, 'NVIDIA Corporation', 'NVDA', render_workers=args.render_workers)
+        video_paths = [video_path]
+    else:
+        audio_path, sentences_list_with_timings, audio_segment, video_paths = run_pipeline(
+            mock_data_input_now=mock_data_input_now, backend=args.render_backend, workers=args.render_workers,
+            profiles=args.profiles, export_wav=args.export_wav, force=args.force)
+    if args.check_equivalence and video_paths:
+        video_path = video_paths[0]
+        other_backend = next(backend for backend in RENDER_BACKENDS if backend != args.render_backend)
+        other_video_path, = render_video(audio_path, f"results/output_video_{other_backend}.mp4",
+                                         sentences_list_with_timings, other_backend, audio_segment=audio_segment)
+        check_output_equivalence(video_path, other_video_path)
+
+    response_cache = get_response_cache()
+    if response_cache:
+        response_cache.log_stats("OpenAI response cache")
+    tts_cache = get_tts_cache()
+    if tts_cache:
+        tts_cache.log_stats("Speech cache")
+    log_scheduler_stats()
 
     logging.info("Script finished successfully.")
 
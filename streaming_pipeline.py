@@ -0,0 +1,152 @@
+import glob
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pydub import AudioSegment
+
+from audio_synthesis import (POLLY_MAX_WORKERS, build_sentences, get_cached_chunk, get_polly_client, get_tts_cache,
+                             split_sentences, store_cached_chunk, synthesize_audio, synthesize_speech_marks)
+from utils.ffmpeg_render import concat_chunks
+from utils.open_ai import get_openai_client, match_sentences_to_videos, stream_stock_opening_analysis
+from utils.utils import clean_text
+from video_creation import VIDEO_FPS, render_chunk
+
+# a render chunk is started once this much narrated audio is ready past the previous chunk
+STREAM_CHUNK_SECONDS = 10.0
+
+
+def split_sentence_stream(deltas):
+    # a boundary needs the whitespace after the punctuation and the next word, so "6.9%" is never split, "Corp."
+    # waits for what follows, and the last sentence is only emitted when the stream ends
+    buffer = ""
+    for delta in deltas:
+        buffer += delta
+        stripped = buffer.rstrip()
+        parts = split_sentences(stripped)
+        parts[-1] += buffer[len(stripped):]
+        for sentence in parts[:-1]:
+            if sentence.strip():
+                yield sentence.strip()
+        buffer = parts[-1]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+class StreamedSentence:
+    # speech, speech marks and the background match of one sentence, all requested as soon as it is generated
+    def __init__(self, text, executor, polly_client, tts_cache, client, video_match_engine):
+        self.text = text
+        self.tts_cache = tts_cache
+        self.cached = get_cached_chunk(tts_cache, text)
+        self.audio_future = self.marks_future = None
+        if self.cached is None:
+            self.audio_future = executor.submit(synthesize_audio, polly_client, text)
+            self.marks_future = executor.submit(synthesize_speech_marks, polly_client, text)
+        self.video_future = executor.submit(match_sentences_to_videos, [text], video_match_engine, client)
+
+    def done(self):
+        futures = [self.video_future] + ([self.audio_future, self.marks_future] if self.cached is None else [])
+        return all(future.done() for future in futures)
+
+    def result(self):
+        if self.cached is None:
+            self.cached = self.audio_future.result(), self.marks_future.result()
+            store_cached_chunk(self.tts_cache, self.text, *self.cached)
+        audio_bytes, speech_marks = self.cached
+        return audio_bytes, speech_marks, self.video_future.result()[0]
+
+
+class StreamingBriefing:
+    # sentences are timed in generation order as soon as the ones before them are ready, and every
+    # STREAM_CHUNK_SECONDS of timed audio is handed to a render process while the LLM is still writing
+    def __init__(self, audio_path, video_path, background_videos, render_executor, chunk_directory):
+        self.audio_path = audio_path
+        self.video_path = video_path
+        self.background_videos = background_videos
+        self.render_executor = render_executor
+        self.chunk_directory = chunk_directory
+        self.pending = []
+        self.audio_segments = []
+        self.sentences_list_with_timings = []
+        self.offset_ms = 0
+        self.chunk_start = 0.0
+        self.chunk_futures = []
+
+    def add(self, streamed_sentence):
+        self.pending.append(streamed_sentence)
+
+    def collect(self, block=False):
+        while self.pending and (block or self.pending[0].done()):
+            audio_bytes, speech_marks, video_name = self.pending.pop(0).result()
+            audio_segment = AudioSegment.from_file(io.BytesIO(audio_bytes), format="mp3")
+            for sentence in build_sentences(speech_marks, len(audio_segment), self.offset_ms):
+                sentence['video_name'] = video_name
+                self.sentences_list_with_timings.append(sentence)
+            self.audio_segments.append(audio_segment)
+            self.offset_ms += len(audio_segment)
+            if self.offset_ms / 1000 - self.chunk_start >= STREAM_CHUNK_SECONDS:
+                self.submit_chunk(round(self.offset_ms / 1000 * VIDEO_FPS) / VIDEO_FPS)
+
+    def submit_chunk(self, end):
+        # only the sentences timed so far are known, which is all a chunk ending at `end` needs
+        chunk_path = os.path.join(self.chunk_directory, f"chunk_{len(self.chunk_futures):03d}.mp4")
+        total_audio_duration = self.offset_ms / 1000 if end is None else end
+        self.chunk_futures.append(self.render_executor.submit(
+            render_chunk, chunk_path, self.chunk_start, end, total_audio_duration,
+            list(self.sentences_list_with_timings), self.background_videos))
+        logging.info(f"Render chunk {len(self.chunk_futures)} submitted: {self.chunk_start:.2f}s to "
+                     f"{'end' if end is None else f'{end:.2f}s'}")
+        if end is not None:
+            self.chunk_start = end
+
+    def finish(self):
+        self.collect(block=True)
+        if not self.audio_segments:
+            raise RuntimeError("The analysis stream produced no sentences")
+        audio_segment = sum(self.audio_segments[1:], self.audio_segments[0])
+        audio_segment.export(self.audio_path, format="mp3")
+        if self.offset_ms / 1000 - self.chunk_start >= 1 / VIDEO_FPS or not self.chunk_futures:
+            self.submit_chunk(None)
+        chunk_paths = [future.result() for future in self.chunk_futures]
+        concat_chunks(chunk_paths, self.audio_path, self.video_path)
+        return audio_segment
+
+
+def stream_briefing(stock_info, company_name, stock_symbol, results_dir='results', client=None, render_workers=None,
+                    max_workers=POLLY_MAX_WORKERS):
+    # the analysis is consumed as it streams: each finished sentence goes to Polly and video matching right away,
+    # timed sentences are rendered in chunks in parallel and the chunks are joined without re-encoding at the end
+    client = client or get_openai_client()
+    polly_client = get_polly_client()
+    tts_cache = get_tts_cache()
+    video_match_engine = os.getenv('VIDEO_MATCH_ENGINE', 'llm')
+    background_videos = glob.glob(os.path.join("inputs", "*.mp4")) or None
+    audio_path = f"{results_dir}/output_audio.mp3"
+    video_path = f"{results_dir}/output_video.mp4"
+    os.makedirs(results_dir, exist_ok=True)
+    chunk_directory = tempfile.mkdtemp(prefix="chunks_", dir=results_dir)
+
+    start_time = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                ProcessPoolExecutor(max_workers=render_workers or os.cpu_count()) as render_executor:
+            briefing = StreamingBriefing(audio_path, video_path, background_videos, render_executor,
+                                         chunk_directory)
+            deltas = stream_stock_opening_analysis(stock_info, company_name, stock_symbol, client)
+            for i, sentence in enumerate(split_sentence_stream(deltas)):
+                if i == 0:
+                    logging.info(f"First sentence generated after {time.time() - start_time:.2f} seconds.")
+                briefing.add(StreamedSentence(clean_text(sentence), executor, polly_client, tts_cache, client,
+                                              video_match_engine))
+                briefing.collect()
+            logging.info(f"Analysis stream finished after {time.time() - start_time:.2f} seconds.")
+            audio_segment = briefing.finish()
+    finally:
+        shutil.rmtree(chunk_directory, ignore_errors=True)
+    logging.info(f"Streamed briefing ready after {time.time() - start_time:.2f} seconds.")
+    return audio_path, briefing.sentences_list_with_timings, audio_segment, video_path
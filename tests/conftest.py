@@ -0,0 +1,34 @@
+import importlib.util
+import sys
+import types
+
+import pytest
+
+from tests.fakes import FakeEndpoint
+
+# inputs/ holds the background videos and their descriptions and is not checked in, a small stand-in map lets
+# the modules that import it load in a clean checkout
+if importlib.util.find_spec("inputs") is None:
+    inputs = types.ModuleType("inputs")
+    inputs.__path__ = []
+    video_map = types.ModuleType("inputs.video_map")
+    video_map.VIDEO_DESCRIPTION_MAP = {
+        "A trader looking at multiple screens with charts": "Interactive_Trading_Screen.mp4",
+        "Close up of a computer chip and semiconductor manufacturing": "Chip_Closeup.mp4",
+    }
+    inputs.video_map = video_map
+    sys.modules["inputs"] = inputs
+    sys.modules["inputs.video_map"] = video_map
+
+
+@pytest.fixture
+def fake_endpoint():
+    endpoints = []
+
+    def start(responses):
+        endpoints.append(FakeEndpoint(responses))
+        return endpoints[-1]
+
+    yield start
+    for endpoint in endpoints:
+        endpoint.close()
@@ -0,0 +1,69 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeEndpoint:
+    # a local HTTP server, `responses` is consumed one per request and the last one repeats, or is a dict of
+    # {path: response} for fixed pages, each response is (status, headers, body) with a dict or list body sent as JSON
+    def __init__(self, responses):
+        self.responses = responses if isinstance(responses, dict) else list(responses)
+        self.requests = []
+        self.lock = threading.Lock()
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b""
+                with endpoint.lock:
+                    endpoint.requests.append((self.command, self.path, body))
+                    if isinstance(endpoint.responses, dict):
+                        response = endpoint.responses.get(self.path, (404, {}, "Not found"))
+                    else:
+                        response = endpoint.responses.pop(0) if len(endpoint.responses) > 1 else \
+                            endpoint.responses[0]
+                status, headers, payload = response
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload)
+                    headers = {"Content-Type": "application/json", **headers}
+                payload = payload.encode('utf-8') if isinstance(payload, str) else payload
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://localhost:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def chat_completion(content):
+    return 200, {}, {
+        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    }
+
+
+def chat_completion_stream(deltas, error=None):
+    # server-sent events of a streamed completion, an error event after the deltas cuts the stream off
+    events = [{"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-mini",
+               "choices": [{"index": 0, "finish_reason": None, "delta": {"content": delta}}]} for delta in deltas]
+    if error:
+        events.append({"error": {"message": error}})
+    body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + ("" if error else "data: [DONE]\n\n")
+    return 200, {"Content-Type": "text/event-stream"}, body
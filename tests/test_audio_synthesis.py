@@ -0,0 +1,176 @@
+import functools
+import io
+import json
+import shutil
+import threading
+import time
+
+import boto3
+import pytest
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from pydub import AudioSegment
+
+import audio_synthesis
+from audio_synthesis import (build_sentences, split_sentences, split_text_into_chunks, synthesize_audio,
+                             synthesize_speech_marks, synthesize_text)
+from utils.response_cache import ResponseCache
+
+# pydub decodes and encodes mp3 through ffmpeg and ffprobe
+needs_ffmpeg = pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")),
+                                  reason="ffmpeg and ffprobe are needed to encode and decode mp3")
+
+SCRIPT = ("NVIDIA Corp. rose 6.9% in the U.S. market. Apple Inc. fell! Jensen H. Huang spoke at 5 p.m. today. "
+          "Shares are up. Is it over?")
+
+
+def test_split_sentences_keeps_abbreviations_and_initialisms():
+    assert [sentence.strip() for sentence in split_sentences(SCRIPT)] == [
+        "NVIDIA Corp. rose 6.9% in the U.S. market.",
+        "Apple Inc. fell!",
+        "Jensen H. Huang spoke at 5 p.m. today.",
+        "Shares are up.",
+        "Is it over?",
+    ]
+
+
+@pytest.mark.parametrize("text", ["Revenue rose 6.9% to $35.1 billion.", "Shares fell vs. the index.",
+                                  "Trading ends at 4 p.m. on Friday."])
+def test_split_sentences_does_not_split_inside_a_sentence(text):
+    assert split_sentences(text) == [text]
+
+
+def test_chunks_pack_sentences_up_to_the_limit():
+    assert split_text_into_chunks(SCRIPT, max_chars=60) == [
+        "NVIDIA Corp. rose 6.9% in the U.S. market. Apple Inc. fell!",
+        "Jensen H. Huang spoke at 5 p.m. today. Shares are up.",
+        "Is it over?",
+    ]
+    assert split_text_into_chunks(SCRIPT) == [SCRIPT]
+
+
+def test_chunks_without_packing_are_sentences():
+    assert len(split_text_into_chunks(SCRIPT, pack=False)) == 5
+
+
+def test_long_sentence_is_split_between_words():
+    chunks = split_text_into_chunks("word " * 50, max_chars=40)
+    assert all(len(chunk) <= 40 for chunk in chunks)
+    assert " ".join(chunks).split() == ["word"] * 50
+
+
+def streaming_body(data):
+    return StreamingBody(io.BytesIO(data), len(data))
+
+
+def test_synthesize_requests_audio_and_speech_marks():
+    polly_client = boto3.client('polly', region_name='us-east-1', aws_access_key_id="test",
+                                aws_secret_access_key="test")
+    marks = [{"time": 0, "type": "sentence", "value": "Hi."}, {"time": 5, "type": "word", "value": "Hi."}]
+    with Stubber(polly_client) as stubber:
+        stubber.add_response('synthesize_speech', {'AudioStream': streaming_body(b"mp3")},
+                             {'Text': "Hi.", 'OutputFormat': 'mp3', 'VoiceId': audio_synthesis.POLLY_VOICE_ID,
+                              'Engine': audio_synthesis.POLLY_ENGINE})
+        stubber.add_response('synthesize_speech', {'AudioStream': streaming_body(
+            "\n".join(json.dumps(mark) for mark in marks).encode('utf-8'))},
+                             {'Text': "Hi.", 'OutputFormat': 'json', 'SpeechMarkTypes': ['word', 'sentence'],
+                              'VoiceId': audio_synthesis.POLLY_VOICE_ID, 'Engine': audio_synthesis.POLLY_ENGINE})
+        assert synthesize_audio(polly_client, "Hi.") == b"mp3"
+        assert synthesize_speech_marks(polly_client, "Hi.") == marks
+
+
+def test_build_sentences_shifts_marks_by_the_chunk_offset():
+    marks = [{"time": 0, "type": "sentence", "value": "Shares rose."},
+             {"time": 10, "type": "word", "value": "Shares"}, {"time": 400, "type": "word", "value": "rose."},
+             {"time": 900, "type": "sentence", "value": "Done."}, {"time": 910, "type": "word", "value": "Done."}]
+    sentences = build_sentences(marks, 1500, offset_ms=2000)
+    assert [(sentence["sentence"], sentence["start"], sentence["end"]) for sentence in sentences] == \
+        [("Shares rose.", 2000, 2900), ("Done.", 2900, 3500)]
+    assert [(word["word"], word["start"], word["end"]) for word in sentences[0]["words_in_sentence"]] == \
+        [("Shares", 2010, 2400), ("rose.", 2400, 2900)]
+    assert sentences[1]["words_in_sentence"][0]["end"] == 3500
+
+
+class FakePolly:
+    # every sentence is 300 ms of silence, requests take a while so concurrent ones overlap
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def synthesize_speech(self, Text, OutputFormat, VoiceId, Engine, SpeechMarkTypes=None):
+        with self.lock:
+            self.requests.append((OutputFormat, Text))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        sentences = split_sentences(Text)
+        if OutputFormat == 'mp3':
+            audio = io.BytesIO()
+            AudioSegment.silent(duration=300 * len(sentences), frame_rate=22050).export(audio, format="mp3")
+            body = audio.getvalue()
+        else:
+            marks = []
+            for i, sentence in enumerate(sentences):
+                marks.append({"time": 300 * i, "type": "sentence", "value": sentence})
+                marks += [{"time": 300 * i + 50 * j, "type": "word", "value": word}
+                          for j, word in enumerate(sentence.split())]
+            body = "\n".join(json.dumps(mark) for mark in marks).encode('utf-8')
+        with self.lock:
+            self.in_flight -= 1
+        return {"AudioStream": io.BytesIO(body)}
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(audio_synthesis, "split_text_into_chunks",
+                        functools.partial(split_text_into_chunks, max_chars=60))
+
+
+@needs_ffmpeg
+def test_chunks_are_synthesized_concurrently_and_stitched_in_order(tmp_path, small_chunks, monkeypatch):
+    monkeypatch.setenv('TTS_CACHE_DISABLED', "1")
+    polly = FakePolly()
+    sentences, audio_segment = synthesize_text(SCRIPT, str(tmp_path / "audio.mp3"), polly_client=polly,
+                                               word_timings='polly')
+
+    assert len(polly.requests) == 6
+    assert polly.max_in_flight > 1
+    assert [sentence["sentence"] for sentence in sentences] == \
+        [sentence.strip() for sentence in split_sentences(SCRIPT)]
+    # the marks of each chunk are shifted by the decoded length of the chunks before it
+    # (two sentences of 300 ms each in the first two chunks, mp3 decoding may add a little padding)
+    starts = [sentence["start"] for sentence in sentences]
+    assert starts[:2] == [0, 300]
+    assert 600 <= starts[2] < 700 and starts[3] == starts[2] + 300
+    assert 1200 <= starts[4] < 1400
+    assert sentences[-1]["end"] == len(audio_segment)
+
+
+@needs_ffmpeg
+def test_cached_chunks_are_not_synthesized_again(tmp_path, small_chunks):
+    tts_cache = ResponseCache(path=str(tmp_path / "tts.sqlite"))
+    first_polly, second_polly = FakePolly(), FakePolly()
+    first, _ = synthesize_text(SCRIPT, str(tmp_path / "first.mp3"), polly_client=first_polly, tts_cache=tts_cache,
+                               word_timings='polly')
+    second, _ = synthesize_text(SCRIPT, str(tmp_path / "second.mp3"), polly_client=second_polly,
+                                tts_cache=tts_cache, word_timings='polly')
+
+    # with the cache on every sentence is its own request and entry
+    assert len(first_polly.requests) == 10
+    assert second_polly.requests == []
+    assert first == second
+
+
+@needs_ffmpeg
+def test_editing_one_sentence_synthesizes_only_that_sentence(tmp_path):
+    tts_cache = ResponseCache(path=str(tmp_path / "tts.sqlite"))
+    synthesize_text(SCRIPT, str(tmp_path / "first.mp3"), polly_client=FakePolly(), tts_cache=tts_cache,
+                    word_timings='polly')
+    polly = FakePolly()
+    sentences, _ = synthesize_text(SCRIPT.replace("Shares are up.", "Shares are down."), str(tmp_path / "second.mp3"),
+                                   polly_client=polly, tts_cache=tts_cache, word_timings='polly')
+
+    assert sorted(polly.requests) == [("json", "Shares are down."), ("mp3", "Shares are down.")]
+    assert [sentence["sentence"] for sentence in sentences][3] == "Shares are down."
@@ -0,0 +1,125 @@
+import asyncio
+import datetime
+
+import pytest
+
+import create_content
+from create_content import collect_news_async, get_news_fingerprint
+from utils.article_store import ArticleStore
+from utils.consts import MARKET_TIME_ZONE
+from utils.stock_market_time import StockMarketTime
+
+NOW = MARKET_TIME_ZONE.localize(datetime.datetime(2026, 10, 20, 9, 0))
+
+
+class FakeFetcher:
+    def __init__(self, text_by_url):
+        self.text_by_url = text_by_url
+        self.fetched = []
+
+    async def fetch_all(self, urls):
+        self.fetched.extend(sorted(urls))
+        return {url: self.text_by_url[url] for url in urls}
+
+
+def news_item(link, hours_ago=1):
+    return {"title": link, "link": link, "providerPublishTime": (NOW - datetime.timedelta(hours=hours_ago)).timestamp()}
+
+
+def collect(news, fetcher, store):
+    return asyncio.run(collect_news_async("NVDA", StockMarketTime(NOW), fetcher, store, lambda symbol: news))
+
+
+def test_news_without_a_link_is_ignored(tmp_path):
+    store = ArticleStore(path=str(tmp_path / "articles.sqlite"))
+    fetcher = FakeFetcher({"https://example.com/a": "Article A."})
+    relevant_news, text_by_link = collect([news_item("https://example.com/a"), news_item("")], fetcher, store)
+    assert [item["link"] for item in relevant_news] == ["https://example.com/a"]
+    assert text_by_link == {"https://example.com/a": "Article A."}
+
+
+def test_fingerprint_changes_with_the_news(tmp_path):
+    store = ArticleStore(path=str(tmp_path / "articles.sqlite"))
+    fetcher = FakeFetcher({"https://example.com/a": "Article A.", "https://example.com/b": "Article B."})
+    first = get_news_fingerprint(collect([news_item("https://example.com/a")], fetcher, store))
+    again = get_news_fingerprint(collect([news_item("https://www.example.com/a?utm_source=x")], fetcher, store))
+    more = get_news_fingerprint(collect([news_item("https://example.com/a"), news_item("https://example.com/b")],
+                                        fetcher, store))
+
+    assert first == again
+    assert more != first
+    # stored articles are not fetched again
+    assert fetcher.fetched == ["https://example.com/a", "https://example.com/b"]
+
+
+def test_fingerprint_covers_article_content():
+    news = [news_item("https://example.com/a")]
+    assert get_news_fingerprint((news, {"https://example.com/a": "Old text."})) != \
+        get_news_fingerprint((news, {"https://example.com/a": "Edited text."}))
+    assert get_news_fingerprint(([], {})) == []
+
+
+class FakeTieredArticleFetcher:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeClient:
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    monkeypatch.setattr(create_content, "TieredArticleFetcher", FakeTieredArticleFetcher)
+    monkeypatch.setattr(create_content, "get_openai_client", FakeClient)
+    monkeypatch.setattr(create_content, "save_to_temp_file", lambda text, name: None)
+    monkeypatch.setattr(create_content, "format_price_data", lambda symbol, analytics: f"{symbol} {analytics}")
+
+    async def get_stock_data_async(stock_symbol, company_name, stock_market_time, fetcher, client, price_data):
+        return price_data
+
+    monkeypatch.setattr(create_content, "get_stock_data_async", get_stock_data_async)
+    monkeypatch.setattr(create_content, "generate_stock_opening_analysis",
+                        lambda stock_info, company_name, stock_symbol, client: f"Analysis of {stock_info}")
+    return monkeypatch
+
+
+def test_failed_bulk_price_download_only_fails_the_bad_symbol(batch):
+    downloads = []
+
+    def update_bar_stores(symbols):
+        downloads.append(list(symbols))
+        if "BAD" in symbols:
+            raise ValueError("download failed")
+        return {symbol: 1 for symbol in symbols}
+
+    batch.setattr(create_content, "update_bar_stores", update_bar_stores)
+    batch.setattr(create_content, "compute_premarket_analytics",
+                  lambda symbols, last_time_closed, next_time_open: {symbol: "analytics" for symbol in symbols})
+
+    results = create_content.create_contents({"NVDA": "NVIDIA", "BAD": "Bad", "AAPL": "Apple"},
+                                             mock_data_input_now=NOW)
+
+    assert downloads == [["NVDA", "BAD", "AAPL"], ["NVDA"], ["BAD"], ["AAPL"]]
+    assert results["NVDA"] == "Analysis of NVDA analytics"
+    assert results["AAPL"] == "Analysis of AAPL analytics"
+    assert isinstance(results["BAD"], ValueError)
+
+
+def test_failed_analytics_only_fails_the_bad_symbol(batch):
+    def compute_premarket_analytics(symbols, last_time_closed, next_time_open):
+        if "BAD" in symbols:
+            raise KeyError("BAD")
+        return {symbol: "analytics" for symbol in symbols}
+
+    batch.setattr(create_content, "update_bar_stores", lambda symbols: {})
+    batch.setattr(create_content, "compute_premarket_analytics", compute_premarket_analytics)
+
+    results = create_content.create_contents({"NVDA": "NVIDIA", "BAD": "Bad"}, mock_data_input_now=NOW)
+
+    assert results["NVDA"] == "Analysis of NVDA analytics"
+    assert isinstance(results["BAD"], KeyError)
@@ -0,0 +1,154 @@
+import asyncio
+import datetime
+import json
+
+import pytest
+
+import create_content
+import daemon
+from utils.article_store import ArticleStore
+from utils.consts import MARKET_TIME_ZONE
+
+
+def market_time(day, hour, minute=0):
+    return MARKET_TIME_ZONE.localize(datetime.datetime(2026, 10, day, hour, minute))
+
+
+class FakeFetcher:
+    def __init__(self, clock):
+        self.clock = clock
+        self.fetches = []
+
+    async def fetch_all(self, urls):
+        self.fetches.append((self.clock.now(), sorted(urls)))
+        return {url: f"Full article text for {url}. " * 20 for url in urls}
+
+
+class FakeClient:
+    def __init__(self):
+        self.prompts = 0
+
+    async def agenerate_text(self, prompt, model="gpt-4o-mini", response_format=None, priority=None):
+        self.prompts += 1
+        return json.dumps({"relevant": True, "summary": "Shares rose on the news."})
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def night(tmp_path, monkeypatch):
+    # three articles published over a Monday night before a 9:00 trigger on Tuesday
+    store = ArticleStore(path=str(tmp_path / "articles.sqlite"))
+    monkeypatch.setattr(create_content, "get_article_store", lambda: store)
+    fixture_path = tmp_path / "news.json"
+    fixture_path.write_text(json.dumps({"NVDA": [
+        {"title": "Evening", "link": "https://example.com/evening", "providerPublishTime":
+            market_time(19, 19, 5).timestamp()},
+        {"title": "Night", "link": "https://example.com/night?utm_source=feed", "providerPublishTime":
+            market_time(19, 23, 30).timestamp()},
+        {"title": "Late", "link": "https://example.com/late", "providerPublishTime":
+            market_time(20, 8, 59).timestamp()},
+    ]}))
+    clock = daemon.FakeClock(market_time(19, 18))
+    return clock, daemon.FixtureNewsFeed(str(fixture_path), clock)
+
+
+def test_fixture_news_feed_only_returns_published_items(night):
+    clock, news_feed = night
+    assert news_feed("NVDA") == []
+    clock.current = market_time(20, 0)
+    assert [news_item["title"] for news_item in news_feed("NVDA")] == ["Evening", "Night"]
+    assert news_feed("AAPL") == []
+
+
+def test_fake_clock_sleep_advances_time():
+    clock = daemon.FakeClock(market_time(19, 18))
+    asyncio.run(clock.sleep(90))
+    assert clock.now() == market_time(19, 18, 1) + datetime.timedelta(seconds=30)
+
+
+def test_daemon_polls_overnight_and_produces_at_trigger(night):
+    clock, news_feed = night
+    fetcher = FakeFetcher(clock)
+    client = FakeClient()
+    triggers = []
+
+    async def produce(trigger):
+        triggers.append((trigger, clock.now()))
+        return {"NVDA": "video.mp4"}
+
+    pre_open_daemon = daemon.PreOpenDaemon({"NVDA": "NVIDIA Corporation"}, poll_interval=60 * 60, clock=clock,
+                                           news_feed=news_feed, client=client, fetcher=fetcher, produce=produce)
+    asyncio.run(pre_open_daemon.run(max_triggers=1))
+
+    assert triggers == [(market_time(20, 9), market_time(20, 9))]
+    # every article is fetched and reviewed once, in the first poll after it was published
+    fetched = [url for _, urls in fetcher.fetches for url in urls]
+    assert sorted(fetched) == ["https://example.com/evening", "https://example.com/late",
+                               "https://example.com/night?utm_source=feed"]
+    assert client.prompts == 3
+    assert pre_open_daemon.polls == 16
+
+
+def test_final_stages_use_the_warm_fetcher_for_late_news(night, monkeypatch):
+    clock, news_feed = night
+    fetcher = FakeFetcher(clock)
+    client = FakeClient()
+    pipeline_calls = []
+    monkeypatch.setattr(create_content, "get_price_data", lambda stock_symbol, stock_market_time: "Price data")
+    monkeypatch.setattr(daemon, "run_pipeline", lambda *args, **kwargs: pipeline_calls.append((args, kwargs)) or
+                        (None, None, None, ["results/NVDA/output_video.mp4"]))
+
+    pre_open_daemon = daemon.PreOpenDaemon({"NVDA": "NVIDIA Corporation"}, clock=clock, news_feed=news_feed,
+                                           client=client, fetcher=fetcher)
+    clock.current = market_time(20, 1)
+    asyncio.run(pre_open_daemon.poll_once())
+    clock.current = market_time(20, 9)
+    results = asyncio.run(pre_open_daemon.run_final_stages(market_time(20, 9)))
+
+    assert results == {"NVDA": ["results/NVDA/output_video.mp4"]}
+    assert fetcher.fetches[-1] == (market_time(20, 9), ["https://example.com/late"])
+    assert client.prompts == 3
+    (args, kwargs), = pipeline_calls
+    assert args[:3] == ("NVDA", "NVIDIA Corporation", market_time(20, 9))
+    assert "Price data" in kwargs["stock_info"]
+    assert kwargs["stock_info"].count("Shares rose on the news.") == 3
+
+
+def test_next_trigger_keeps_wall_clock_time_across_the_dst_change():
+    # Saturday 2026-10-31, DST ends on Sunday 2026-11-01, the next trading day is Monday
+    clock = daemon.FakeClock(market_time(31, 18))
+    pre_open_daemon = daemon.PreOpenDaemon({"NVDA": "NVIDIA Corporation"}, clock=clock, client=FakeClient())
+
+    trigger = pre_open_daemon.next_trigger()
+
+    assert trigger == MARKET_TIME_ZONE.localize(datetime.datetime(2026, 11, 2, 9, 0))
+    assert trigger.utcoffset() == datetime.timedelta(hours=-5)
+
+
+def test_next_trigger_skips_weekends_and_market_holidays():
+    clock = daemon.FakeClock(MARKET_TIME_ZONE.localize(datetime.datetime(2026, 11, 25, 10, 0)))
+    pre_open_daemon = daemon.PreOpenDaemon({"NVDA": "NVIDIA Corporation"}, clock=clock, client=FakeClient())
+
+    # Thanksgiving on Thursday, the market opens again on Friday
+    assert pre_open_daemon.next_trigger() == MARKET_TIME_ZONE.localize(datetime.datetime(2026, 11, 27, 9, 0))
+    clock.current = MARKET_TIME_ZONE.localize(datetime.datetime(2026, 11, 27, 9, 0))
+    assert pre_open_daemon.next_trigger() == MARKET_TIME_ZONE.localize(datetime.datetime(2026, 11, 30, 9, 0))
+
+
+def test_daemon_fires_at_local_trigger_time_after_the_dst_change():
+    clock = daemon.FakeClock(market_time(31, 18))
+    triggers = []
+
+    async def produce(trigger):
+        triggers.append(clock.now())
+        return {}
+
+    pre_open_daemon = daemon.PreOpenDaemon({}, poll_interval=60 * 60, clock=clock, client=FakeClient(),
+                                           fetcher=FakeFetcher(clock), produce=produce)
+    asyncio.run(pre_open_daemon.run(max_triggers=1))
+
+    now, = triggers
+    assert (now.hour, now.minute, now.utcoffset()) == (9, 0, datetime.timedelta(hours=-5))
+    assert now.date() == datetime.date(2026, 11, 2)
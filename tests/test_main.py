@@ -0,0 +1,89 @@
+import datetime
+
+import pytest
+
+import main
+from utils.consts import MARKET_TIME_ZONE
+
+NOW = MARKET_TIME_ZONE.localize(datetime.datetime(2026, 10, 20, 9, 0))
+NEWS = ([{"title": "Earnings", "link": "https://example.com/a", "providerPublishTime": NOW.timestamp() - 3600}],
+        {"https://example.com/a": "Earnings beat estimates."})
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    # every stage is faked, the calls show which stages were rebuilt
+    monkeypatch.chdir(tmp_path)
+    calls = {"stock_info": 0, "analysis": 0, "audio": 0, "render": 0}
+    prices = {"last_bar": "08:58"}
+
+    async def collect_news_async(stock_symbol, stock_market_time, news_feed=None):
+        return NEWS
+
+    def get_stock_info(stock_market_time, stock_symbol, company_name, use_temp_file, client, news_feed,
+                       collected_news, price_data):
+        calls["stock_info"] += 1
+        return f"{price_data}\n{collected_news[1]}"
+
+    def generate_stock_opening_analysis(stock_info, company_name, stock_symbol, client):
+        calls["analysis"] += 1
+        return f"Analysis of {stock_info}."
+
+    def synthesize_text(text, audio_path, wav_audio_path=None):
+        calls["audio"] += 1
+        with open(audio_path, 'wb') as file:
+            file.write(b"mp3")
+        return [{"sentence": text, "start": 0, "end": 1000, "words_in_sentence": []}], None
+
+    def render_video(audio_path, video_path, *args):
+        calls["render"] += 1
+        with open(video_path, 'wb') as file:
+            file.write(b"mp4")
+
+    monkeypatch.setattr(main, "collect_news_async", collect_news_async)
+    monkeypatch.setattr(main, "get_price_data",
+                        lambda stock_symbol, stock_market_time: f"Last pre-market bar at {prices['last_bar']}")
+    monkeypatch.setattr(main, "get_stock_info", get_stock_info)
+    monkeypatch.setattr(main, "generate_stock_opening_analysis", generate_stock_opening_analysis)
+    monkeypatch.setattr(main, "synthesize_text", synthesize_text)
+    monkeypatch.setattr(main, "match_sentences_to_videos",
+                        lambda sentences, engine, client: ["Chip_Closeup.mp4"] * len(sentences))
+    monkeypatch.setattr(main, "render_video", render_video)
+    return calls, prices
+
+
+def test_rerun_with_unchanged_inputs_reuses_every_stage(pipeline):
+    calls, _ = pipeline
+    main.run_pipeline(mock_data_input_now=NOW)
+    main.run_pipeline(mock_data_input_now=NOW)
+    assert calls == {"stock_info": 1, "analysis": 1, "audio": 1, "render": 1}
+
+
+def test_newer_bar_with_the_same_news_rebuilds_stock_info_and_analysis(pipeline):
+    calls, prices = pipeline
+    main.run_pipeline(mock_data_input_now=NOW)
+    prices["last_bar"] = "08:59"
+    _, sentences_list_with_timings, _, _ = main.run_pipeline(mock_data_input_now=NOW)
+
+    assert calls == {"stock_info": 2, "analysis": 2, "audio": 2, "render": 2}
+    assert "08:59" in sentences_list_with_timings[0]["sentence"]
+
+
+@pytest.mark.parametrize("flags", [["--profiles", "vertical"], ["--export-wav"], ["--render-backend", "ffmpeg"],
+                                   ["--force", "render"]])
+def test_stream_rejects_flags_it_cannot_honour(flags, monkeypatch):
+    monkeypatch.setattr("sys.argv", ["main.py", "--stream", *flags])
+    with pytest.raises(SystemExit):
+        main.parse_args()
+
+
+def test_stream_accepts_forcing_the_stock_info_stage(monkeypatch):
+    monkeypatch.setattr("sys.argv", ["main.py", "--stream", "--force", "stock_info"])
+    assert main.parse_args().force == ["stock_info"]
+
+
+@pytest.mark.parametrize("flags", [["--render-backend", "chunked"], ["--render-workers", "4"], ["--check-equivalence"]])
+def test_profiles_reject_backend_flags(flags, monkeypatch):
+    monkeypatch.setattr("sys.argv", ["main.py", "--profiles", "landscape", "vertical", *flags])
+    with pytest.raises(SystemExit):
+        main.parse_args()
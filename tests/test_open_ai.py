@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import openai
+import pytest
+
+from tests.fakes import chat_completion_stream
+from utils.open_ai import OpenAIClient, review_article_async
+from utils.request_scheduler import RequestScheduler
+from utils.response_cache import ResponseCache
+
+
+class FakeClient:
+    def __init__(self, response):
+        self.response = response
+
+    async def agenerate_text(self, prompt, model="gpt-4o-mini", response_format=None, priority=None):
+        return self.response
+
+
+def review(response):
+    return asyncio.run(review_article_async("Article text.", "https://example.com/a", "NVIDIA", "NVDA",
+                                            FakeClient(response)))
+
+
+def test_relevant_review_keeps_summary():
+    assert review(json.dumps({"relevant": True, "summary": " Shares rose. "})) == \
+        {"relevant": True, "summary": "Shares rose."}
+
+
+def test_irrelevant_review_has_no_summary():
+    assert review(json.dumps({"relevant": False, "summary": {"ignored": 1}})) == {"relevant": False, "summary": None}
+
+
+@pytest.mark.parametrize("summary", [{"1": "Shares rose."}, ["Shares rose."], "", "   ", None, 3])
+def test_unusable_summary_is_not_a_review(summary):
+    assert review(json.dumps({"relevant": True, "summary": summary})) is None
+
+
+@pytest.mark.parametrize("response", [None, "not json", "[1, 2]"])
+def test_unparseable_response_is_not_a_review(response):
+    assert review(response) is None
+
+
+def test_async_client_is_pooled_per_event_loop(monkeypatch):
+    monkeypatch.setenv('OPEN_AI_TOKEN', "test")
+    monkeypatch.setenv('OPEN_AI_CACHE_DISABLED', "1")
+    client = OpenAIClient()
+
+    async def use_twice():
+        first, second = client.async_client, client.async_client
+        return first, second
+
+    async def use_and_close():
+        async_client = client.async_client
+        await client.aclose()
+        return async_client
+
+    first, second = asyncio.run(use_twice())
+    other, _ = asyncio.run(use_twice())
+    assert first is second
+    assert other is not first
+    assert asyncio.run(use_and_close()).is_closed()
+
+
+@pytest.fixture
+def streaming_client(fake_endpoint, monkeypatch, tmp_path):
+    def start(responses):
+        endpoint = fake_endpoint(responses)
+        monkeypatch.setenv('OPEN_AI_BASE_URL', f"{endpoint.url}/v1")
+        monkeypatch.setenv('OPEN_AI_TOKEN', "test")
+        return OpenAIClient(cache=ResponseCache(path=str(tmp_path / "cache.sqlite")),
+                            scheduler=RequestScheduler("test", max_retries=0))
+
+    return start
+
+
+def test_streamed_completion_is_cached(streaming_client):
+    client = streaming_client([chat_completion_stream(["NVDA rose ", "6.9%."])])
+    assert list(client.stream_text("prompt")) == ["NVDA rose ", "6.9%."]
+    assert list(client.stream_text("prompt")) == ["NVDA rose 6.9%."]
+
+
+def test_stream_failing_partway_raises_and_is_not_cached(streaming_client):
+    client = streaming_client([chat_completion_stream(["NVDA rose ", "6.9%. Shares of"], error="connection lost"),
+                               chat_completion_stream(["NVDA rose 6.9%."])])
+    deltas = []
+    with pytest.raises(openai.APIError):
+        for delta in client.stream_text("prompt"):
+            deltas.append(delta)
+    assert deltas == ["NVDA rose ", "6.9%. Shares of"]
+    assert list(client.stream_text("prompt")) == ["NVDA rose 6.9%."]
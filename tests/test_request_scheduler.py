@@ -0,0 +1,175 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+import pytest
+
+import audio_synthesis
+from tests.fakes import chat_completion
+from utils.request_scheduler import PRIORITY_HIGH, PRIORITY_LOW, RequestScheduler, TokenBucket
+
+
+RATE_LIMITED = (429, {"retry-after": "0.05"}, {"error": {"message": "rate limited"}})
+
+
+def create_completion(client, prompt):
+    return client.chat.completions.create(messages=[{"role": "user", "content": prompt}], model="gpt-4o-mini")
+
+
+def test_rate_limited_requests_are_retried(fake_endpoint):
+    endpoint = fake_endpoint([RATE_LIMITED, RATE_LIMITED, chat_completion("True")])
+    client = openai.OpenAI(base_url=f"{endpoint.url}/v1", api_key="test", max_retries=0)
+    scheduler = RequestScheduler("test", max_retries=3)
+
+    response = scheduler.call(create_completion, client, "prompt")
+    assert response.choices[0].message.content == "True"
+    assert len(endpoint.requests) == 3
+    assert scheduler.stats()["retries"] == 2
+    assert scheduler.stats()["failures"] == 0
+
+
+def test_requests_give_up_after_max_retries(fake_endpoint):
+    endpoint = fake_endpoint([(503, {"retry-after": "0"}, {"error": {"message": "unavailable"}})])
+    client = openai.OpenAI(base_url=f"{endpoint.url}/v1", api_key="test", max_retries=0)
+    scheduler = RequestScheduler("test", max_retries=2)
+
+    with pytest.raises(openai.InternalServerError):
+        scheduler.call(create_completion, client, "prompt")
+    assert len(endpoint.requests) == 3
+    assert scheduler.stats()["failures"] == 1
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_client_errors_are_not_retried(fake_endpoint):
+    endpoint = fake_endpoint([(400, {}, {"error": {"message": "bad request"}})])
+    client = openai.OpenAI(base_url=f"{endpoint.url}/v1", api_key="test", max_retries=0)
+    scheduler = RequestScheduler("test", max_retries=3)
+
+    with pytest.raises(openai.BadRequestError):
+        scheduler.call(create_completion, client, "prompt")
+    assert len(endpoint.requests) == 1
+
+
+def test_open_ai_client_goes_through_the_scheduler(fake_endpoint, monkeypatch):
+    from utils.open_ai import OpenAIClient
+    endpoint = fake_endpoint([RATE_LIMITED, chat_completion("True")])
+    monkeypatch.setenv('OPEN_AI_BASE_URL', f"{endpoint.url}/v1")
+    monkeypatch.setenv('OPEN_AI_TOKEN', "test")
+    monkeypatch.setenv('OPEN_AI_CACHE_DISABLED', "1")
+    scheduler = RequestScheduler("test", max_retries=3)
+
+    client = OpenAIClient(scheduler=scheduler)
+    assert client.generate_text("prompt") == "True"
+    assert asyncio.run(client.agenerate_text("prompt")) == "True"
+    assert scheduler.stats()["completed"] == 3
+
+
+def test_many_async_requests_do_not_starve_the_default_executor(fake_endpoint):
+    # 40 queued requests on a 1-CPU sized default executor, new connections resolve "localhost" through it
+    endpoint = fake_endpoint([chat_completion("ok")])
+    scheduler = RequestScheduler("test", max_concurrency=16)
+
+    async def run():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=5))
+        async with openai.AsyncOpenAI(base_url=f"{endpoint.url}/v1", api_key="test", max_retries=0) as client:
+            responses = await asyncio.wait_for(asyncio.gather(*(
+                scheduler.acall(client.chat.completions.create, messages=[{"role": "user", "content": str(i)}],
+                                model="gpt-4o-mini")
+                for i in range(40))), timeout=30)
+        return [response.choices[0].message.content for response in responses]
+
+    assert asyncio.run(run()) == ["ok"] * 40
+    assert scheduler.stats()["completed"] == 40
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    scheduler = RequestScheduler("test", max_concurrency=1)
+
+    async def run():
+        await scheduler.aacquire()
+        waiter = asyncio.create_task(scheduler.aacquire())
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["queue_depth"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()["queue_depth"] == 0
+        scheduler.release()
+        await asyncio.wait_for(scheduler.aacquire(), timeout=1)
+        scheduler.release()
+
+    asyncio.run(run())
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_higher_priority_is_admitted_first():
+    scheduler = RequestScheduler("test", max_concurrency=1)
+    scheduler.acquire()
+    order = []
+
+    def request(priority):
+        scheduler.acquire(priority)
+        order.append(priority)
+        scheduler.release()
+
+    threads = [threading.Thread(target=request, args=(priority,))
+               for priority in (PRIORITY_LOW, PRIORITY_LOW, PRIORITY_HIGH)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    scheduler.release()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert order == [PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_LOW]
+
+
+def test_sync_and_async_waiters_share_the_limit():
+    scheduler = RequestScheduler("test", max_concurrency=1)
+    scheduler.acquire()
+
+    async def run():
+        waiter = asyncio.create_task(scheduler.aacquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        threading.Timer(0.02, scheduler.release).start()
+        await asyncio.wait_for(waiter, timeout=1)
+        scheduler.release()
+
+    asyncio.run(run())
+    assert scheduler.stats()["completed"] == 2
+
+
+def test_request_bucket_spaces_requests():
+    scheduler = RequestScheduler("test", requests_per_minute=600)
+    scheduler.requests.available = 0
+    start = time.monotonic()
+    scheduler.acquire()
+    assert time.monotonic() - start >= 0.08
+    scheduler.release()
+
+
+def test_token_bucket_caps_oversized_requests():
+    bucket = TokenBucket(60)
+    bucket.take(1000)
+    assert bucket.available == 0
+    assert bucket.wait_time(1000) == pytest.approx(60)
+    assert TokenBucket(None).wait_time(10 ** 6) == 0
+
+
+def test_polly_throttling_is_retried_only_by_the_scheduler(fake_endpoint, monkeypatch):
+    throttled = (400, {"x-amzn-ErrorType": "ThrottlingException"}, {"message": "Rate exceeded"})
+    endpoint = fake_endpoint([throttled, (200, {"Content-Type": "audio/mpeg"}, b"mp3 bytes")])
+    monkeypatch.setenv('POLLY_ENDPOINT_URL', endpoint.url)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', "test")
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', "test")
+    monkeypatch.setattr(audio_synthesis, "_polly_client", None)
+    scheduler = RequestScheduler("polly", base_delay=0.01)
+    monkeypatch.setattr(audio_synthesis, "get_scheduler", lambda provider: scheduler)
+
+    assert audio_synthesis.synthesize_audio(audio_synthesis.get_polly_client(), "Hello.") == b"mp3 bytes"
+    assert len(endpoint.requests) == 2
+    assert scheduler.stats()["retries"] == 1
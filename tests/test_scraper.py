@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from utils.scraper import ArticleScraper, TieredArticleFetcher
+
+PARAGRAPH = ("NVIDIA reported record data center revenue for the quarter as demand for its accelerators kept "
+             "growing across every major cloud provider.")
+ARTICLE = f"""<html><head><title>NVIDIA earnings</title></head><body>
+<nav>Markets News Videos</nav>
+<article>{"".join(f"<p>{PARAGRAPH}</p>" for _ in range(6))}</article>
+<div class="share-bar"><p>Share this story with your followers on every network.</p></div>
+</body></html>"""
+CLIENT_RENDERED = "<html><body><div id='root'></div><script>render()</script></body></html>"
+HTML = {"Content-Type": "text/html"}
+
+
+class FakeScraper:
+    def __init__(self, text_by_url):
+        self.text_by_url = text_by_url
+        self.timings = {}
+        self.starts = 0
+        self.fetched = []
+
+    async def start(self):
+        self.starts += 1
+
+    async def close(self):
+        pass
+
+    async def fetch_all(self, urls):
+        self.fetched.extend(urls)
+        return {url: self.text_by_url.get(url) for url in urls}
+
+
+def test_static_articles_do_not_use_the_browser(fake_endpoint):
+    endpoint = fake_endpoint({"/article": (200, HTML, ARTICLE)})
+    scraper = FakeScraper({})
+
+    async def run():
+        async with TieredArticleFetcher(scraper=scraper) as fetcher:
+            return await fetcher.fetch_all([f"{endpoint.url}/article"])
+
+    text = asyncio.run(run())[f"{endpoint.url}/article"]
+    assert text.startswith("NVIDIA earnings")
+    assert text.count(PARAGRAPH) == 6
+    assert "Share this story" not in text
+    assert "Markets News Videos" not in text
+    assert scraper.fetched == []
+
+
+def test_short_and_failed_pages_fall_back_to_the_browser(fake_endpoint):
+    endpoint = fake_endpoint({"/article": (200, HTML, ARTICLE), "/app": (200, HTML, CLIENT_RENDERED)})
+    article_url, app_url, missing_url = (f"{endpoint.url}{path}" for path in ("/article", "/app", "/missing"))
+    browser_text = PARAGRAPH * 5
+    scraper = FakeScraper({app_url: browser_text, missing_url: None})
+
+    async def run():
+        async with TieredArticleFetcher(scraper=scraper) as fetcher:
+            # two tickers sharing the fetcher at once
+            return await asyncio.gather(fetcher.fetch_all([article_url, app_url]), fetcher.fetch_all([missing_url]))
+
+    first, second = asyncio.run(run())
+    assert first[app_url] == browser_text
+    assert first[article_url].count(PARAGRAPH) == 6
+    assert second[missing_url] is None
+    assert sorted(scraper.fetched) == sorted([app_url, missing_url])
+
+
+class FakePage:
+    def __init__(self, texts):
+        self.texts = list(texts)
+        self.evaluations = 0
+
+    async def evaluate(self, script):
+        self.evaluations += 1
+        return self.texts.pop(0) if len(self.texts) > 1 else self.texts[0]
+
+
+def test_page_is_released_once_its_text_is_stable():
+    scraper = ArticleScraper(poll_interval=0, stable_polls=2)
+    page = FakePage(["", "Loading", "Article text", "Article text", "Article text", "Changed later"])
+    text = asyncio.run(scraper._wait_for_stable_text(page, time.monotonic() + 5))
+    assert text == "Article text"
+    assert page.evaluations == 5
+
+
+def test_page_text_is_returned_at_the_deadline():
+    scraper = ArticleScraper(poll_interval=0.01, stable_polls=2)
+    page = FakePage([f"Text {i}" for i in range(1000)])
+    text = asyncio.run(scraper._wait_for_stable_text(page, time.monotonic() + 0.1))
+    assert text.startswith("Text ")
+
+
+def test_browser_fetches_client_rendered_page(fake_endpoint):
+    page = "<html><body><script>setTimeout(() => document.body.innerText = 'Rendered article text.', 200)" \
+           "</script></body></html>"
+    endpoint = fake_endpoint({"/app": (200, HTML, page)})
+
+    async def run():
+        scraper = ArticleScraper(max_pages=1, consent_url=None, poll_interval=0.1)
+        try:
+            await scraper.start()
+        except Exception as e:
+            await scraper.close()
+            pytest.skip(f"No browser available: {e}")
+        try:
+            return await scraper.fetch_all([f"{endpoint.url}/app"])
+        finally:
+            await scraper.close()
+
+    assert asyncio.run(run()) == {f"{endpoint.url}/app": "Rendered article text."}
@@ -0,0 +1,119 @@
+import os
+from concurrent.futures import Future
+
+import pytest
+from pydub import AudioSegment
+
+import streaming_pipeline
+from streaming_pipeline import StreamingBriefing, split_sentence_stream
+
+
+def test_sentences_are_emitted_once_the_next_word_arrives():
+    deltas = ["NVIDIA Co", "rp. rose 6", ".9% in the U", ".S. mar", "ket. ", "Apple Inc. fell", "! Shares are up"]
+    assert list(split_sentence_stream(deltas)) == [
+        "NVIDIA Corp. rose 6.9% in the U.S. market.",
+        "Apple Inc. fell!",
+        "Shares are up",
+    ]
+
+
+def test_a_sentence_is_not_emitted_before_what_follows_it_is_known():
+    stream = split_sentence_stream(iter(["Shares of NVIDIA Corp.", " ", "rose. Apple", " fell."]))
+    assert next(stream) == "Shares of NVIDIA Corp. rose."
+    assert list(stream) == ["Apple fell."]
+
+
+def test_trailing_sentence_is_emitted_at_the_end_of_the_stream():
+    assert list(split_sentence_stream(["Shares rose. ", "Trading ends at 4 p.m.", "  "])) == \
+        ["Shares rose.", "Trading ends at 4 p.m."]
+    assert list(split_sentence_stream([])) == []
+
+
+class FakeStreamedSentence:
+    # `duration` ms of silence with one sentence mark and a word mark every 100 ms, ready once the future is set
+    def __init__(self, text, duration, video_name):
+        self.future = Future()
+        marks = [{"time": 0, "type": "sentence", "value": text}]
+        marks += [{"time": 100 * i, "type": "word", "value": word} for i, word in enumerate(text.split())]
+        self.value = (str(duration).encode('utf-8'), marks, video_name)
+
+    def finish(self):
+        self.future.set_result(self.value)
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+
+class FakeAudioSegment:
+    # the fake sentences carry their duration instead of mp3 bytes, so no ffmpeg is needed to decode them
+    @staticmethod
+    def from_file(file, format):
+        return AudioSegment.silent(duration=int(file.read()), frame_rate=22050)
+
+
+class FakeExecutor:
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, function, *args):
+        self.calls.append(args)
+        future = Future()
+        future.set_result(args[0])
+        return future
+
+
+@pytest.fixture
+def briefing(tmp_path, monkeypatch):
+    monkeypatch.setattr(streaming_pipeline, "AudioSegment", FakeAudioSegment)
+    monkeypatch.setattr(streaming_pipeline, "STREAM_CHUNK_SECONDS", 1.0)
+    return StreamingBriefing(str(tmp_path / "audio.mp3"), str(tmp_path / "video.mp4"), None, FakeExecutor(),
+                             str(tmp_path))
+
+
+def test_sentences_are_timed_in_generation_order_with_cumulative_offsets(briefing):
+    sentences = [FakeStreamedSentence("Shares rose sharply.", 700, "a.mp4"),
+                 FakeStreamedSentence("Apple fell.", 500, "b.mp4"),
+                 FakeStreamedSentence("Markets wait.", 600, "c.mp4")]
+    for sentence in sentences:
+        briefing.add(sentence)
+
+    # a later sentence that is ready waits for the ones generated before it
+    sentences[1].finish()
+    briefing.collect()
+    assert briefing.sentences_list_with_timings == []
+
+    sentences[0].finish()
+    sentences[2].finish()
+    briefing.collect()
+    assert [(sentence["sentence"], sentence["start"], sentence["end"], sentence["video_name"])
+            for sentence in briefing.sentences_list_with_timings] == [
+        ("Shares rose sharply.", 0, 700, "a.mp4"),
+        ("Apple fell.", 700, 1200, "b.mp4"),
+        ("Markets wait.", 1200, 1800, "c.mp4"),
+    ]
+    assert [(word["word"], word["start"], word["end"])
+            for word in briefing.sentences_list_with_timings[1]["words_in_sentence"]] == \
+        [("Apple", 700, 800), ("fell.", 800, 1200)]
+    assert briefing.offset_ms == 1800
+
+
+def test_chunks_are_submitted_on_frame_boundaries_as_audio_accumulates(briefing):
+    # durations on frame boundaries, a chunk ends at the end of the sentence that took it past a second
+    durations = [750, 500, 625, 875]
+    for i, duration in enumerate(durations):
+        sentence = FakeStreamedSentence(f"Sentence {i}.", duration, f"{i}.mp4")
+        sentence.finish()
+        briefing.add(sentence)
+        briefing.collect()
+    briefing.submit_chunk(None)
+
+    # (start, end, total audio duration, sentences known when the chunk was submitted)
+    chunks = [(start, end, total, len(sentences))
+              for _, start, end, total, sentences, _ in briefing.render_executor.calls]
+    assert chunks == [(0.0, 1.25, 1.25, 2), (1.25, 2.75, 2.75, 4), (2.75, None, 2.75, 4)]
+    assert [sentence["end"] for sentence in briefing.sentences_list_with_timings] == [750, 1250, 1875, 2750]
+    assert [os.path.basename(call[0]) for call in briefing.render_executor.calls] == \
+        ["chunk_000.mp4", "chunk_001.mp4", "chunk_002.mp4"]
@@ -0,0 +1,36 @@
+import pytest
+
+from utils.text_extraction import NOISE_PATTERN, extract_main_text, truncate_to_token_budget
+
+PARAGRAPH = "NVIDIA reported record data center revenue as demand for its accelerators kept growing."
+
+
+@pytest.mark.parametrize("attributes", ["share-bar", "social_links", "comments", "ad-slot", "site nav", "Sidebar",
+                                        "cookie-consent-banner", "related-articles"])
+def test_noise_tokens_match(attributes):
+    assert NOISE_PATTERN.search(attributes)
+
+
+@pytest.mark.parametrize("attributes", ["shareholder-letter", "canvas", "commentary", "headline", "loaded",
+                                        "navigator", "article-body"])
+def test_words_containing_noise_tokens_do_not_match(attributes):
+    assert not NOISE_PATTERN.search(attributes)
+
+
+def test_main_text_survives_in_a_container_named_like_noise():
+    html = f"""<html><head><title>Earnings</title></head><body>
+        <div class="share-bar"><p>Share this article on every social network you use today.</p></div>
+        <div class="commentary shareholder-letter"><p>{PARAGRAPH}</p><p>{PARAGRAPH}</p></div>
+        <div id="comments"><p>This is the first comment posted under the article by a reader.</p></div>
+    </body></html>"""
+    text = extract_main_text(html)
+    assert text.startswith("Earnings")
+    assert PARAGRAPH in text
+    assert "Share this article" not in text
+    assert "first comment" not in text
+
+
+def test_truncation_cuts_at_a_paragraph():
+    text = "A" * 300 + "\n\n" + "B" * 300
+    assert truncate_to_token_budget(text, 100) == "A" * 300
+    assert truncate_to_token_budget("short", 100) == "short"
@@ -0,0 +1,35 @@
+import pytest
+
+from video_creation import create_video, window_sentences
+
+SENTENCES = [
+    {"sentence": "The stock rose.", "start": 0, "end": 1500, "video_name": "a.mp4", "words_in_sentence": [
+        {"word": "The", "start": 0, "end": 400}, {"word": "stock", "start": 400, "end": 900},
+        {"word": "rose.", "start": 900, "end": 1500}]},
+    {"sentence": "Today.", "start": 1500, "end": 2600, "video_name": "b.mp4", "words_in_sentence": [
+        {"word": "Today.", "start": 1500, "end": 2600}]},
+]
+
+
+def test_window_keeps_overlapping_words_relative_to_its_start():
+    sentences = window_sentences(SENTENCES, 1.0, 2.0)
+    assert [[(word["word"], word["start"], word["end"]) for word in sentence["words_in_sentence"]]
+            for sentence in sentences] == [[("rose.", -100, 500)], [("Today.", 500, 1600)]]
+    assert sentences[0]["start"] == -1000
+
+
+def test_open_ended_window_runs_to_the_end():
+    sentences = window_sentences(SENTENCES, 1.5)
+    assert [sentence["sentence"] for sentence in sentences] == ["Today."]
+    assert sentences[0]["words_in_sentence"][0]["start"] == 0
+
+
+def test_window_does_not_modify_the_timeline():
+    window_sentences(SENTENCES, 1.0, 2.0)
+    assert SENTENCES[0]["words_in_sentence"][2] == {"word": "rose.", "start": 900, "end": 1500}
+
+
+@pytest.mark.parametrize("options", [{"backend": "ffmpeg"}, {"workers": 4}, {"caption_mode": "layers"}])
+def test_profiles_do_not_silently_drop_render_options(options):
+    with pytest.raises(ValueError):
+        create_video("audio.mp3", "video.mp4", SENTENCES, None, profiles=["landscape"], **options)
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+ARTICLE_STORE_PATH = "temp/cache/articles.sqlite"
+ARTICLE_RETENTION_DAYS = 14
+# sqlite limits the number of bound parameters per statement
+LOOKUP_BATCH_SIZE = 500
+TRACKING_PARAMS = {'guccounter', 'guce_referrer', 'guce_referrer_sig', 'ncid', 'soc_src', 'soc_trk', 'cmpid', '.tsrc',
+                   'yptr', 'fbclid', 'gclid'}
+
+_article_store = None
+_article_store_lock = threading.Lock()
+
+
+def canonicalize_url(url):
+    # the same story is linked with different tracking parameters, hosts with and without www and trailing slashes
+    parts = urlsplit(url.strip())
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS]
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return urlunsplit((parts.scheme.lower() or 'https', host, parts.path.rstrip('/') or '/',
+                       urlencode(sorted(query)), ''))
+
+
+def content_hash(text):
+    return hashlib.sha256(" ".join(text.split()).encode('utf-8')).hexdigest()
+
+
+def batched(items, size=LOOKUP_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ArticleStore:
+    # extracted article text keyed by canonical URL, relevance verdicts and summaries keyed by
+    # (content hash, symbol), so a syndicated copy of a story reuses the verdict and an edited article gets a new one
+    def __init__(self, path=ARTICLE_STORE_PATH, retention_days=ARTICLE_RETENTION_DAYS):
+        self.path = path
+        self.retention_seconds = retention_days * 24 * 60 * 60
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS articles ("
+                "url TEXT PRIMARY KEY, "
+                "content_hash TEXT NOT NULL, "
+                "text TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS reviews ("
+                "content_hash TEXT NOT NULL, "
+                "symbol TEXT NOT NULL, "
+                "relevant INTEGER NOT NULL, "
+                "summary TEXT, "
+                "reviewed_at REAL NOT NULL, "
+                "PRIMARY KEY (content_hash, symbol))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS articles_fetched_at ON articles (fetched_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS reviews_reviewed_at ON reviews (reviewed_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_texts(self, urls) -> dict:
+        # one query per batch of URLs, returns {url: text} for the URLs as given
+        urls_by_canonical = {}
+        for url in urls:
+            urls_by_canonical.setdefault(canonicalize_url(url), []).append(url)
+        text_by_url = {}
+        with closing(self._connect()) as connection:
+            for batch in batched(urls_by_canonical):
+                rows = connection.execute(
+                    f"SELECT url, text FROM articles WHERE url IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for canonical_url, text in rows:
+                    for url in urls_by_canonical[canonical_url]:
+                        text_by_url[url] = text
+        return text_by_url
+
+    def put_texts(self, text_by_url: dict):
+        now = time.time()
+        rows = [(canonicalize_url(url), content_hash(text), text, now) for url, text in text_by_url.items() if text]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO articles (url, content_hash, text, fetched_at) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def get_reviews(self, content_hashes, symbol) -> dict:
+        # returns {content hash: {"relevant": bool, "summary": str or None}}
+        reviews = {}
+        with closing(self._connect()) as connection:
+            for batch in batched(set(content_hashes)):
+                rows = connection.execute(
+                    f"SELECT content_hash, relevant, summary FROM reviews "
+                    f"WHERE symbol = ? AND content_hash IN ({','.join('?' * len(batch))})", [symbol, *batch]
+                ).fetchall()
+                for article_hash, relevant, summary in rows:
+                    reviews[article_hash] = {"relevant": bool(relevant), "summary": summary}
+        return reviews
+
+    def put_reviews(self, symbol, review_by_hash: dict):
+        now = time.time()
+        rows = [(article_hash, symbol, int(review["relevant"]), review["summary"], now)
+                for article_hash, review in review_by_hash.items() if review is not None]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO reviews (content_hash, symbol, relevant, summary, reviewed_at) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def prune(self):
+        cutoff = time.time() - self.retention_seconds
+        with closing(self._connect()) as connection, connection:
+            articles = connection.execute("DELETE FROM articles WHERE fetched_at < ?", (cutoff,)).rowcount
+            reviews = connection.execute("DELETE FROM reviews WHERE reviewed_at < ?", (cutoff,)).rowcount
+        if articles or reviews:
+            logging.info(f"Article store: pruned {articles} articles and {reviews} reviews older than retention.")
+
+
+def get_article_store():
+    global _article_store
+    if os.getenv('ARTICLE_STORE_DISABLED', '').lower() in ('1', 'true', 'yes'):
+        return None
+    with _article_store_lock:
+        if _article_store is None:
+            _article_store = ArticleStore(
+                path=os.getenv('ARTICLE_STORE_PATH', ARTICLE_STORE_PATH),
+                retention_days=float(os.getenv('ARTICLE_RETENTION_DAYS', ARTICLE_RETENTION_DAYS)),
+            )
+            _article_store.prune()
+        return _article_store
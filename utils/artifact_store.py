@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import shutil
+import time
+
+from utils.response_cache import make_cache_key
+
+ARTIFACT_DIR = "temp/artifacts"
+
+
+class ArtifactStore:
+    # every stage output lives in its own directory named by a hash of the stage inputs and config,
+    # the directory only appears once the stage finished, so a failed run resumes at the failed stage
+    def __init__(self, root=ARTIFACT_DIR, force=()):
+        self.root = root
+        self.force = set(force)
+        self.built = []
+        self.reused = []
+
+    def key(self, stage, *inputs):
+        return make_cache_key(stage, *inputs)
+
+    def path(self, stage, key):
+        return os.path.join(self.root, stage, key)
+
+    def run(self, stage, inputs, produce):
+        # produce(directory) writes the stage files into directory, returns (key, directory)
+        key = self.key(stage, *inputs)
+        path = self.path(stage, key)
+        if stage in self.force:
+            shutil.rmtree(path, ignore_errors=True)
+        if os.path.isdir(path):
+            self.reused.append(stage)
+            logging.info(f"Stage {stage}: unchanged, reusing {path}")
+            return key, path
+
+        start_time = time.time()
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        try:
+            produce(temp_path)
+            os.rename(temp_path, path)
+        except OSError:
+            # another process finished the same stage first, its output is identical
+            if not os.path.isdir(path):
+                raise
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+        self.built.append(stage)
+        logging.info(f"Stage {stage}: built in {time.time() - start_time:.2f} seconds, stored in {path}")
+        return key, path
+
+
+def write_json(directory, name, value):
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as file:
+        json.dump(value, file, indent=2)
+
+
+def read_json(directory, name):
+    with open(os.path.join(directory, name), 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def write_text(directory, name, text):
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as file:
+        file.write(text)
+
+
+def read_text(directory, name):
+    with open(os.path.join(directory, name), 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def file_fingerprint(paths):
+    # name, size and mtime stand in for the content of large inputs such as the background videos
+    fingerprint = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        fingerprint.append([os.path.basename(path), stat.st_size, int(stat.st_mtime)])
+    return fingerprint
@@ -0,0 +1,91 @@
+import logging
+
+import numpy as np
+from moviepy.editor import VideoClip, VideoFileClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from utils.proxy_cache import ensure_proxy
+
+
+class BackgroundSourceManager:
+    # one reader per distinct file, opened when its first segment is rendered and closed right after its
+    # last one, so open ffmpeg processes are bounded by the number of distinct clips, not sentences
+    def __init__(self, size=(640, 480), fps=24, use_proxies=True):
+        self.size = size
+        self.fps = fps
+        self.use_proxies = use_proxies
+        self.readers = {}
+        self.last_use = {}
+        self.durations = {}
+        self.opened = 0
+
+    def duration(self, path):
+        if path not in self.durations:
+            self.durations[path] = ffmpeg_parse_infos(path)['duration']
+        return self.durations[path]
+
+    def plan(self, path, timeline_end):
+        self.last_use[path] = max(self.last_use.get(path, 0), timeline_end)
+
+    def get_frame(self, path, t):
+        reader = self.readers.get(path)
+        if reader is None:
+            reader = self.open(path)
+            self.readers[path] = reader
+            self.opened += 1
+        return reader.get_frame(min(t, reader.duration - 1 / reader.fps))
+
+    def resolve(self, path):
+        # a render-sized proxy takes the per-frame scaling and most of the decode cost out of the render
+        if self.use_proxies:
+            width, height = self.size
+            try:
+                return ensure_proxy(path, width, height, self.fps)
+            except Exception as e:
+                print(f"Error using proxy for video '{path}', reading the source instead: {e}")
+        return path
+
+    def open(self, path):
+        width, height = self.size
+        resolved_path = self.resolve(path)
+        if resolved_path != path:
+            return VideoFileClip(resolved_path, audio=False)
+        return VideoFileClip(path, audio=False, target_resolution=(height, width))
+
+    def release_finished(self, timeline_t):
+        for path in [path for path in self.readers if self.last_use.get(path, 0) <= timeline_t]:
+            self.close(path)
+
+    def close(self, path):
+        reader = self.readers.pop(path, None)
+        if reader:
+            reader.close()
+
+    def close_all(self):
+        for path in list(self.readers):
+            self.close(path)
+        logging.info(f"Background readers opened: {self.opened} for {len(self.last_use)} distinct files.")
+
+
+class BackgroundTrack(VideoClip):
+    # segments are (path, timeline start, duration) in timeline order, each one plays its file from 0.
+    # With a window only the segments overlapping [window_start, window_end) are kept and the clip starts at
+    # window_start, so a render chunk never opens the files outside its range
+    def __init__(self, segments, manager, window_start=0.0, window_end=None):
+        total_duration = segments[-1][1] + segments[-1][2]
+        window_end = total_duration if window_end is None else min(window_end, total_duration)
+        self.segments = [(path, start, duration) for path, start, duration in segments
+                         if start < window_end and start + duration > window_start] or segments[-1:]
+        self.manager = manager
+        self.window_start = window_start
+        self.segment_starts = np.array([start for _, start, _ in self.segments], dtype=np.float64)
+        for path, start, duration in self.segments:
+            manager.plan(path, start + duration)
+        VideoClip.__init__(self, make_frame=self.make_segment_frame, duration=window_end - window_start)
+
+    def make_segment_frame(self, t):
+        t += self.window_start
+        i = max(np.searchsorted(self.segment_starts, t, side='right') - 1, 0)
+        path, start, _ = self.segments[i]
+        self.manager.release_finished(start)
+        return self.manager.get_frame(path, t - start)
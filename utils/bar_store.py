@@ -0,0 +1,126 @@
+import datetime
+import fcntl
+import logging
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from utils.consts import MARKET_TIME_ZONE
+
+BAR_STORE_DIR = "temp/bars"
+COLUMNS = ("Open", "High", "Low", "Close", "Volume")
+# yfinance only serves 1 minute bars for roughly the last week
+MAX_INCREMENTAL_GAP = datetime.timedelta(days=6)
+
+
+class BarStore:
+    # per symbol append-only columnar files: int64 UTC nanosecond timestamps plus a float64 row of
+    # COLUMNS per bar, both memory-mapped for reads and searched with np.searchsorted
+    def __init__(self, symbol, root=BAR_STORE_DIR):
+        self.symbol = symbol
+        self.directory = os.path.join(root, symbol)
+        self.timestamps_path = os.path.join(self.directory, "timestamps.i8")
+        self.bars_path = os.path.join(self.directory, "bars.f8")
+        self.lock_path = os.path.join(self.directory, ".lock")
+        os.makedirs(self.directory, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __len__(self):
+        if not os.path.exists(self.timestamps_path):
+            return 0
+        return os.path.getsize(self.timestamps_path) // 8
+
+    def timestamps(self) -> np.ndarray:
+        count = len(self)
+        if not count:
+            return np.empty(0, dtype=np.int64)
+        return np.memmap(self.timestamps_path, dtype=np.int64, mode="r", shape=(count,))
+
+    def bars(self) -> np.ndarray:
+        count = len(self)
+        if not count:
+            return np.empty((0, len(COLUMNS)), dtype=np.float64)
+        return np.memmap(self.bars_path, dtype=np.float64, mode="r", shape=(count, len(COLUMNS)))
+
+    def last_timestamp(self):
+        timestamps = self.timestamps()
+        return pd.Timestamp(int(timestamps[-1]), tz="UTC") if len(timestamps) else None
+
+    def append(self, frame: pd.DataFrame) -> int:
+        if frame is None or frame.empty:
+            return 0
+        frame = frame[list(COLUMNS)].dropna(subset=["Open"])
+        index = frame.index if frame.index.tz is not None else frame.index.tz_localize(MARKET_TIME_ZONE)
+        timestamps = index.tz_convert("UTC").as_unit("ns").asi8
+        with self._locked():
+            count = len(self)
+            # a crash between the two writes can leave extra bar rows, timestamps define the valid length
+            if os.path.exists(self.bars_path):
+                os.truncate(self.bars_path, count * len(COLUMNS) * 8)
+            last = int(self.timestamps()[-1]) if count else None
+            new_rows = timestamps > last if last is not None else np.ones(len(timestamps), dtype=bool)
+            if not new_rows.any():
+                return 0
+            order = np.argsort(timestamps[new_rows], kind="stable")
+            with open(self.bars_path, "ab") as file:
+                file.write(np.ascontiguousarray(frame.to_numpy(dtype=np.float64)[new_rows][order]).tobytes())
+            with open(self.timestamps_path, "ab") as file:
+                file.write(np.ascontiguousarray(timestamps[new_rows][order]).tobytes())
+            return int(new_rows.sum())
+
+    def range(self, start, end) -> pd.DataFrame:
+        timestamps = self.timestamps()
+        first = np.searchsorted(timestamps, pd.Timestamp(start).tz_convert("UTC").value, side="left")
+        last = np.searchsorted(timestamps, pd.Timestamp(end).tz_convert("UTC").value, side="right")
+        index = pd.DatetimeIndex(np.asarray(timestamps[first:last]), tz="UTC").tz_convert(MARKET_TIME_ZONE)
+        return pd.DataFrame(np.asarray(self.bars()[first:last]), index=index, columns=list(COLUMNS))
+
+    def update(self):
+        return update_bar_stores([self.symbol], root=os.path.dirname(self.directory))[self.symbol]
+
+
+def _complete_bars(frame, now):
+    # the bar of the current minute is still changing, it is stored on the next update instead
+    if frame.index.tz is None:
+        frame = frame.tz_localize(MARKET_TIME_ZONE)
+    current_minute = pd.Timestamp(now).tz_convert("UTC").floor("min")
+    return frame[frame.index.tz_convert("UTC") < current_minute]
+
+
+def _download_kwargs(stores, now):
+    last_timestamps = [store.last_timestamp() for store in stores]
+    if any(last is None for last in last_timestamps) or now - min(last_timestamps) > MAX_INCREMENTAL_GAP:
+        return {"period": "5d"}
+    return {"start": min(last_timestamps).to_pydatetime()}
+
+
+def update_bar_stores(symbols, root=BAR_STORE_DIR) -> dict:
+    # fetches only bars newer than the oldest last stored bar, for all symbols in one bulk download
+    stores = {symbol: BarStore(symbol, root) for symbol in symbols}
+    now = datetime.datetime.now(datetime.timezone.utc)
+    data = yf.download(list(symbols), interval="1m", prepost=True, group_by="ticker", threads=True,
+                       progress=False, **_download_kwargs(stores.values(), now))
+    appended_by_symbol = {}
+    for symbol, store in stores.items():
+        if isinstance(data.columns, pd.MultiIndex):
+            frame = data[symbol] if symbol in data.columns.get_level_values(0) else None
+        else:
+            frame = data
+        appended_by_symbol[symbol] = store.append(_complete_bars(frame, now)) if frame is not None else 0
+    logging.info(f"Bar store updated: {sum(appended_by_symbol.values())} new bars for {len(symbols)} symbols.")
+    return appended_by_symbol
+
+
+def get_bar_range(symbols, start, end, root=BAR_STORE_DIR) -> dict:
+    return {symbol: BarStore(symbol, root).range(start, end) for symbol in symbols}
@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.response_cache import make_cache_key
+
+CAPTION_CACHE_DIR = "temp/cache/captions"
+CAPTION_LRU_SIZE = 1024
+
+
+def rasterize_caption(word, font, fontsize, color, size):
+    # imported here so processes that only read cached captions never touch ImageMagick
+    from moviepy.editor import TextClip
+
+    text_clip = TextClip(word, fontsize=fontsize, color=color, size=size, method='caption', font=font)
+    try:
+        rgb = text_clip.get_frame(0)
+        alpha = text_clip.mask.get_frame(0) if text_clip.mask else np.ones(rgb.shape[:2])
+    finally:
+        text_clip.close()
+    return np.dstack([rgb, np.round(alpha * 255)]).astype(np.uint8)
+
+
+def crop_to_content(rgba):
+    # only the bounding box of the visible pixels is kept, with its offset on the canvas
+    rows = np.flatnonzero(rgba[..., 3].any(axis=1))
+    columns = np.flatnonzero(rgba[..., 3].any(axis=0))
+    if not len(rows):
+        return np.zeros((1, 1, 4), dtype=np.uint8), (0, 0)
+    return rgba[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1].copy(), (int(columns[0]), int(rows[0]))
+
+
+class CaptionCache:
+    # in-process LRU in front of an on-disk store of cropped RGBA rasters, one .npz per
+    # (word, font, fontsize, color, canvas size), shared by every run, video and ticker
+    def __init__(self, directory=CAPTION_CACHE_DIR, max_items=CAPTION_LRU_SIZE):
+        self.directory = directory
+        self.max_items = max_items
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.npz")
+
+    def _remember(self, key, item):
+        with self._lock:
+            self._items[key] = item
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def get(self, word, font='Arial', fontsize=70, color='white', size=(640, 480)):
+        key = make_cache_key(word, font, fontsize, color, list(size))
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item
+
+        path = self._path(key)
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    item = data["rgba"], tuple(int(value) for value in data["position"])
+                self.disk_hits += 1
+            except Exception as e:
+                print(f"Error loading cached caption '{path}': {e}")
+
+        if item is None:
+            self.misses += 1
+            item = crop_to_content(rasterize_caption(word, font, fontsize, color, size))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+            np.savez_compressed(temp_path, rgba=item[0], position=np.array(item[1]))
+            os.replace(temp_path, path)
+
+        self._remember(key, item)
+        return item
+
+
+_caption_cache = None
+
+
+def get_caption_cache():
+    global _caption_cache
+    if _caption_cache is None:
+        _caption_cache = CaptionCache()
+    return _caption_cache
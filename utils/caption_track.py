@@ -0,0 +1,45 @@
+import numpy as np
+
+from utils.caption_cache import get_caption_cache
+
+
+class CaptionTrack:
+    # all word captions as one layer: sorted start/end arrays find the active word with a binary search
+    # and its cached raster is alpha-blended onto the frame, so the per-frame cost does not grow with the script
+    def __init__(self, sentences_list_with_timings, size=(640, 480), font='Arial', fontsize=70, color='white',
+                 caption_cache=None, offset=(0, 0)):
+        caption_cache = caption_cache or get_caption_cache()
+        words = [timing for sentence in sentences_list_with_timings for timing in sentence['words_in_sentence']]
+        words.sort(key=lambda timing: timing['start'])
+        self.size = size
+        self.starts = np.array([timing['start'] / 1000 for timing in words], dtype=np.float64)
+        self.ends = np.array([timing['end'] / 1000 for timing in words], dtype=np.float64)
+        self.captions = []
+        for timing in words:
+            rgba, (x, y) = caption_cache.get(timing['word'], font=font, fontsize=fontsize, color=color, size=size)
+            position = (x + offset[0], y + offset[1])
+            alpha = (rgba[..., 3:] / 255.0).astype(np.float32)
+            self.captions.append((rgba[..., :3].astype(np.float32) * alpha, 1 - alpha, position))
+
+    def caption_at(self, t):
+        i = np.searchsorted(self.starts, t, side='right') - 1
+        if i < 0 or t >= self.ends[i]:
+            return None
+        return self.captions[i]
+
+    def blend(self, frame, t):
+        caption = self.caption_at(t)
+        if caption is None:
+            return frame
+        premultiplied_rgb, inverse_alpha, (x, y) = caption
+        height = min(premultiplied_rgb.shape[0], frame.shape[0] - y)
+        width = min(premultiplied_rgb.shape[1], frame.shape[1] - x)
+        if height <= 0 or width <= 0:
+            return frame
+        frame = frame.copy()
+        region = frame[y:y + height, x:x + width]
+        region[:] = (premultiplied_rgb[:height, :width] + inverse_alpha[:height, :width] * region).astype(np.uint8)
+        return frame
+
+    def apply(self, background):
+        return background.fl(lambda get_frame, t: self.blend(get_frame(t), t))
@@ -0,0 +1,154 @@
+import logging
+import os
+import subprocess
+
+import numpy as np
+from moviepy.config import get_setting
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+WrapStyle: 0
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,{font},{fontsize},{color},{color},&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,0,0,5,10,10,10,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+ASS_COLORS = {'white': '&H00FFFFFF', 'black': '&H00000000', 'yellow': '&H0000FFFF'}
+
+
+def format_ass_time(seconds):
+    centiseconds = int(round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+
+def escape_ass_text(text):
+    return text.replace('\\', '').replace('{', '(').replace('}', ')').replace('\n', ' ')
+
+
+def write_ass_captions(sentences_list_with_timings, ass_path, size=(640, 480), font='Arial', fontsize=70,
+                       color='white'):
+    width, height = size
+    lines = [ASS_HEADER.format(width=width, height=height, font=font, fontsize=fontsize,
+                               color=ASS_COLORS.get(color, color))]
+    for sentence in sentences_list_with_timings:
+        for timing in sentence['words_in_sentence']:
+            lines.append(f"Dialogue: 0,{format_ass_time(timing['start'] / 1000)},{format_ass_time(timing['end'] / 1000)},"
+                         f"Default,,0,0,0,,{escape_ass_text(timing['word'])}\n")
+    os.makedirs(os.path.dirname(ass_path) or '.', exist_ok=True)
+    with open(ass_path, 'w', encoding='utf-8') as file:
+        file.writelines(lines)
+    return ass_path
+
+
+def escape_filter_path(path):
+    return path.replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+
+
+def build_ffmpeg_command(audio_path, video_path, segments, ass_path, duration, size=(640, 480), fps=24,
+                         preset='medium', threads=None):
+    # one input per background segment, read only for its duration, scaled and concatenated in a single
+    # filtergraph, captions burned in by libass from the ASS file, no frame passes through Python
+    width, height = size
+    inputs = []
+    filters = []
+    if segments:
+        for k, (path, _, segment_duration) in enumerate(segments):
+            inputs += ["-t", f"{segment_duration:.3f}", "-i", path]
+            filters.append(f"[{k}:v]scale={width}:{height},setsar=1,fps={fps},setpts=PTS-STARTPTS[segment{k}]")
+        filters.append("".join(f"[segment{k}]" for k in range(len(segments))) +
+                       f"concat=n={len(segments)}:v=1:a=0[background]")
+    else:
+        inputs += ["-f", "lavfi", "-i", f"color=c=black:s={width}x{height}:r={fps}:d={duration:.3f}"]
+        filters.append("[0:v]null[background]")
+    filters.append(f"[background]subtitles=filename='{escape_filter_path(ass_path)}'[video]")
+    audio_input = len(segments) if segments else 1
+
+    command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", *inputs, "-i", audio_path,
+               "-filter_complex", ";".join(filters),
+               "-map", "[video]", "-map", f"{audio_input}:a",
+               "-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p", "-r", str(fps),
+               "-c:a", "aac", "-t", f"{duration:.3f}"]
+    if threads:
+        command += ["-threads", str(threads)]
+    return command + [video_path]
+
+
+def render_with_ffmpeg(audio_path, video_path, segments, sentences_list_with_timings, duration, size=(640, 480),
+                       fps=24, preset='medium', threads=None):
+    ass_path = f"{os.path.splitext(video_path)[0]}.ass"
+    write_ass_captions(sentences_list_with_timings, ass_path, size=size)
+    command = build_ffmpeg_command(audio_path, video_path, segments, ass_path, duration, size, fps, preset, threads)
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg render failed: {e.stderr.strip()}") from e
+    finally:
+        if os.path.exists(ass_path):
+            os.remove(ass_path)
+    return video_path
+
+
+def concat_chunks(chunk_paths, audio_path, video_path):
+    # the chunks share codec parameters, so the concat demuxer joins them without re-encoding
+    # and the audio is muxed once over the whole timeline
+    list_path = f"{os.path.splitext(video_path)[0]}_chunks.txt"
+    with open(list_path, 'w', encoding='utf-8') as file:
+        for chunk_path in chunk_paths:
+            file.write(f"file '{os.path.abspath(chunk_path)}'\n")
+    command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+               "-f", "concat", "-safe", "0", "-i", list_path, "-i", audio_path,
+               "-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "aac", video_path]
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg concat failed: {e.stderr.strip()}") from e
+    finally:
+        os.remove(list_path)
+    return video_path
+
+
+def compare_videos(path_a, path_b, samples=12):
+    from moviepy.editor import VideoFileClip
+
+    clip_a, clip_b = VideoFileClip(path_a), VideoFileClip(path_b)
+    try:
+        duration = min(clip_a.duration, clip_b.duration)
+        psnrs = []
+        for t in np.linspace(0, duration, samples, endpoint=False) + duration / samples / 2:
+            frame_a = clip_a.get_frame(t).astype(np.float64)
+            frame_b = clip_b.get_frame(t).astype(np.float64)
+            if frame_a.shape != frame_b.shape:
+                psnrs.append(0.0)
+                continue
+            mse = np.mean((frame_a - frame_b) ** 2)
+            psnrs.append(100.0 if mse == 0 else 10 * np.log10(255 ** 2 / mse))
+        return {
+            "size_a": tuple(clip_a.size),
+            "size_b": tuple(clip_b.size),
+            "duration_difference": abs(clip_a.duration - clip_b.duration),
+            "mean_psnr": float(np.mean(psnrs)),
+            "min_psnr": float(np.min(psnrs)),
+        }
+    finally:
+        clip_a.close()
+        clip_b.close()
+
+
+def check_output_equivalence(path_a, path_b, min_psnr=25.0, max_duration_difference=0.25) -> bool:
+    # the two backends rasterize captions differently (ImageMagick vs libass), so equivalence is judged on
+    # geometry, duration and a PSNR floor rather than identical pixels
+    report = compare_videos(path_a, path_b)
+    equivalent = (report["size_a"] == report["size_b"]
+                  and report["duration_difference"] <= max_duration_difference
+                  and report["mean_psnr"] >= min_psnr)
+    logging.info(f"Output equivalence {'passed' if equivalent else 'FAILED'}: {report}")
+    return equivalent
@@ -0,0 +1,112 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+VOSK_MODEL_PATH = os.getenv('VOSK_MODEL_PATH', 'models/vosk-model-small-en-us-0.15')
+VOSK_MAX_WORKERS = int(os.getenv('VOSK_MAX_WORKERS', os.cpu_count() or 1))
+VOSK_SAMPLE_RATE = 16000
+VOSK_CHUNK_FRAMES = 4000
+WORD_PUNCTUATION = '.,!?;:"()[]'
+
+_vosk_model = None
+_alignment_pool = None
+_alignment_pool_lock = threading.Lock()
+
+
+def get_vosk_model():
+    # loaded once per worker process, the model is by far the slowest part to set up
+    global _vosk_model
+    if _vosk_model is None:
+        from vosk import Model, SetLogLevel
+
+        SetLogLevel(-1)
+        _vosk_model = Model(VOSK_MODEL_PATH)
+    return _vosk_model
+
+
+def normalize_word(word):
+    return re.sub(r"[^a-z0-9']", "", word.lower())
+
+
+def recognize_words(pcm, vocabulary=None, sample_rate=VOSK_SAMPLE_RATE):
+    # 16 bit mono PCM in, recognized words with start/end in seconds out, the grammar limits the
+    # recognizer to the words of the script so it only has to find where they are
+    from vosk import KaldiRecognizer
+
+    model = get_vosk_model()
+    if vocabulary:
+        recognizer = KaldiRecognizer(model, sample_rate, json.dumps(sorted(vocabulary) + ["[unk]"]))
+    else:
+        recognizer = KaldiRecognizer(model, sample_rate)
+    recognizer.SetWords(True)
+    words = []
+    step = VOSK_CHUNK_FRAMES * 2
+    for i in range(0, len(pcm), step):
+        if recognizer.AcceptWaveform(pcm[i:i + step]):
+            words += json.loads(recognizer.Result()).get('result', [])
+    words += json.loads(recognizer.FinalResult()).get('result', [])
+    return words
+
+
+def align_word_times(script_words, recognized_words, duration_ms):
+    # script words matched to a recognized word take its start time, replaced runs (numbers read out,
+    # misrecognitions) take the recognized words they replace, anything left is spread evenly between
+    # the matched neighbours
+    script_tokens = [normalize_word(word) for word in script_words]
+    recognized_tokens = [normalize_word(word['word']) for word in recognized_words]
+    starts = [None] * len(script_words)
+    matcher = SequenceMatcher(None, script_tokens, recognized_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag in ('equal', 'replace'):
+            for k in range(i2 - i1):
+                starts[i1 + k] = int(recognized_words[j1 + k * (j2 - j1) // (i2 - i1)]['start'] * 1000)
+
+    end_ms = int(recognized_words[-1]['end'] * 1000) if recognized_words else duration_ms
+    anchors = [(-1, 0)] + [(i, start) for i, start in enumerate(starts) if start is not None] + \
+              [(len(script_words), min(end_ms, duration_ms))]
+    for (i0, t0), (i1, t1) in zip(anchors, anchors[1:]):
+        for j in range(i0 + 1, i1):
+            starts[j] = int(t0 + (t1 - t0) * (j - i0) / (i1 - i0))
+    return starts
+
+
+def align_speech_marks(pcm, sentences, duration_ms):
+    # produces the same word/sentence marks Polly returns, so build_sentences handles both
+    words_by_sentence = [[word.strip(WORD_PUNCTUATION) for word in sentence.split()] for sentence in sentences]
+    words_by_sentence = [[word for word in words if word] for words in words_by_sentence]
+    script_words = [word for words in words_by_sentence for word in words]
+    vocabulary = {normalize_word(word) for word in script_words} - {""}
+    starts = align_word_times(script_words, recognize_words(pcm, vocabulary), duration_ms)
+
+    speech_marks = []
+    i = 0
+    for sentence, words in zip(sentences, words_by_sentence):
+        if not words:
+            continue
+        speech_marks.append({"time": starts[i], "type": "sentence", "value": sentence})
+        for word in words:
+            speech_marks.append({"time": starts[i], "type": "word", "value": word})
+            i += 1
+    return speech_marks
+
+
+def get_alignment_pool():
+    global _alignment_pool
+    with _alignment_pool_lock:
+        if _alignment_pool is None:
+            _alignment_pool = ProcessPoolExecutor(max_workers=VOSK_MAX_WORKERS)
+        return _alignment_pool
+
+
+def align_audio(audio_segment, sentences):
+    # runs in the shared process pool, so tickers prepared concurrently in a batch align in parallel
+    audio = audio_segment.set_channels(1).set_frame_rate(VOSK_SAMPLE_RATE).set_sample_width(2)
+    future = get_alignment_pool().submit(align_speech_marks, audio.raw_data, sentences, len(audio_segment))
+    return future.result()
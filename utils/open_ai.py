@@ -1,39 +1,195 @@
+import asyncio
+import json
+import logging
 import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from inputs.video_map import VIDEO_DESCRIPTION_MAP
+from utils.response_cache import ResponseCache, make_cache_key
+from utils.request_scheduler import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, get_scheduler
+from utils.text_extraction import estimate_tokens, truncate_to_token_budget
 from utils.utils import fix_video_name
+from utils.video_index import get_video_index
 
 load_dotenv()
 
+MATCH_MAX_WORKERS = 4
+LOCAL_MATCH_MIN_CONFIDENCE = 0.15
+VIDEO_MATCH_ENGINES = ("llm", "local", "hybrid")
+ARTICLE_TOKEN_BUDGET = int(os.getenv('ARTICLE_TOKEN_BUDGET', 1500))
+SUMMARY_MAX_CONCURRENCY = int(os.getenv('SUMMARY_MAX_CONCURRENCY', 5))
 
-class OpenAIClient():
-    def __init__(self):
-        self.client = OpenAI(
-            organization=os.getenv('OPEN_AI_ORGANIZATION_ID'),
-            project=os.getenv('OPEN_AI_PROJECT_ID'),
-            api_key=os.getenv('OPEN_AI_TOKEN')
+# the prompt is estimated from its length, the completion is not known up front
+COMPLETION_TOKEN_ALLOWANCE = int(os.getenv('OPEN_AI_COMPLETION_TOKEN_ALLOWANCE', 500))
+
+_response_cache = None
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _response_cache
+    if os.getenv('OPEN_AI_CACHE_DISABLED', '').lower() in ('1', 'true', 'yes'):
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            path=os.getenv('OPEN_AI_CACHE_PATH', 'temp/cache/open_ai.sqlite'),
+            ttl_seconds=float(os.getenv('OPEN_AI_CACHE_TTL_SECONDS', 7 * 24 * 60 * 60)),
+            max_entries=int(os.getenv('OPEN_AI_CACHE_MAX_ENTRIES', 5000)),
         )
+    return _response_cache
+
+
+def estimate_request_tokens(prompt):
+    return estimate_tokens(prompt) + COMPLETION_TOKEN_ALLOWANCE
+
+
+def get_client_kwargs():
+    return {
+        "organization": os.getenv('OPEN_AI_ORGANIZATION_ID'),
+        "project": os.getenv('OPEN_AI_PROJECT_ID'),
+        "api_key": os.getenv('OPEN_AI_TOKEN'),
+        "base_url": os.getenv('OPEN_AI_BASE_URL') or None,
+        # retries and backoff are left to the request scheduler
+        "max_retries": 0,
+    }
+
+
+class OpenAIClient():
+    def __init__(self, cache=None, scheduler=None):
+        self.client = OpenAI(**get_client_kwargs())
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_clients_lock = threading.Lock()
+        self.cache = cache or get_response_cache()
+        self.scheduler = scheduler or get_scheduler("open_ai")
+
+    def _get_cached(self, prompt, model, response_format):
+        cache_key = make_cache_key(model, prompt, response_format)
+        return cache_key, self.cache.get(cache_key) if self.cache else None
+
+    def _store(self, cache_key, result):
+        if self.cache and result is not None:
+            self.cache.set(cache_key, result)
+
+    @property
+    def async_client(self):
+        # an async client is bound to its event loop, so each loop using the shared client gets its own pool
+        loop = asyncio.get_running_loop()
+        with self._async_clients_lock:
+            async_client = self._async_clients.get(loop)
+            if async_client is None:
+                async_client = self._async_clients[loop] = AsyncOpenAI(**get_client_kwargs())
+        return async_client
+
+    async def aclose(self):
+        # closes the running loop's connections, the owner of a loop calls it before the loop ends
+        with self._async_clients_lock:
+            async_client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if async_client is not None:
+            await async_client.close()
+
+    async def agenerate_text(self, prompt, model="gpt-4o-mini", response_format=None, priority=PRIORITY_NORMAL):
+        cache_key, cached_result = self._get_cached(prompt, model, response_format)
+        if cached_result is not None:
+            return cached_result
+
+        kwargs = {"response_format": response_format} if response_format else {}
+        try:
+            response = await self.scheduler.acall(
+                self.async_client.chat.completions.create,
+                priority=priority,
+                tokens=estimate_request_tokens(prompt),
+                messages=[{
+                    "role": "user",
+                    "content": prompt,
+                }],
+                model=model,
+                **kwargs,
+            )
+
+            result = response.choices[0].message.content
+        except Exception as e:
+            logging.error(f"OpenAI request failed: {e}")
+            result = None
+
+        self._store(cache_key, result)
+        return result
 
-    def generate_text(self, prompt, model="gpt-4o-mini"):
+    def generate_text(self, prompt, model="gpt-4o-mini", response_format=None, priority=PRIORITY_NORMAL):
+        cache_key, cached_result = self._get_cached(prompt, model, response_format)
+        if cached_result is not None:
+            return cached_result
+
+        kwargs = {"response_format": response_format} if response_format else {}
         try:
-            response = self.client.chat.completions.create(
+            response = self.scheduler.call(
+                self.client.chat.completions.create,
+                priority=priority,
+                tokens=estimate_request_tokens(prompt),
                 messages=[{
                     "role": "user",
                     "content": prompt,
                 }],
                 model=model,
+                **kwargs,
             )
 
             result = response.choices[0].message.content
         except Exception as e:
-            print(f"Error: {e}")
+            logging.error(f"OpenAI request failed: {e}")
             result = None
 
+        self._store(cache_key, result)
         return result
 
+    def stream_text(self, prompt, model="gpt-4o-mini", priority=PRIORITY_HIGH):
+        # yields the completion as it is generated, a cached completion comes back as a single piece,
+        # only opening the stream goes through the scheduler
+        cache_key, cached_result = self._get_cached(prompt, model, None)
+        if cached_result is not None:
+            yield cached_result
+            return
+
+        parts = []
+        try:
+            stream = self.scheduler.call(
+                self.client.chat.completions.create,
+                priority=priority,
+                tokens=estimate_request_tokens(prompt),
+                messages=[{
+                    "role": "user",
+                    "content": prompt,
+                }],
+                model=model,
+                stream=True,
+            )
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            # a cut-off completion must not be narrated as if it were the whole analysis
+            logging.error(f"OpenAI stream failed after {len(parts)} parts: {e}")
+            raise
+
+        self._store(cache_key, "".join(parts))
+
+
+def get_openai_client() -> OpenAIClient:
+    # one pooled client per process, so every caller shares its HTTP connections and the rate limits
+    global _openai_client
+    with _openai_client_lock:
+        if _openai_client is None:
+            _openai_client = OpenAIClient()
+        return _openai_client
+
 
 def check_if_article_relevant(text, link, company_name, stock_symbol, client) -> bool:
+    text = truncate_to_token_budget(text, ARTICLE_TOKEN_BUDGET)
     prompt = (
         "You are a financial analyst specializing in evaluating news articles for their potential impact on a company's stock price.\n"
         "Analyze the following article and determine whether it is relevant to the future stock price movement of the specified company.\n"
@@ -45,7 +201,7 @@ def check_if_article_relevant(text, link, company_name, stock_symbol, client) ->
         f"Article Link: {link}\n"
         f"Article Text: {text}"
     )
-    response = client.generate_text(prompt)
+    response = client.generate_text(prompt, priority=PRIORITY_LOW)
     try:
         return response.strip().lower() == 'true'
     except Exception as e:
@@ -54,10 +210,11 @@ def check_if_article_relevant(text, link, company_name, stock_symbol, client) ->
 
 
 def summarize_with_open_ai(text, link, company_name, stock_symbol):
-    client = OpenAIClient()
+    client = get_openai_client()
     is_article_relevant = check_if_article_relevant(text, link, company_name, stock_symbol, client)
     if not is_article_relevant:
         return None
+    text = truncate_to_token_budget(text, ARTICLE_TOKEN_BUDGET)
     prompt = (
         f"You are a financial analyst with expertise in assessing news impact on stock prices in the immediate term.\n"
         f"Please perform the following tasks:\n"
@@ -69,14 +226,71 @@ def summarize_with_open_ai(text, link, company_name, stock_symbol):
         f"Article Text:\n{text}\n"
     )
 
-    summary = client.generate_text(prompt)
+    summary = client.generate_text(prompt, priority=PRIORITY_LOW)
     return summary
 
 
-def generate_stock_opening_analysis(text, company_name, stock_symbol):
-    client = OpenAIClient()
+async def summarize_article_async(text, link, company_name, stock_symbol, client):
+    review = await review_article_async(text, link, company_name, stock_symbol, client)
+    return review and review["summary"]
 
+
+async def review_article_async(text, link, company_name, stock_symbol, client):
+    # returns {"relevant": bool, "summary": str or None}, or None when the response could not be used
+    text = truncate_to_token_budget(text, ARTICLE_TOKEN_BUDGET)
     prompt = (
+        f"You are a financial analyst with expertise in assessing news impact on stock prices in the immediate term.\n"
+        f"First, determine whether the following news article is relevant to the future stock price movement of "
+        f"{company_name} ({stock_symbol}). Consider factors such as financial performance, market conditions, legal issues, "
+        f"management changes, or other significant events that could influence the stock price.\n"
+        f"If it is relevant, perform the following tasks:\n"
+        f"1. **Summarize** the news article in 2-3 sentences.\n"
+        f"2. **Evaluate** the likely impact of this news on the company's stock price for the next trading day. Indicate whether the impact is **positive**, **negative**, or **neutral**.\n"
+        f"3. **Explain** your reasoning in 1-2 sentences.\n"
+        f"Return ONLY a JSON object of the form {{\"relevant\": true or false, \"summary\": \"...\"}} where summary "
+        f"holds the three numbered parts above, or is empty if the article is not relevant.\n\n"
+        f"Article Link: {link}\n\n"
+        f"Article Text:\n{text}\n"
+    )
+
+    response = await client.agenerate_text(prompt, response_format={"type": "json_object"}, priority=PRIORITY_LOW)
+    try:
+        result = json.loads(response)
+    except (TypeError, ValueError) as e:
+        print(f"Error parsing summary response for {link}: {e}")
+        return None
+    if not isinstance(result, dict):
+        return None
+    relevant = result.get("relevant") is True
+    summary = result.get("summary")
+    if relevant and not (isinstance(summary, str) and summary.strip()):
+        # a relevant article without a usable summary is reviewed again next time
+        print(f"Unusable summary in response for {link}: {summary!r}")
+        return None
+    return {"relevant": relevant, "summary": summary.strip() if relevant else None}
+
+
+async def review_articles(articles, company_name, stock_symbol, client=None,
+                          max_concurrency=SUMMARY_MAX_CONCURRENCY) -> list:
+    # articles is a list of (text, link) pairs, the reviews come back in the same order
+    client = client or get_openai_client()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def review(text, link):
+        async with semaphore:
+            return await review_article_async(text, link, company_name, stock_symbol, client)
+
+    return await asyncio.gather(*(review(text, link) for text, link in articles))
+
+
+async def summarize_articles(articles, company_name, stock_symbol, client=None,
+                             max_concurrency=SUMMARY_MAX_CONCURRENCY) -> list:
+    reviews = await review_articles(articles, company_name, stock_symbol, client, max_concurrency)
+    return [review and review["summary"] for review in reviews]
+
+
+def get_stock_opening_analysis_prompt(text, company_name, stock_symbol):
+    return (
         f"You are a seasoned financial analyst and market commentator.\n"
         f"Based on the latest news and developments related to {company_name} ({stock_symbol}), "
         f"provide a concise and insightful analysis of how the stock is likely to perform when the market opens today.\n"
@@ -85,17 +299,26 @@ def generate_stock_opening_analysis(text, company_name, stock_symbol):
         f"Your analysis should include:\n"
         f"1. A prediction on whether the stock will go **up** or **down** at market open, and why.\n"
         f"2. An estimated percentage of the expected price movement.\n"
-        f"3. Key factors from the news that support your prediction.\n"
+        f"3. Key factors from the news and the pre-market price metrics (gap, VWAP, volume, volatility) that support your prediction.\n"
         f"Please present your analysis in a single, well-structured paragraph."
     )
 
-    results = client.generate_text(prompt)
+
+def generate_stock_opening_analysis(text, company_name, stock_symbol, client=None):
+    client = client or get_openai_client()
+    prompt = get_stock_opening_analysis_prompt(text, company_name, stock_symbol)
+    results = client.generate_text(prompt, priority=PRIORITY_HIGH)
     return results
 
 
+def stream_stock_opening_analysis(text, company_name, stock_symbol, client=None):
+    client = client or get_openai_client()
+    return client.stream_text(get_stock_opening_analysis_prompt(text, company_name, stock_symbol))
+
+
 def add_SSML_tags(text, company_name, stock_symbol):
     # TODO - Implement SSML tagging better
-    client = OpenAIClient()
+    client = get_openai_client()
 
     prompt = (
         f"You are a text-to-speech expert. Enhance the given text with SSML "
@@ -115,7 +338,7 @@ def add_SSML_tags(text, company_name, stock_symbol):
 
 def match_text_to_videos(text) -> dict:
     video_description_map = VIDEO_DESCRIPTION_MAP  # This dictionary should be pre-defined
-    client = OpenAIClient()
+    client = get_openai_client()
 
     prompt = f"""
     You are given a mapping of video descriptions and their corresponding video file names.
@@ -155,8 +378,8 @@ def match_text_to_videos(text) -> dict:
     return video_mapping
 
 
-def match_text_to_video(text) -> str:
-    client = OpenAIClient()
+def match_text_to_video(text, client=None) -> str:
+    client = client or get_openai_client()
 
     prompt = f"""
     You are given a mapping of video descriptions and their corresponding video file names.
@@ -170,9 +393,77 @@ def match_text_to_video(text) -> str:
     """
 
     response = client.generate_text(prompt)
-    response = fix_video_name(response)
+    response = fix_video_name(response or "")
     return response
 
+
+def match_sentences_to_videos(sentences, engine="llm", client=None) -> list:
+    if engine not in VIDEO_MATCH_ENGINES:
+        raise ValueError(f"Unknown video matching engine '{engine}', expected one of {VIDEO_MATCH_ENGINES}")
+    if not sentences:
+        return []
+    if engine == "llm":
+        return match_sentences_to_videos_with_llm(sentences, client)
+
+    video_names, confidences = get_video_index().match(sentences)
+    video_names = [fix_video_name(video_name) for video_name in video_names]
+    if engine == "local":
+        return video_names
+
+    # hybrid: only the sentences the local index is unsure about go to the LLM
+    low_confidence = [i for i, confidence in enumerate(confidences) if confidence < LOCAL_MATCH_MIN_CONFIDENCE]
+    if low_confidence:
+        llm_video_names = match_sentences_to_videos_with_llm([sentences[i] for i in low_confidence], client)
+        for i, video_name in zip(low_confidence, llm_video_names):
+            video_names[i] = video_name
+    return video_names
+
+
+def match_sentences_to_videos_with_llm(sentences, client=None) -> list:
+    client = client or get_openai_client()
+    numbered_sentences = "\n".join(f"{i}. {sentence}" for i, sentence in enumerate(sentences, start=1))
+
+    prompt = f"""
+    You are given a mapping of video descriptions and their corresponding video file names.
+    Here is the video description map: {VIDEO_DESCRIPTION_MAP}
+
+    Your task is to analyze each of the following numbered sentences and find, for each one, the video whose
+    description from the description map holds the most relevance.
+
+    Sentences:
+    {numbered_sentences}
+
+    Return ONLY a JSON object whose keys are the sentence numbers (as strings) and whose values are the name
+    of the video file that best matches that sentence, for example {{"1": "video_name.mp4"}}.
+    """
+
+    response = client.generate_text(prompt, response_format={"type": "json_object"})
+    try:
+        video_mapping = json.loads(response)
+    except (TypeError, ValueError) as e:
+        print(f"Error parsing batched video matching response: {e}")
+        video_mapping = {}
+    if not isinstance(video_mapping, dict):
+        video_mapping = {}
+
+    video_names = [None] * len(sentences)
+    missing = []
+    for i in range(len(sentences)):
+        video_name = video_mapping.get(str(i + 1))
+        if isinstance(video_name, str) and video_name:
+            video_names[i] = fix_video_name(video_name)
+        else:
+            missing.append(i)
+
+    # sentences the batched answer did not cover are matched one by one, concurrently, through the same client
+    if missing:
+        with ThreadPoolExecutor(max_workers=MATCH_MAX_WORKERS) as executor:
+            results = executor.map(lambda i: match_text_to_video(sentences[i], client), missing)
+            for i, video_name in zip(missing, results):
+                video_names[i] = video_name
+
+    return video_names
+
 # if __name__ == "__main__":
 #     text = "Meanwhile, despite competitive challenges and overall market declines, analysts highlight NVIDIA's strong position in the AI chip market, presenting a mixed sentiment for its future stock performance."
 #     print(match_text_to_video(text))
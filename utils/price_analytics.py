@@ -0,0 +1,140 @@
+import datetime
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from utils.bar_store import BAR_STORE_DIR, BarStore
+
+MINUTE_NS = 60 * 10 ** 9
+TRAILING_DAYS = 4
+POST_MARKET_DURATION = datetime.timedelta(hours=4)
+PRE_MARKET_DURATION = datetime.timedelta(hours=5, minutes=30)
+
+
+def load_bar_matrix(symbols, start, end, root=BAR_STORE_DIR):
+    # scatters every symbol's stored bars onto one shared minute grid, missing minutes are NaN,
+    # the result has shape (len(symbols), minutes) per OHLCV column
+    grid_start = pd.Timestamp(start).tz_convert("UTC").floor("min").value
+    grid_end = pd.Timestamp(end).tz_convert("UTC").floor("min").value
+    minutes = (grid_end - grid_start) // MINUTE_NS + 1
+    matrix = np.full((5, len(symbols), minutes), np.nan)
+    for row, symbol in enumerate(symbols):
+        store = BarStore(symbol, root)
+        timestamps = store.timestamps()
+        first = np.searchsorted(timestamps, grid_start, side="left")
+        last = np.searchsorted(timestamps, grid_end, side="right")
+        columns = (np.asarray(timestamps[first:last]) - grid_start) // MINUTE_NS
+        matrix[:, row, columns] = np.asarray(store.bars()[first:last]).T
+    return grid_start, matrix
+
+
+def _minute_column(timestamp, grid_start):
+    return int((pd.Timestamp(timestamp).tz_convert("UTC").value - grid_start) // MINUTE_NS)
+
+
+def _window(minutes, first, last):
+    return slice(min(max(first, 0), minutes), min(max(last, 0), minutes))
+
+
+def _forward_fill(values):
+    valid = ~np.isnan(values)
+    index = np.where(valid, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    filled = values[np.arange(values.shape[0])[:, None], index]
+    return np.where(np.maximum.accumulate(valid, axis=1), filled, np.nan)
+
+
+def _first_valid(values):
+    valid = ~np.isnan(values)
+    first = valid.argmax(axis=1)
+    return np.where(valid.any(axis=1), values[np.arange(len(values)), first], np.nan)
+
+
+def _last_valid(values):
+    return _first_valid(values[:, ::-1])
+
+
+def _vwap(high, low, close, volume):
+    typical_price = (high + low + close) / 3
+    traded_value = np.nansum(typical_price * volume, axis=1)
+    traded_volume = np.nansum(volume, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(traded_volume > 0, traded_value / traded_volume, np.nan)
+
+
+def compute_premarket_analytics(symbols, last_time_closed, next_time_open, trailing_days=TRAILING_DAYS,
+                                root=BAR_STORE_DIR) -> dict:
+    history_start = last_time_closed - datetime.timedelta(days=trailing_days)
+    grid_start, (open_, high, low, close, volume) = load_bar_matrix(symbols, history_start, next_time_open, root)
+    minutes = open_.shape[1]
+
+    close_column = _minute_column(last_time_closed, grid_start)
+    open_column = _minute_column(next_time_open, grid_start)
+    window = _window(minutes, close_column, open_column + 1)
+    post_market = _window(minutes, close_column, _minute_column(last_time_closed + POST_MARKET_DURATION, grid_start))
+    pre_market = _window(minutes, _minute_column(next_time_open - PRE_MARKET_DURATION, grid_start), open_column)
+
+    previous_close = _last_valid(close[:, :window.start])
+    window_close = _forward_fill(close[:, window])
+    last_price = _last_valid(window_close)
+    window_volume = np.nansum(volume[:, window], axis=1)
+
+    # the same overnight window on each of the previous days, days without any trades (weekends) are ignored
+    day_minutes = 24 * 60
+    trailing_volumes = np.array([
+        np.nansum(volume[:, _window(minutes, close_column - day * day_minutes, open_column + 1 - day * day_minutes)],
+                  axis=1)
+        for day in range(1, trailing_days + 1)
+    ]).reshape(trailing_days, len(symbols))
+    trailing_volumes = np.where(trailing_volumes > 0, trailing_volumes, np.nan)
+
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        trailing_average_volume = np.nanmean(trailing_volumes, axis=0) if trailing_days else \
+            np.full(len(symbols), np.nan)
+        log_returns = np.diff(np.log(window_close), axis=1)
+        realized_volatility = np.sqrt(np.nansum(log_returns ** 2, axis=1)) * 100
+        high_in_window = np.nanmax(high[:, window], axis=1)
+        low_in_window = np.nanmin(low[:, window], axis=1)
+
+        analytics = {
+            "first_open": _first_valid(open_[:, window]),
+            "last_open": _last_valid(open_[:, window]),
+            "previous_close": previous_close,
+            "last_price": last_price,
+            "gap_pct": (last_price / previous_close - 1) * 100,
+            "post_market_vwap": _vwap(high[:, post_market], low[:, post_market], close[:, post_market],
+                                      volume[:, post_market]),
+            "pre_market_vwap": _vwap(high[:, pre_market], low[:, pre_market], close[:, pre_market],
+                                     volume[:, pre_market]),
+            "volume": window_volume,
+            "volume_vs_trailing_avg": window_volume / trailing_average_volume,
+            "realized_volatility_pct": realized_volatility,
+            "high": high_in_window,
+            "low": low_in_window,
+            "range_pct": (high_in_window - low_in_window) / previous_close * 100,
+        }
+    return {symbol: {name: float(values[row]) for name, values in analytics.items()}
+            for row, symbol in enumerate(symbols)}
+
+
+def _format_value(value, template):
+    return "n/a" if np.isnan(value) else template.format(value)
+
+
+def format_premarket_analytics(analytics: dict) -> str:
+    return (
+        f"Previous Close (Yesterday): {analytics['first_open']}\n"
+        f"Open Price (Today): {analytics['last_open']}\n"
+        f"Regular Session Close: {_format_value(analytics['previous_close'], '{:.2f}')}\n"
+        f"Latest Extended-Hours Price: {_format_value(analytics['last_price'], '{:.2f}')}\n"
+        f"Gap: {_format_value(analytics['gap_pct'], '{:+.2f}%')}\n"
+        f"Post-Market VWAP: {_format_value(analytics['post_market_vwap'], '{:.2f}')}\n"
+        f"Pre-Market VWAP: {_format_value(analytics['pre_market_vwap'], '{:.2f}')}\n"
+        f"Extended-Hours Volume: {_format_value(analytics['volume'], '{:,.0f}')} "
+        f"({_format_value(analytics['volume_vs_trailing_avg'], '{:.2f}x')} the trailing average)\n"
+        f"Realized Volatility: {_format_value(analytics['realized_volatility_pct'], '{:.2f}%')}\n"
+        f"High/Low Range: {_format_value(analytics['low'], '{:.2f}')} - {_format_value(analytics['high'], '{:.2f}')} "
+        f"({_format_value(analytics['range_pct'], '{:.2f}%')})\n"
+    )
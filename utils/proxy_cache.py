@@ -0,0 +1,97 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+
+from moviepy.config import get_setting
+
+from utils.response_cache import make_cache_key
+from utils.utils import setup_logging
+
+PROXY_CACHE_DIR = "temp/cache/proxies"
+# bump when the transcode settings below change so old proxies are not reused
+PROXY_VERSION = 1
+
+_hash_lock = threading.Lock()
+
+
+def file_hash(path, directory=PROXY_CACHE_DIR):
+    # content hashes are remembered by (size, mtime) so unchanged sources are not re-read on every run
+    stat = os.stat(path)
+    index_path = os.path.join(directory, "source_hashes.json")
+    with _hash_lock:
+        index = {}
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as file:
+                index = json.load(file)
+        entry = index.get(os.path.abspath(path))
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return entry[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        index[os.path.abspath(path)] = [stat.st_size, stat.st_mtime, digest.hexdigest()]
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(index, file)
+        os.replace(temp_path, index_path)
+        return digest.hexdigest()
+
+
+def get_proxy_path(source_path, width, height, fps, directory=PROXY_CACHE_DIR):
+    key = make_cache_key(file_hash(source_path, directory), width, height, fps, PROXY_VERSION)[:16]
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(directory, f"{name}_{width}x{height}_{fps}fps_{key}.mp4")
+
+
+def transcode(source_path, target_path, width, height, fps):
+    # a keyframe every second keeps seeking into the proxy cheap
+    temp_path = f"{target_path}.{os.getpid()}.tmp.mp4"
+    command = [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-i", source_path,
+        "-vf", f"scale={width}:{height},fps={fps}",
+        "-an", "-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-g", str(fps),
+        "-pix_fmt", "yuv420p",
+        temp_path,
+    ]
+    subprocess.run(command, check=True, capture_output=True)
+    os.replace(temp_path, target_path)
+
+
+def ensure_proxy(source_path, width, height, fps, directory=PROXY_CACHE_DIR):
+    proxy_path = get_proxy_path(source_path, width, height, fps, directory)
+    if not os.path.exists(proxy_path):
+        logging.info(f"Transcoding proxy for '{source_path}' at {width}x{height} {fps}fps...")
+        os.makedirs(directory, exist_ok=True)
+        transcode(source_path, proxy_path, width, height, fps)
+    return proxy_path
+
+
+def ingest(source_directory="inputs", width=640, height=480, fps=24, directory=PROXY_CACHE_DIR):
+    proxy_paths = {}
+    for source_path in sorted(glob.glob(os.path.join(source_directory, "*.mp4"))):
+        try:
+            proxy_paths[source_path] = ensure_proxy(source_path, width, height, fps, directory)
+        except Exception as e:
+            print(f"Error transcoding proxy for '{source_path}': {e}")
+    return proxy_paths
+
+
+if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Pre-transcode background videos to render-sized proxies.")
+    parser.add_argument("--inputs", default="inputs")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=int, default=24)
+    args = parser.parse_args()
+    for source, proxy in ingest(args.inputs, args.width, args.height, args.fps).items():
+        print(f"{source} -> {proxy}")
@@ -0,0 +1,51 @@
+import numpy as np
+from PIL import Image
+
+
+class RenderProfile:
+    # fit is 'stretch' (scale the whole background, the original 640x480 look) or 'crop' (center-crop to the
+    # profile's aspect ratio first), captions are laid out on caption_size placed at caption_offset
+    def __init__(self, name, size, fit='stretch', fontsize=70, caption_size=None, caption_offset=(0, 0),
+                 bitrate=None, preset='medium', threads=None, crf=None):
+        self.name = name
+        self.size = size
+        self.fit = fit
+        self.fontsize = fontsize
+        self.caption_size = caption_size or size
+        self.caption_offset = caption_offset
+        self.bitrate = bitrate
+        self.preset = preset
+        self.threads = threads
+        self.crf = crf
+
+    def fit_frame(self, frame):
+        width, height = self.size
+        if self.fit == 'crop':
+            frame_height, frame_width = frame.shape[:2]
+            target_aspect = width / height
+            if frame_width / frame_height > target_aspect:
+                crop_width = round(frame_height * target_aspect)
+                left = (frame_width - crop_width) // 2
+                frame = frame[:, left:left + crop_width]
+            else:
+                crop_height = round(frame_width / target_aspect)
+                top = (frame_height - crop_height) // 2
+                frame = frame[top:top + crop_height]
+        if frame.shape[1] != width or frame.shape[0] != height:
+            frame = np.asarray(Image.fromarray(np.ascontiguousarray(frame)).resize((width, height), Image.BILINEAR))
+        return frame
+
+    def ffmpeg_params(self):
+        params = ["-c:a", "aac", "-shortest"]
+        if self.crf is not None:
+            params += ["-crf", str(self.crf)]
+        return params
+
+
+RENDER_PROFILES = {
+    "landscape": RenderProfile("landscape", (640, 480)),
+    "vertical": RenderProfile("vertical", (1080, 1920), fit='crop', fontsize=110, caption_size=(1080, 640),
+                              caption_offset=(0, 1100), preset='fast', crf=23),
+}
+# background decode size when several profiles share one pass, large enough for the vertical crop
+MASTER_SIZE = (1920, 1080)
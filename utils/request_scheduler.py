@@ -0,0 +1,298 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+import openai
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError
+
+# lower runs first: the final analysis preempts matching, which preempts background article summaries
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+THROTTLING_ERROR_CODES = {'Throttling', 'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailable',
+                          'ServiceFailureException'}
+
+
+class TokenBucket:
+    # refills continuously at per_minute / 60 per second up to one minute of capacity, None means unlimited
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.available = float(per_minute or 0)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        if self.per_minute:
+            self.available = min(self.per_minute, self.available + (now - self.updated_at) * self.per_minute / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        if not self.per_minute:
+            return 0.0
+        missing = min(amount, self.per_minute) - self.available
+        return max(0.0, missing * 60 / self.per_minute)
+
+    def take(self, amount):
+        if self.per_minute:
+            self.available -= min(amount, self.per_minute)
+
+
+def get_retry_after(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    try:
+        return float(headers.get('retry-after')) if headers and headers.get('retry-after') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable_error(error):
+    if isinstance(error, (openai.APIConnectionError, BotocoreConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, ClientError):
+        status_code = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return status_code in RETRYABLE_STATUS_CODES or error.response.get('Error', {}).get('Code') in \
+            THROTTLING_ERROR_CODES
+    return False
+
+
+class SyncWaiter:
+    # a queued thread, woken by whoever changes what the head of the queue can do
+    def __init__(self):
+        self.event = threading.Event()
+
+    def reset(self):
+        self.event.clear()
+
+    def wake(self):
+        self.event.set()
+
+    def wait(self, timeout):
+        self.event.wait(timeout)
+
+
+class AsyncWaiter:
+    # a queued coroutine, it waits on its own event loop so no executor thread is held while it is queued
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = None
+
+    def reset(self):
+        self.future = self.loop.create_future()
+
+    def wake(self):
+        future = self.future
+        if future is not None:
+            self.loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+    async def wait(self, timeout):
+        await asyncio.wait({self.future}, timeout=timeout)
+
+
+class RequestScheduler:
+    # one per provider and process: callers wait in a priority queue (FIFO within a priority) until a
+    # concurrency slot and both the request and token buckets allow them through, throttling and 5xx
+    # responses are retried with jittered exponential backoff
+    def __init__(self, name, requests_per_minute=None, tokens_per_minute=None, max_concurrency=16, max_retries=5,
+                 base_delay=1.0, max_delay=30.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._queue = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_queue_depth = 0
+
+    def _enqueue(self, priority, waiter):
+        entry = (priority, next(self._counter), waiter)
+        with self._lock:
+            heapq.heappush(self._queue, entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        return entry
+
+    def _wake_head(self):
+        if self._queue:
+            self._queue[0][2].wake()
+
+    def _try_admit(self, entry, tokens, enqueued_at):
+        # called with the lock held, only the head of the queue can be admitted, returns (admitted, seconds to
+        # wait before trying again or None to wait for a wake up)
+        if self._queue[0] is not entry or self.in_flight >= self.max_concurrency:
+            return False, None
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        timeout = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+        if timeout > 0:
+            return False, timeout
+        heapq.heappop(self._queue)
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.in_flight += 1
+        waited = now - enqueued_at
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self._wake_head()
+        return True, 0
+
+    def _remove(self, entry):
+        with self._lock:
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._wake_head()
+
+    def acquire(self, priority=PRIORITY_NORMAL, tokens=0):
+        waiter = SyncWaiter()
+        enqueued_at = time.monotonic()
+        entry = self._enqueue(priority, waiter)
+        while True:
+            with self._lock:
+                waiter.reset()
+                admitted, timeout = self._try_admit(entry, tokens, enqueued_at)
+            if admitted:
+                return
+            waiter.wait(timeout)
+
+    async def aacquire(self, priority=PRIORITY_NORMAL, tokens=0):
+        waiter = AsyncWaiter(asyncio.get_running_loop())
+        enqueued_at = time.monotonic()
+        entry = self._enqueue(priority, waiter)
+        try:
+            while True:
+                with self._lock:
+                    waiter.reset()
+                    admitted, timeout = self._try_admit(entry, tokens, enqueued_at)
+                if admitted:
+                    return
+                await waiter.wait(timeout)
+        except BaseException:
+            # a cancelled waiter gives up its place, admission happens without awaiting so it holds no slot
+            self._remove(entry)
+            raise
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self._wake_head()
+
+    def backoff(self, attempt, error):
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _should_retry(self, attempt, error):
+        if attempt < self.max_retries and is_retryable_error(error):
+            with self._lock:
+                self.retries += 1
+            return True
+        with self._lock:
+            self.failures += 1
+        return False
+
+    def call(self, function, *args, priority=PRIORITY_NORMAL, tokens=0, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority, tokens)
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self.backoff(attempt, e)
+                logging.warning(f"{self.name} request failed ({e}), retry {attempt + 1}/{self.max_retries} "
+                                f"in {delay:.1f} seconds")
+            finally:
+                self.release()
+            time.sleep(delay)
+
+    async def acall(self, function, *args, priority=PRIORITY_NORMAL, tokens=0, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self.aacquire(priority, tokens)
+            try:
+                return await function(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self.backoff(attempt, e)
+                logging.warning(f"{self.name} request failed ({e}), retry {attempt + 1}/{self.max_retries} "
+                                f"in {delay:.1f} seconds")
+            finally:
+                self.release()
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            admitted = self.completed + self.in_flight
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "retries": self.retries,
+                "failures": self.failures,
+                "mean_wait": self.total_wait / admitted if admitted else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"{self.name} scheduler: {stats['completed']} requests, {stats['retries']} retries, "
+                     f"{stats['failures']} failures, queue depth {stats['queue_depth']} (max {stats['max_queue_depth']}), "
+                     f"wait {stats['mean_wait']:.2f}s mean / {stats['max_wait']:.2f}s max.")
+
+
+def get_optional_int(name, default):
+    value = os.getenv(name, default)
+    return int(value) if value not in (None, '', '0') else None
+
+
+PROVIDER_DEFAULTS = {
+    # OPEN_AI_RPM / OPEN_AI_TPM / OPEN_AI_MAX_CONCURRENCY and the POLLY_ equivalents override these
+    "open_ai": {"rpm": 500, "tpm": 200000, "concurrency": 16},
+    "polly": {"rpm": 480, "tpm": None, "concurrency": 8},
+}
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider) -> RequestScheduler:
+    with _schedulers_lock:
+        if provider not in _schedulers:
+            defaults = PROVIDER_DEFAULTS[provider]
+            prefix = provider.upper()
+            _schedulers[provider] = RequestScheduler(
+                provider,
+                requests_per_minute=get_optional_int(f"{prefix}_RPM", defaults["rpm"]),
+                tokens_per_minute=get_optional_int(f"{prefix}_TPM", defaults["tpm"]),
+                max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", defaults["concurrency"])),
+                max_retries=int(os.getenv(f"{prefix}_MAX_RETRIES", 5)),
+            )
+        return _schedulers[provider]
+
+
+def log_scheduler_stats():
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    for scheduler in schedulers:
+        scheduler.log_stats()
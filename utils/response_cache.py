@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+DEFAULT_CACHE_PATH = "temp/cache/responses.sqlite"
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 5000
+
+
+def make_cache_key(*parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # sqlite in WAL mode lets several processes read and write the same cache file,
+    # a new connection is opened per operation so the cache can be shared between threads
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            row = connection.execute(
+                "SELECT value FROM responses WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row:
+                connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return row[0] if row else None
+
+    def set(self, key, value):
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        connection.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as connection:
+            entries = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+            }
+
+    def log_stats(self, name="Response cache"):
+        stats = self.stats()
+        logging.info(f"{name}: {stats['hits']} hits, {stats['misses']} misses "
+                     f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries stored.")
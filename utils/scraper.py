@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+
+import httpx
+from playwright.async_api import async_playwright
+
+from utils.text_extraction import extract_main_text
+
+CONSENT_URL = "https://finance.yahoo.com/"
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36")
+MIN_STATIC_TEXT_CHARS = 500
+BODY_TEXT_SCRIPT = "document.body ? document.body.innerText : ''"
+
+
+class ArticleScraper:
+    # one browser and one context shared by a bounded pool of pages, each page is released as soon as
+    # its text stops changing instead of after a fixed sleep
+    def __init__(self, max_pages=4, url_timeout=15.0, poll_interval=0.5, stable_polls=2,
+                 consent_url=CONSENT_URL, headless=True):
+        self.max_pages = max_pages
+        self.url_timeout = url_timeout
+        self.poll_interval = poll_interval
+        self.stable_polls = stable_polls
+        self.consent_url = consent_url
+        self.headless = headless
+        self.timings = {}
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._pages = None
+        self._start_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        async with self._start_lock:
+            if self._browser:
+                return
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=self.headless)
+            self._context = await self._browser.new_context()
+            self._pages = asyncio.Queue()
+            for _ in range(self.max_pages):
+                self._pages.put_nowait(await self._context.new_page())
+            if self.consent_url:
+                await self._accept_consent()
+
+    async def close(self):
+        if self._browser:
+            await self._browser.close()
+        if self._playwright:
+            await self._playwright.stop()
+        self._browser = None
+        self._playwright = None
+        self._context = None
+        self._pages = None
+
+    async def _accept_consent(self):
+        page = await self._pages.get()
+        try:
+            await page.goto(self.consent_url, wait_until="domcontentloaded", timeout=self.url_timeout * 1000)
+            await page.click("button#scroll-down-btn", timeout=3000)
+            await page.click("button.btn.secondary.reject-all", timeout=3000)
+        except Exception as e:
+            print(f"No consent buttons found or error clicking: {e}")
+        finally:
+            self._pages.put_nowait(page)
+
+    async def _wait_for_stable_text(self, page, deadline):
+        text = ""
+        stable_count = 0
+        while True:
+            current_text = await page.evaluate(BODY_TEXT_SCRIPT)
+            if current_text and current_text == text:
+                stable_count += 1
+                if stable_count >= self.stable_polls:
+                    return text
+            else:
+                stable_count = 0
+            text = current_text
+            if time.monotonic() + self.poll_interval > deadline:
+                return text
+            await asyncio.sleep(self.poll_interval)
+
+    async def fetch(self, url):
+        page = await self._pages.get()
+        start_time = time.monotonic()
+        deadline = start_time + self.url_timeout
+        try:
+            await page.goto(url, wait_until="domcontentloaded", timeout=self.url_timeout * 1000)
+            text = await self._wait_for_stable_text(page, deadline)
+            if not text:
+                text = "Error: Body element is not present on the page."
+        except Exception as e:
+            print(f"Error fetching text from URL {url}: {e}")
+            text = None
+        finally:
+            self._pages.put_nowait(page)
+        self.timings[url] = time.monotonic() - start_time
+        logging.info(f"Fetched {url} in {self.timings[url]:.2f} seconds.")
+        return text
+
+    async def fetch_all(self, urls):
+        urls = list(urls)
+        texts = await asyncio.gather(*(self.fetch(url) for url in urls))
+        return dict(zip(urls, texts))
+
+
+class TieredArticleFetcher:
+    # static HTTP fetch plus local main-content extraction first, the headless browser only for
+    # the URLs whose static text came back too short (client-side rendered pages, consent walls)
+    def __init__(self, max_connections=10, timeout=10.0, min_text_chars=MIN_STATIC_TEXT_CHARS, scraper=None):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.min_text_chars = min_text_chars
+        self.timings = {}
+        self._client = None
+        self._scraper = scraper
+        self._owns_scraper = scraper is None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        if self._client:
+            return
+        self._client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            timeout=self.timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+        )
+
+    async def close(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+        if self._scraper and self._owns_scraper:
+            await self._scraper.close()
+            self._scraper = None
+
+    async def fetch_static(self, url):
+        start_time = time.monotonic()
+        try:
+            response = await self._client.get(url)
+            response.raise_for_status()
+            text = extract_main_text(response.text)
+        except Exception as e:
+            print(f"Static fetch failed for URL {url}: {e}")
+            text = None
+        self.timings[url] = time.monotonic() - start_time
+        return text
+
+    async def fetch_all(self, urls):
+        await self.start()
+        urls = list(urls)
+        texts = await asyncio.gather(*(self.fetch_static(url) for url in urls))
+        text_by_link = dict(zip(urls, texts))
+
+        fallback_urls = [url for url, text in text_by_link.items() if not text or len(text) < self.min_text_chars]
+        logging.info(f"Static fetch extracted {len(urls) - len(fallback_urls)}/{len(urls)} articles, "
+                     f"{len(fallback_urls)} fall back to the browser.")
+        if fallback_urls:
+            # several tickers can share this fetcher concurrently, the browser is still started only once
+            if self._scraper is None:
+                self._scraper = ArticleScraper()
+            await self._scraper.start()
+            browser_text_by_link = await self._scraper.fetch_all(fallback_urls)
+            for url in fallback_urls:
+                browser_text = browser_text_by_link.get(url)
+                static_text = text_by_link.get(url)
+                if browser_text and len(browser_text) > len(static_text or ""):
+                    text_by_link[url] = browser_text
+                self.timings[url] += self._scraper.timings.get(url, 0)
+
+        return text_by_link
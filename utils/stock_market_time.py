@@ -45,4 +45,51 @@ def format_time_difference(delta):
     total_seconds = delta.total_seconds()
     hours, remainder = divmod(total_seconds, 3600)
     minutes = remainder // 60
-    return int(hours), int(minutes)
\ No newline at end of file
+    return int(hours), int(minutes)
+
+def easter_sunday(year):
+    # anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 19 * l) // 433
+    month, day = divmod(h + l - 7 * m + 90, 25)
+    return datetime.date(year, month, (h + l - 7 * m + 33 * month + 19) % 32)
+
+
+def nth_weekday(year, month, weekday, n):
+    # n-th given weekday (Monday is 0) of the month, n=-1 is the last one
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def observed(date):
+    # a holiday on a Saturday is observed on the Friday before, on a Sunday on the Monday after
+    if date.weekday() == 5:
+        return date - datetime.timedelta(days=1)
+    if date.weekday() == 6:
+        return date + datetime.timedelta(days=1)
+    return date
+
+
+def market_holidays(year):
+    # NYSE full-day closures, New Year's Day falling on a Saturday is not observed on the Friday before
+    holidays = {nth_weekday(year, 1, 0, 3), nth_weekday(year, 2, 0, 3),
+                easter_sunday(year) - datetime.timedelta(days=2), nth_weekday(year, 5, 0, -1),
+                observed(datetime.date(year, 7, 4)), nth_weekday(year, 9, 0, 1), nth_weekday(year, 11, 3, 4),
+                observed(datetime.date(year, 12, 25))}
+    if datetime.date(year, 1, 1).weekday() != 5:
+        holidays.add(observed(datetime.date(year, 1, 1)))
+    if year >= 2022:
+        holidays.add(observed(datetime.date(year, 6, 19)))
+    return holidays
+
+
+def is_trading_day(date):
+    return date.weekday() < 5 and date not in market_holidays(date.year)
@@ -0,0 +1,68 @@
+import re
+
+from bs4 import BeautifulSoup
+
+CHARS_PER_TOKEN = 4
+NOISE_TAGS = ["script", "style", "noscript", "nav", "header", "footer", "aside", "form", "iframe", "svg", "button"]
+# whole tokens of class, id and role values only (split on whitespace, "-" and "_"), so "share-bar" is noise
+# but "shareholder-letter", "canvas" and "commentary" are not
+NOISE_PATTERN = re.compile(
+    r"(?:^|[\s_-])(?:cookie|consent|banner|related|recommend|newsletter|subscribe|share|social|promo|ad|advert|"
+    r"sponsor|sidebar|footer|header|menu|nav|comment|popup|modal|trending)s?(?=$|[\s_-])",
+    re.IGNORECASE
+)
+MIN_PARAGRAPH_CHARS = 40
+
+
+def _is_noise(tag):
+    if tag.attrs is None:
+        return False
+    attributes = " ".join(tag.get("class", [])) + " " + (tag.get("id") or "") + " " + (tag.get("role") or "")
+    return bool(NOISE_PATTERN.search(attributes))
+
+
+def extract_main_text(html) -> str:
+    soup = BeautifulSoup(html, "lxml")
+    for tag in soup(NOISE_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(_is_noise):
+        if tag.name not in ("html", "body", "article", "main"):
+            tag.decompose()
+
+    # each paragraph votes for its parent and, with half the weight, its grandparent,
+    # the container with the most paragraph text is taken as the main content
+    scores = {}
+    for paragraph in soup.find_all("p"):
+        length = len(paragraph.get_text(" ", strip=True))
+        if length < MIN_PARAGRAPH_CHARS:
+            continue
+        for container, weight in ((paragraph.parent, 1.0), (paragraph.parent and paragraph.parent.parent, 0.5)):
+            if container is None:
+                continue
+            entry = scores.setdefault(id(container), [container, 0.0])
+            entry[1] += length * weight
+    best_container = max(scores.values(), key=lambda entry: entry[1])[0] if scores else None
+
+    root = best_container or soup.body or soup
+    paragraphs = [p.get_text(" ", strip=True) for p in root.find_all(["h1", "h2", "h3", "p", "li"])]
+    paragraphs = [p for p in paragraphs if len(p) >= MIN_PARAGRAPH_CHARS or p.endswith((".", "!", "?"))]
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    text = "\n\n".join(paragraphs)
+    return f"{title}\n\n{text}".strip() if title and title not in text else text
+
+
+def estimate_tokens(text) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1 if text else 0
+
+
+def truncate_to_token_budget(text, max_tokens) -> str:
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    truncated = text[:max_chars]
+    # prefer cutting at a paragraph, then a sentence boundary, as long as that keeps most of the budget
+    for boundary in ("\n\n", ". ", "\n"):
+        cut = truncated.rfind(boundary)
+        if cut > max_chars * 0.7:
+            return truncated[:cut + len(boundary)].strip()
+    return truncated.strip()
@@ -1,58 +1,16 @@
 import os
 import logging
 import random
-import time
-
-from playwright.async_api import async_playwright
 
 from inputs.video_map import VIDEO_DESCRIPTION_MAP
+from utils.scraper import TieredArticleFetcher
 
 
-async def open_finance_yahoo(p):
-    base_url = "https://finance.yahoo.com/"
-    browser = await p.chromium.launch(headless=True)
-    page = await browser.new_page()
-    await page.goto(base_url)
-    await page.wait_for_timeout(10000)
-    try:
-        time.sleep(0.2)
-        await page.click("button#scroll-down-btn")
-        await page.click("button.btn.secondary.reject-all")
-    except Exception as e:
-        print(f"No consent buttons found or error clicking: {e}")
-    return browser, page
-
-
-async def get_text_from_url(url, page):
-    try:
-        await page.goto(url)
-        await page.wait_for_timeout(10000)
-        body_handle = await page.query_selector("body")
-        if body_handle:
-            text_raw = await page.evaluate("document.body.innerText")
-        else:
-            text_raw = "Error: Body element is not present on the page."
-        return text_raw
-    except Exception as e:
-        print(f"Error fetching text from URL {url}: {e}")
-        return None
-
-
-async def get_text_by_url(urls):
-    text_by_link = {}
-    time.sleep(0.2)
-    async with async_playwright() as p:
-        browser, page = await open_finance_yahoo(p)
-        if not browser or not page:
-            print("Failed to open browser or page.")
-            return text_by_link
-        try:
-            for url in urls:
-                text = await get_text_from_url(url, page)
-                text_by_link[url] = text
-            return text_by_link
-        finally:
-            await browser.close()
+async def get_text_by_url(urls, fetcher=None):
+    if fetcher:
+        return await fetcher.fetch_all(urls)
+    async with TieredArticleFetcher() as fetcher:
+        return await fetcher.fetch_all(urls)
 
 
 def save_to_temp_file(text, name):
@@ -79,6 +37,10 @@ def read_temp_file(file_name):
     return None
 
 
+def clean_text(text):
+    return text.replace("*", "").replace('"', "'")
+
+
 def setup_logging():
     logging.basicConfig(
         level=logging.INFO,
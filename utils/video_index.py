@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import zlib
+
+import numpy as np
+
+from inputs.video_map import VIDEO_DESCRIPTION_MAP
+
+INDEX_PATH = "temp/cache/video_index.npz"
+N_FEATURES = 2 ** 14
+CHAR_NGRAM_SIZE = 4
+
+_index = None
+
+
+def _tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _features(text):
+    words = _tokenize(text)
+    features = [f"w:{word}" for word in words]
+    features += [f"b:{a}_{b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f" {word} "
+        features += [f"c:{padded[i:i + CHAR_NGRAM_SIZE]}" for i in range(max(len(padded) - CHAR_NGRAM_SIZE + 1, 1))]
+    return features
+
+
+def _hashed_counts(texts):
+    # crc32 instead of hash() so the feature columns are stable across processes and runs
+    counts = np.zeros((len(texts), N_FEATURES), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            counts[row, zlib.crc32(feature.encode("utf-8")) % N_FEATURES] += 1
+    return counts
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def get_map_hash(video_description_map):
+    payload = json.dumps(sorted(video_description_map.items()))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class VideoIndex:
+    def __init__(self, video_names, idf, matrix, map_hash):
+        self.video_names = video_names
+        self.idf = idf
+        self.matrix = matrix
+        self.map_hash = map_hash
+
+    @classmethod
+    def build(cls, video_description_map):
+        descriptions = list(video_description_map.keys())
+        counts = _hashed_counts(descriptions)
+        document_frequency = np.count_nonzero(counts, axis=0)
+        idf = (np.log((1 + len(descriptions)) / (1 + document_frequency)) + 1).astype(np.float32)
+        matrix = _normalize(np.log1p(counts) * idf)
+        return cls(list(video_description_map.values()), idf, matrix, get_map_hash(video_description_map))
+
+    def save(self, path=INDEX_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, video_names=np.array(self.video_names), idf=self.idf, matrix=self.matrix,
+                 map_hash=np.array(self.map_hash))
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        with np.load(path) as data:
+            return cls(data["video_names"].tolist(), data["idf"], data["matrix"], str(data["map_hash"]))
+
+    def match(self, sentences):
+        queries = _normalize(np.log1p(_hashed_counts(sentences)) * self.idf)
+        scores = queries @ self.matrix.T
+        best = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(sentences)), best]
+        return [self.video_names[i] for i in best], confidences.tolist()
+
+
+def get_video_index(video_description_map=VIDEO_DESCRIPTION_MAP, path=INDEX_PATH) -> VideoIndex:
+    global _index
+    map_hash = get_map_hash(video_description_map)
+    if _index is not None and _index.map_hash == map_hash:
+        return _index
+
+    index = None
+    if os.path.exists(path):
+        try:
+            index = VideoIndex.load(path)
+        except Exception as e:
+            print(f"Error loading video index '{path}': {e}")
+    if index is None or index.map_hash != map_hash:
+        logging.info("Building video description index...")
+        index = VideoIndex.build(video_description_map)
+        index.save(path)
+
+    _index = index
+    return _index
@@ -1,9 +1,42 @@
+import logging
+import os
 import random
-from moviepy.editor import AudioFileClip, VideoFileClip, TextClip, concatenate_videoclips, CompositeVideoClip
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from moviepy.editor import AudioFileClip, ImageClip, ColorClip, CompositeVideoClip
+from moviepy.audio.AudioClip import AudioArrayClip
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+from utils.background_sources import BackgroundSourceManager, BackgroundTrack
+from utils.caption_cache import get_caption_cache
+from utils.caption_track import CaptionTrack
+from utils.ffmpeg_render import concat_chunks, render_with_ffmpeg
+from utils.render_profiles import MASTER_SIZE, RENDER_PROFILES
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
 
+VIDEO_SIZE = (640, 480)
+VIDEO_FPS = 24
+CAPTION_MODES = ("track", "layers")
+RENDER_BACKENDS = ("moviepy", "ffmpeg", "chunked")
 
-def load_audio(audio_path):
-    return AudioFileClip(audio_path)
+
+def load_audio(audio_path, audio_segment=None):
+    if audio_segment is None:
+        return AudioFileClip(audio_path)
+    # the PCM decoded during synthesis becomes the soundtrack, the mp3 is not decoded a second time
+    samples = np.array(audio_segment.get_array_of_samples(), dtype=np.float32).reshape(-1, audio_segment.channels)
+    samples /= float(1 << (8 * audio_segment.sample_width - 1))
+    if samples.shape[1] == 1:
+        # moviepy writes mono array clips at the wrong length, AudioFileClip always reads stereo anyway
+        samples = np.repeat(samples, 2, axis=1)
+    return AudioArrayClip(samples, fps=audio_segment.frame_rate)
+
+
+def get_audio_duration(audio_path, audio_segment=None):
+    if audio_segment is not None:
+        return audio_segment.duration_seconds
+    return ffmpeg_parse_infos(audio_path)['duration']
 
 
 def match_text_part_to_sentence(text_part, sentences_timings):
@@ -24,12 +57,26 @@ def match_text_part_to_sentence(text_part, sentences_timings):
     return sentence, next_sentence
 
 
-def load_background_clips(background_videos, total_audio_duration, sentences_list_with_timings):
+def load_background_clips(background_videos, total_audio_duration, sentences_list_with_timings, size=VIDEO_SIZE,
+                          window_start=0.0, window_end=None):
     if background_videos is None:
-        return None, []  # Return an empty list for bg_videos
+        return None, None  # No background, nothing to close
+
+    manager = BackgroundSourceManager(size=size, fps=VIDEO_FPS)
+    segments = plan_background_segments(manager, total_audio_duration, sentences_list_with_timings)
+    if not segments:
+        return None, manager
+    try:
+        return BackgroundTrack(segments, manager, window_start, window_end), manager
+    except Exception as e:
+        print(f"Error creating background track: {e}")
+        manager.close_all()
+        return None, None
 
-    background_clips = []
-    bg_videos = []  # List to keep references to bg_video instances
+
+def plan_background_segments(manager, total_audio_duration, sentences_list_with_timings):
+    # returns (file name, timeline start, duration) for each background segment in timeline order
+    segments = []
     current_duration = 0
 
     # Iterate over each text segment and its corresponding video from the map
@@ -39,82 +86,51 @@ def load_background_clips(background_videos, total_audio_duration, sentences_lis
         if current_duration >= total_audio_duration:
             break
 
-        # Use the specific video file for the text segment
+        # Use the specific video file for the text segment, it is only opened when its segment is rendered
         file_name = f"inputs/{video_name}"
-        # print(f"Attempting to load video: {file_name}")
         try:
-            bg_video = VideoFileClip(file_name)
-            bg_videos.append(bg_video)  # Keep a reference to prevent premature closing
+            video_duration = manager.duration(file_name)
         except Exception as e:
             print(f"Error loading video '{file_name}': {e}")
             continue
 
-        if bg_video.reader is None:
-            print(f"Video reader is None for video '{file_name}'. Skipping.")
-            continue
-
-        if sentence is None:
-            print(f"Could not find a matching sentence for text part: {text_part}")
-            continue  # Do not close bg_video here
-
         start_time_in_seconds = sentence['start']/1000
         end_time_in_seconds = sentence['end']/1000
         clip_duration = end_time_in_seconds - start_time_in_seconds
 
-        video_duration = bg_video.duration
-
         if clip_duration > video_duration:
             print(f"Clip duration is greater than video duration for video '{file_name}'")
             clip_duration = video_duration
 
         if clip_duration <= 0:
             print(f"Clip duration is non-positive after adjustments for text part: {text_part}")
-            continue  # Do not close bg_video here
+            continue
 
-        # Create the subclip with adjusted timings
-        bg_clip = bg_video.subclip(0, clip_duration)
-        bg_clip = bg_clip.resize((640, 480))
-        background_clips.append(bg_clip)
+        segments.append((file_name, current_duration, clip_duration))
         current_duration += clip_duration
-        # Do not close bg_video here; it is needed by bg_clip
 
     # Repeat background video to fill remaining duration
     while current_duration < total_audio_duration:
         file_name = f"inputs/Interactive_Trading_Screen.mp4"
-        print(f"Attempting to load video: {file_name}")
         try:
-            bg_video = VideoFileClip(file_name)
-            bg_videos.append(bg_video)  # Keep a reference to prevent premature closing
+            video_duration = manager.duration(file_name)
         except Exception as e:
             print(f"Error loading video '{file_name}': {e}")
             break
 
-        if bg_video.reader is None:
-            print(f"Video reader is None for video '{file_name}'. Exiting loop.")
+        if not video_duration:
+            print(f"Video duration is unknown for video '{file_name}'. Exiting loop.")
             break
 
-        clip_duration = min(bg_video.duration, total_audio_duration - current_duration)
-        bg_clip = bg_video.subclip(0, clip_duration)
-        bg_clip = bg_clip.resize((640, 480))
-        background_clips.append(bg_clip)
+        clip_duration = min(video_duration, total_audio_duration - current_duration)
+        segments.append((file_name, current_duration, clip_duration))
         current_duration += clip_duration
-        # Do not close bg_video here; it is needed by bg_clip
 
-    if background_clips:
-        try:
-            concatenated_background = concatenate_videoclips(background_clips)
-        except Exception as e:
-            print(f"Error concatenating video clips: {e}")
-            # Do not close bg_videos here
-            return None, bg_videos  # Return bg_videos
-        # Do not close bg_videos yet
-        return concatenated_background, bg_videos
-    else:
-        # Do not close bg_videos yet
-        return None, bg_videos
+    return segments
 
 
 def generate_text_clips(sentences_list_with_timings):
+    caption_cache = get_caption_cache()
     clips = []
     for sentence in sentences_list_with_timings:
         for timing in sentence['words_in_sentence']:
@@ -122,33 +138,195 @@ def generate_text_clips(sentences_list_with_timings):
             start_time_in_seconds = timing['start']/1000
             end_time_in_seconds = timing['end']/1000
             duration = end_time_in_seconds - start_time_in_seconds
-            text_clip = TextClip(word, fontsize=70, color='white', size=(640, 480), method='caption', font='Arial')
+            rgba, position = caption_cache.get(word, font='Arial', fontsize=70, color='white', size=VIDEO_SIZE)
+            text_clip = ImageClip(rgba[..., :3]).set_mask(ImageClip(rgba[..., 3] / 255.0, ismask=True))
             text_clip = (text_clip.set_start(start_time_in_seconds)
                          .set_duration(duration)
-                         .set_pos('center'))
+                         .set_pos(position))
             clips.append(text_clip)
     return clips
 
 
-def create_video(audio_path, video_path, sentences_list_with_timings, background_videos):
-    audio = load_audio(audio_path)
-    total_audio_duration = audio.duration
+def window_sentences(sentences_list_with_timings, window_start, window_end=None):
+    # the words overlapping [window_start, window_end) in seconds, with timings relative to window_start
+    offset_ms = window_start * 1000
+    end_ms = float('inf') if window_end is None else window_end * 1000
+    sentences = []
+    for sentence in sentences_list_with_timings:
+        words = [dict(timing, start=timing['start'] - offset_ms, end=timing['end'] - offset_ms)
+                 for timing in sentence['words_in_sentence'] if timing['end'] > offset_ms and timing['start'] < end_ms]
+        if words:
+            sentences.append(dict(sentence, start=sentence['start'] - offset_ms, end=sentence['end'] - offset_ms,
+                                  words_in_sentence=words))
+    return sentences
+
+
+def build_video_clip(total_audio_duration, sentences_list_with_timings, background_videos, caption_mode="track",
+                     window_start=0.0, window_end=None):
+    # the background is planned over the whole timeline, but only the part in [window_start, window_end) is
+    # opened and captioned, the returned clip starts at window_start
+    background, background_sources = load_background_clips(background_videos=background_videos,
+                                                           total_audio_duration=total_audio_duration,
+                                                           sentences_list_with_timings=sentences_list_with_timings,
+                                                           window_start=window_start, window_end=window_end)
+    caption_sentences = sentences_list_with_timings
+    if window_start or window_end is not None:
+        caption_sentences = window_sentences(sentences_list_with_timings, window_start, window_end)
+
+    if caption_mode == "track":
+        duration = (total_audio_duration if window_end is None else window_end) - window_start
+        background = background or ColorClip(VIDEO_SIZE, color=(0, 0, 0), duration=duration)
+        video = CaptionTrack(caption_sentences, size=VIDEO_SIZE).apply(background)
+    else:
+        clips = generate_text_clips(caption_sentences)
+        video = CompositeVideoClip([background] + clips) if background else CompositeVideoClip(clips, size=VIDEO_SIZE)
+        if window_end is not None and video.duration > window_end - window_start:
+            # a word running past the window would otherwise lengthen the chunk
+            video = video.set_duration(window_end - window_start)
+    return video, background_sources
 
-    background, bg_videos = load_background_clips(background_videos=background_videos,
-                                                  total_audio_duration=total_audio_duration,
-                                                  sentences_list_with_timings=sentences_list_with_timings)
 
-    clips = generate_text_clips(sentences_list_with_timings)
+def create_video(audio_path, video_path, sentences_list_with_timings, background_videos, caption_mode="track",
+                 backend="moviepy", workers=None, profiles=None, audio_segment=None):
+    if profiles:
+        # several output formats share one decode/composite pass, written next to video_path
+        if backend != "moviepy" or workers or caption_mode != "track":
+            raise ValueError(f"Render profiles have their own single-pass renderer, they cannot be combined with "
+                             f"backend '{backend}', workers {workers} or caption mode '{caption_mode}'")
+        return create_video_renditions(audio_path, video_path, sentences_list_with_timings, background_videos,
+                                       profiles, audio_segment)
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"Unknown render backend '{backend}', expected one of {RENDER_BACKENDS}")
+    if caption_mode not in CAPTION_MODES:
+        raise ValueError(f"Unknown caption mode '{caption_mode}', expected one of {CAPTION_MODES}")
+    if backend == "ffmpeg":
+        return create_video_with_ffmpeg(audio_path, video_path, sentences_list_with_timings, background_videos,
+                                        audio_segment)
+    if backend == "chunked":
+        return create_video_chunked(audio_path, video_path, sentences_list_with_timings, background_videos,
+                                    caption_mode, workers, audio_segment)
+    audio = load_audio(audio_path, audio_segment)
+    total_audio_duration = audio.duration
 
-    video = CompositeVideoClip([background] + clips) if background else CompositeVideoClip(clips)
+    video, background_sources = build_video_clip(total_audio_duration, sentences_list_with_timings,
+                                                 background_videos, caption_mode)
     video = video.set_audio(audio)
-    video.write_videofile(video_path, fps=24, audio_codec='aac')
+    video.write_videofile(video_path, fps=VIDEO_FPS, audio_codec='aac', audio_fps=audio.fps)
 
     # Close resources
     video.close()
     audio.close()
-    for bg_video in bg_videos:
-        bg_video.close()
+    if background_sources:
+        background_sources.close_all()
+
+
+def get_render_profiles(profile_names):
+    unknown = [name for name in profile_names if name not in RENDER_PROFILES]
+    if unknown:
+        raise ValueError(f"Unknown render profiles {unknown}, expected some of {tuple(RENDER_PROFILES)}")
+    return [RENDER_PROFILES[name] for name in profile_names]
+
+
+def get_rendition_path(video_path, profile):
+    root, extension = os.path.splitext(video_path)
+    return f"{root}_{profile.name}{extension or '.mp4'}"
+
+
+def create_video_renditions(audio_path, video_path, sentences_list_with_timings, background_videos,
+                            profile_names=("landscape", "vertical"), audio_segment=None):
+    # the background is decoded once per frame at the master size, then every profile crops/scales it,
+    # blends its own caption layout and feeds its own encoder, instead of one full render per output
+    profiles = get_render_profiles(profile_names)
+    sizes = {profile.size for profile in profiles}
+    master_size = profiles[0].size if len(sizes) == 1 and profiles[0].fit == 'stretch' else MASTER_SIZE
+    total_audio_duration = get_audio_duration(audio_path, audio_segment)
+
+    background, background_sources = load_background_clips(background_videos, total_audio_duration,
+                                                           sentences_list_with_timings, size=master_size)
+    background = background or ColorClip(master_size, color=(0, 0, 0), duration=total_audio_duration)
+    caption_tracks = [CaptionTrack(sentences_list_with_timings, size=profile.caption_size, fontsize=profile.fontsize,
+                                   offset=profile.caption_offset) for profile in profiles]
+    rendition_paths = {profile.name: get_rendition_path(video_path, profile) for profile in profiles}
+    writers = []
+    try:
+        for profile in profiles:
+            writers.append(FFMPEG_VideoWriter(rendition_paths[profile.name], profile.size, VIDEO_FPS,
+                                              codec='libx264', audiofile=audio_path, preset=profile.preset,
+                                              bitrate=profile.bitrate, threads=profile.threads,
+                                              ffmpeg_params=profile.ffmpeg_params()))
+        for t in np.arange(0, background.duration, 1.0 / VIDEO_FPS):
+            frame = background.get_frame(t)
+            for profile, caption_track, writer in zip(profiles, caption_tracks, writers):
+                writer.write_frame(caption_track.blend(profile.fit_frame(frame), t))
+    finally:
+        for writer in writers:
+            writer.close()
+        background.close()
+        if background_sources:
+            background_sources.close_all()
+    logging.info(f"Rendered {len(profiles)} renditions: {', '.join(rendition_paths.values())}")
+    return rendition_paths
+
+
+def split_timeline(sentences_list_with_timings, chunks):
+    # chunk boundaries fall on sentence starts, snapped to the frame grid, balanced by duration
+    sentence_starts = sorted(sentence['start'] / 1000 for sentence in sentences_list_with_timings)[1:]
+    if not sentence_starts or chunks <= 1:
+        return [0.0]
+    total_duration = max(sentence['end'] for sentence in sentences_list_with_timings) / 1000
+    boundaries = [0.0]
+    for start in sentence_starts:
+        if start - boundaries[-1] >= total_duration / chunks and len(boundaries) < chunks:
+            boundaries.append(round(start * VIDEO_FPS) / VIDEO_FPS)
+    return boundaries
+
+
+def render_chunk(chunk_path, start, end, total_audio_duration, sentences_list_with_timings, background_videos,
+                 caption_mode="track"):
+    # the clip covers only [start, end), so this worker opens and captions just the segments inside it
+    video, background_sources = build_video_clip(total_audio_duration, sentences_list_with_timings,
+                                                 background_videos, caption_mode, start, end)
+    try:
+        video.write_videofile(chunk_path, fps=VIDEO_FPS, codec='libx264', audio=False, logger=None)
+    finally:
+        video.close()
+        if background_sources:
+            background_sources.close_all()
+    return chunk_path
+
+
+def create_video_chunked(audio_path, video_path, sentences_list_with_timings, background_videos,
+                         caption_mode="track", workers=None, audio_segment=None):
+    workers = workers or os.cpu_count()
+    total_audio_duration = get_audio_duration(audio_path, audio_segment)
+    boundaries = split_timeline(sentences_list_with_timings, workers)
+    chunk_directory = tempfile.mkdtemp(prefix="chunks_", dir=os.path.dirname(video_path) or ".")
+    try:
+        chunk_paths = [os.path.join(chunk_directory, f"chunk_{i:03d}.mp4") for i in range(len(boundaries))]
+        ends = boundaries[1:] + [None]
+        with ProcessPoolExecutor(max_workers=min(workers, len(boundaries))) as executor:
+            futures = [executor.submit(render_chunk, chunk_path, start, end, total_audio_duration,
+                                       sentences_list_with_timings, background_videos, caption_mode)
+                       for chunk_path, start, end in zip(chunk_paths, boundaries, ends)]
+            chunk_paths = [future.result() for future in futures]
+        concat_chunks(chunk_paths, audio_path, video_path)
+    finally:
+        shutil.rmtree(chunk_directory, ignore_errors=True)
+    return video_path
+
+
+def create_video_with_ffmpeg(audio_path, video_path, sentences_list_with_timings, background_videos,
+                             audio_segment=None):
+    total_audio_duration = get_audio_duration(audio_path, audio_segment)
+    segments = []
+    if background_videos is not None:
+        manager = BackgroundSourceManager(size=VIDEO_SIZE, fps=VIDEO_FPS)
+        segments = [(manager.resolve(file_name), start, duration) for file_name, start, duration in
+                    plan_background_segments(manager, total_audio_duration, sentences_list_with_timings)]
+    # same timeline length as the moviepy path: the background track when there is one, the audio otherwise
+    duration = segments[-1][1] + segments[-1][2] if segments else total_audio_duration
+    render_with_ffmpeg(audio_path, video_path, segments, sentences_list_with_timings, duration,
+                       size=VIDEO_SIZE, fps=VIDEO_FPS)
 
 # def get_random_clip_timing(bg_video, remaining_duration):
 #     min_clip_duration = 3